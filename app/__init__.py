@@ -8,12 +8,13 @@ from logging.handlers import RotatingFileHandler
 
 from app.utils.db import Mongo
 from app.utils.dummy_data import create_dummy_data
+from app.ml.feature_versions import FEATURE_UPDATED_AT_FIELD
 
 mail = Mail()
 mongo = Mongo()
 celery_app = Celery('edflow_tasks')
 
-def create_app():
+def create_app(warm_up_models=True):
     app = Flask(__name__)
     app.config.from_object("config.Config")
 
@@ -58,7 +59,8 @@ def create_app():
 
         required_collections = [
             "users", "students", "teachers", "courses", "alerts",
-            "feedbacks", "contacts", "otp_codes", "lms_logs","trained_models","uploaded_datasets","login_logs"
+            "feedbacks", "contacts", "otp_codes", "lms_logs","trained_models","uploaded_datasets","login_logs",
+            "prediction_jobs","training_jobs"
         ]
         existing_collections = db.list_collection_names()
         for col_name in required_collections:
@@ -79,6 +81,20 @@ def create_app():
             except Exception as e:
                 app.logger.error(f"Failed to ensure TTL index on otp_codes: {e}")
 
+        try:
+            # Feature store refreshes read the students written since their last version.
+            db.students.create_index(FEATURE_UPDATED_AT_FIELD)
+        except Exception as e:
+            app.logger.error(f"Failed to ensure index on 'students.{FEATURE_UPDATED_AT_FIELD}': {e}")
+
+        try:
+            # One active upload-and-train job per dataset; ended jobs set the field to None and drop out of the index.
+            from app.ml.training_jobs import ACTIVE_DATASET_FIELD
+            db.training_jobs.create_index(ACTIVE_DATASET_FIELD, unique=True,
+                                          partialFilterExpression={ACTIVE_DATASET_FIELD: {'$type': 'string'}})
+        except Exception as e:
+            app.logger.error(f"Failed to ensure unique index on 'training_jobs.active_dataset': {e}")
+
         create_dummy_data(db)
     #-------------------------
     # Importing Blueprints -
@@ -117,5 +133,11 @@ def create_app():
             return render_template("dashboard/error_500.html"), 500
         else:
             return render_template("i_interface/error_500.html"), 500
-        
+
+    # Preload the active models so the first requests on this worker are not cold.
+    # Celery workers warm up in each pool process instead (see celery_worker.py).
+    if warm_up_models:
+        from app.ml.warmup import start_warm_up
+        start_warm_up(app)
+
     return app
\ No newline at end of file
@@ -6,6 +6,7 @@ import pandas as pd
 import numpy as np
 from sklearn.ensemble import IsolationForest
 from app import mongo
+from app.ml.feature_store import FEATURE_COLUMNS, load_features
 
 # MongoDB database instance
 db = mongo.db
@@ -59,32 +60,32 @@ def get_insights(df_anomalies):
 
 def detect_anomalies_from_db():
     """
-    Fetches student data from MongoDB, detects anomalies, and returns the results.
+    Reads the students' ML features from the feature store, detects anomalies, and returns the results.
     """
-    students_collection = db.students
-    
     try:
-        data = list(students_collection.find())
-        if not data:
+        df, _ = load_features(db, ['_id', 'student_id', 'studentID', 'name', *FEATURE_COLUMNS])
+        if df.empty:
             return [], {}, 0
-        
-        df = pd.DataFrame(data)
-        
-        if '_id' in df.columns:
-            df = df.drop(columns=['_id'])
 
-        if 'student_name' not in df.columns:
-            df['student_name'] = df.get('name', 'N/A')
-        if 'studentID' not in df.columns:
-            df['studentID'] = df.get('student_id', 'N/A')
-        
-        df_anomalies, _ = run_isolation_forest(df)
-
-        anomalous_df = df_anomalies[df_anomalies['is_anomaly'] == -1].copy()
+        # Columns nobody filled in carry no signal and would leave NaNs after the median fill.
+        features = df[FEATURE_COLUMNS].dropna(axis=1, how='all')
+        df_anomalies, _ = run_isolation_forest(features.copy())
 
+        anomalous = (df_anomalies['is_anomaly'] == -1).to_numpy()
+        anomalous_df = df_anomalies[anomalous].copy()
         anomaly_insights = get_insights(anomalous_df)
-        
-        anomalous_students = anomalous_df.to_dict('records')
+
+        identities = df[anomalous]
+        ml_features = features[anomalous].astype(object).where(features[anomalous].notna(), None)
+        anomalous_students = [{
+            'student_id': identity['student_id'] if pd.notna(identity['student_id']) else identity['_id'],
+            'studentID': identity['studentID'] if pd.notna(identity['studentID']) else 'N/A',
+            'student_name': identity['name'] if pd.notna(identity['name']) else 'N/A',
+            'anomaly_score': float(score),
+            'is_anomaly': -1,
+            'ml_features': row
+        } for (_, identity), score, row in zip(identities.iterrows(), anomalous_df['anomaly_score'],
+                                               ml_features.to_dict('records'))]
 
         return anomalous_students, anomaly_insights, len(df)
         
@@ -175,13 +176,10 @@ def detect_student_anomalies(file_name):
         else:
             df = pd.read_excel(file_path)
     else:
-        students_collection = db.students
-        all_students_data = list(students_collection.find())
-        if not all_students_data:
+        df, _ = load_features(db, ['_id', 'age', 'attendance', 'gender'])
+        if df.empty:
             return pd.DataFrame(), {}, 0
-        df = pd.DataFrame(all_students_data)
-        if '_id' in df.columns:
-            df.rename(columns={'_id': 'student_id'}, inplace=True)
+        df.rename(columns={'_id': 'student_id'}, inplace=True)
         
     total_students = len(df)
     
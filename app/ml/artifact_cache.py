@@ -0,0 +1,265 @@
+# app/ml/artifact_cache.py
+
+import copy
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import joblib
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_LOCK_FILE = 'manifest.lock'
+# Fitted attributes that only report on training; prediction never reads them.
+TRAINING_ONLY_ATTRIBUTES = ('oob_score_', 'oob_decision_function_', 'oob_prediction_',
+                            'oob_improvement_', 'oob_scores_', 'train_score_')
+_manifest_lock = threading.Lock()
+
+
+class ArtifactCache:
+    """
+    Process-wide LRU cache for deserialized ML artifacts (models, preprocessors,
+    feature name lists, explainers).
+
+    Every entry remembers the (path, mtime, size) signature of the files it was
+    built from and is reloaded when any of them changes on disk, so a retrain in
+    another process is picked up on the next access. The memory budget is
+    enforced against the on-disk size of those files, which is a close proxy
+    for the in-memory size of numpy-backed sklearn objects.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (signature, value, nbytes)
+        self._lock = threading.RLock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: str, sources: list, build):
+        """Returns the cached value for `key`, calling `build()` if it is missing or stale."""
+        signature = _file_signature(sources)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._discard(key)
+                self.invalidations += 1
+            self.misses += 1
+
+        # Deserialize outside the lock so a slow load does not block cache hits.
+        value = build()
+        nbytes = sum(size for _, _, size in signature)
+
+        with self._lock:
+            if nbytes > self.max_bytes:
+                logger.warning(f"Artifact '{key}' ({nbytes} bytes) exceeds the cache budget; not caching it.")
+                return value
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (signature, value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                evicted_key, _ = next(iter(self._entries.items()))
+                self._discard(evicted_key)
+                self.evictions += 1
+                logger.info(f"Evicted artifact '{evicted_key}' from cache.")
+        return value
+
+    def load(self, path: str, mmap_mode: str | None = None):
+        """Loads a joblib artifact through the cache, optionally memory-mapping its numpy arrays."""
+        return self.get(path, [path], lambda: joblib.load(path, mmap_mode=mmap_mode))
+
+    def invalidate(self, path: str):
+        """Drops every entry that was built from `path`."""
+        path = _normalize(path)
+        with self._lock:
+            stale = [key for key, (signature, _, _) in self._entries.items()
+                     if any(source == path for source, _, _ in signature)]
+            for key in stale:
+                self._discard(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def _discard(self, key):
+        _, _, nbytes = self._entries.pop(key)
+        self.current_bytes -= nbytes
+
+
+def _normalize(path: str) -> str:
+    return os.path.abspath(path).replace("\\", "/")
+
+
+def _file_signature(sources: list) -> tuple:
+    signature = []
+    for source in sources:
+        st = os.stat(source)
+        signature.append((_normalize(source), st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+artifact_cache = ArtifactCache(max_bytes=Config.MODEL_CACHE_MAX_BYTES)
+
+
+def artifact_version(paths: list) -> str:
+    """Short digest of the (path, mtime, size) signature of `paths`. Missing files are part of the version too."""
+    existing = [path for path in paths if os.path.exists(path)]
+    missing = sorted(_normalize(path) for path in paths if path not in existing)
+    return hashlib.sha1(repr((_file_signature(existing), missing)).encode()).hexdigest()[:16]
+
+
+def worker_memory() -> dict | None:
+    """
+    Resident memory of this worker in MB. Pss splits shared pages between the
+    processes mapping them, so memory-mapped models show up there rather than in Private_Dirty.
+    Returns None where /proc/self/smaps_rollup is unavailable.
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    report = {'pid': os.getpid()}
+    for line in lines:
+        parts = line.split()
+        if parts[0] in ('Rss:', 'Pss:', 'Shared_Clean:', 'Private_Dirty:'):
+            report[f"{parts[0][:-1].lower()}_mb"] = round(int(parts[1]) / 1024, 1)
+    return report
+
+
+def load_artifact(path: str, mmap_mode: str | None = None):
+    """Shortcut for loading a single joblib file through the shared cache."""
+    return artifact_cache.load(path, mmap_mode=mmap_mode)
+
+
+def slim_artifact(obj) -> tuple:
+    """
+    Returns (obj, stripped): a shallow copy of `obj` without its
+    TRAINING_ONLY_ATTRIBUTES, or `obj` itself when it has none. The caller's object is not modified.
+    """
+    stripped = [name for name in TRAINING_ONLY_ATTRIBUTES if name in getattr(obj, '__dict__', {})]
+    if not stripped:
+        return obj, []
+    slim = copy.copy(obj)
+    for name in stripped:
+        delattr(slim, name)
+    return slim, stripped
+
+
+def temp_path_for(path: str) -> str:
+    """A scratch file beside `path` that no other writer, in this process or another, uses."""
+    return f"{path}.{os.getpid()}-{uuid.uuid4().hex[:12]}.tmp"
+
+
+def dump_artifact(obj, path: str, mmap_mode: str | None = None) -> dict:
+    """
+    Writes an artifact with joblib and drops any stale copy held by the serving cache.
+    The file is written beside the target and renamed over it, so processes that
+    memory-mapped the previous version keep a consistent copy.
+
+    Training-only attributes are stripped and the file is compressed at
+    ARTIFACT_COMPRESSION, unless it is served with `mmap_mode`: only uncompressed
+    files can be memory-mapped. Returns the manifest entry recorded for it.
+    """
+    obj, stripped = slim_artifact(obj)
+    compress = 0 if mmap_mode else Config.ARTIFACT_COMPRESSION
+    tmp_path = temp_path_for(path)
+    try:
+        joblib.dump(obj, tmp_path, compress=compress)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    artifact_cache.invalidate(path)
+    return record_artifact(path, lambda: joblib.load(path, mmap_mode=mmap_mode),
+                           compress=compress, mmap_mode=mmap_mode, stripped=stripped)
+
+
+def record_artifact(path: str, load, **fields) -> dict:
+    """
+    Times `load()` and records it, with the artifact's size on disk and `fields`,
+    in the manifest of the artifact's directory. A directory counts as one
+    artifact holding all of its files. The load runs right after writing, so it
+    measures deserialization rather than disk reads.
+    """
+    started = time.perf_counter()
+    load()
+    entry = {
+        'bytes': _disk_bytes(path),
+        'load_seconds': round(time.perf_counter() - started, 4),
+        **fields,
+        'written_at': datetime.now(timezone.utc).isoformat()
+    }
+    directory, name = os.path.split(_normalize(path))
+    try:
+        # Training workers in other processes update the same manifests, so the
+        # read-modify-write holds an exclusive lock on the directory's lock file.
+        with _manifest_lock, open(os.path.join(directory, MANIFEST_LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = read_manifest(directory)
+            manifest[name] = entry
+            manifest_path = os.path.join(directory, MANIFEST_FILE)
+            tmp_path = temp_path_for(manifest_path)
+            with open(tmp_path, 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, manifest_path)
+    except OSError as e:
+        logger.warning(f"Could not update the artifact manifest in {directory}: {e}")
+    return entry
+
+
+def read_manifest(directory: str) -> dict:
+    """Manifest entries of the artifacts still present in `directory`, keyed by file name."""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {name: entry for name, entry in manifest.items() if os.path.exists(os.path.join(directory, name))}
+
+
+def manifest_entry(path: str) -> dict | None:
+    """The manifest entry recorded when `path` was last written, if any."""
+    directory, name = os.path.split(_normalize(path))
+    return read_manifest(directory).get(name)
+
+
+def _disk_bytes(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return os.path.getsize(path)
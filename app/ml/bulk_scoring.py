@@ -0,0 +1,181 @@
+# app/ml/bulk_scoring.py
+
+import logging
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+from pymongo import UpdateOne
+
+from config import Config
+from app.ml.feature_store import load_features
+from app.ml.feature_versions import FEATURE_VERSION_FIELD, stale_predictions_query
+from app.ml.imputation import impute_missing_fields
+from app.ml.predictors import predict_batch, prediction_model_version
+from app.ml.profiling import PhaseTimer, timed
+from app.ml.student_loader import FEATURE_COLUMNS, frame_from_documents, load_students
+
+logger = logging.getLogger(__name__)
+
+# Picking the students to score only needs their ids and feature versions; the features come from the feature store.
+STUDENT_SCORING_PROJECTION = {'_id': 1, FEATURE_VERSION_FIELD: 1}
+SCORING_COLUMNS = ['_id', FEATURE_VERSION_FIELD, *FEATURE_COLUMNS]
+
+SCORABLE_STUDENTS_QUERY = {'ml_features': {'$exists': True, '$nin': [None, {}]}}
+
+
+def scoring_query(model_path: str, stale_only: bool = False, start_after_id=None) -> dict:
+    """
+    Students a scoring run visits. With `stale_only`, only those whose stored
+    prediction does not match the current features and model version.
+    """
+    query = dict(SCORABLE_STUDENTS_QUERY)
+    if stale_only:
+        query.update(stale_predictions_query(model_path, prediction_model_version(model_path)))
+    if start_after_id is not None:
+        query['_id'] = {'$gt': start_after_id}
+    return query
+
+
+def _unchanged_since_read(student_id, feature_version) -> dict:
+    """Update filter that only matches if the student's features were not rewritten while being scored."""
+    if pd.isna(feature_version):
+        return {'_id': student_id, FEATURE_VERSION_FIELD: {'$exists': False}}
+    return {'_id': student_id, FEATURE_VERSION_FIELD: int(feature_version)}
+
+
+def build_feature_frame(students: list) -> pd.DataFrame:
+    """Feature rows, as the feature store holds them, of student documents read straight from Mongo."""
+    return frame_from_documents(students, SCORING_COLUMNS)
+
+
+def iter_student_chunks(db, chunk_size: int, query: dict | None = None):
+    """
+    Streams scorable students in `_id` order as feature frames of `chunk_size`
+    rows. Which students to score comes from an id-and-version query on
+    `students`; their features from the feature store, except for students
+    whose features were written after it was refreshed, which are read from Mongo.
+    """
+    store, _ = load_features(db, SCORING_COLUMNS)
+    store = store.set_index('_id')
+    cursor = (
+        db.students.find(query or SCORABLE_STUDENTS_QUERY, STUDENT_SCORING_PROJECTION)
+        .sort('_id', 1)
+        .batch_size(max(chunk_size, Config.STUDENT_LOAD_BATCH_SIZE))
+    )
+    chunk = []
+    for student in cursor:
+        chunk.append(student)
+        if len(chunk) >= chunk_size:
+            yield _chunk_rows(db, store, chunk)
+            chunk = []
+    if chunk:
+        yield _chunk_rows(db, store, chunk)
+
+
+def _chunk_rows(db, store: pd.DataFrame, students: list) -> pd.DataFrame:
+    keys = [str(student['_id']) for student in students]
+    rows = store.reindex(keys)
+    versions = pd.array([student.get(FEATURE_VERSION_FIELD) for student in students], dtype='Int64')
+    current = (rows[FEATURE_VERSION_FIELD].array.fillna(-1) == versions.fillna(-1)).to_numpy(dtype=bool)
+    current &= rows.index.isin(store.index)
+    if not current.all():
+        changed = [student['_id'] for student, fresh in zip(students, current) if not fresh]
+        reread = load_students(db, SCORING_COLUMNS, {'_id': {'$in': changed}})
+        reread.index = [str(student_id) for student_id in reread.pop('_id')]
+        rows = pd.concat([rows[current], reread[rows.columns]]).reindex(keys)
+    rows = rows.reset_index(drop=True)
+    rows.insert(0, '_id', [student['_id'] for student in students])
+    return rows
+
+
+def score_chunk(students: list, model_path: str, model_label: str, dataset_name: str | None = None,
+                inference_backend: str | None = None, explanation: str = 'exact',
+                timer: PhaseTimer | None = None) -> list:
+    """
+    Scores one chunk of students, a frame from `iter_student_chunks` or
+    `build_feature_frame`, and returns the Mongo update operations for it.
+    """
+    with timed(timer, 'transform'):
+        df_data = students[FEATURE_COLUMNS].reset_index(drop=True)
+        if dataset_name:
+            df_data = impute_missing_fields(df_data, dataset_name)
+    prediction_classes, probabilities, recommendations = predict_batch(df_data, model_path, inference_backend,
+                                                                       explanation, timer)
+
+    scored_at = datetime.now(timezone.utc)
+    model_version = prediction_model_version(model_path)
+    feature_versions = students[FEATURE_VERSION_FIELD].tolist()
+    return [
+        UpdateOne(_unchanged_since_read(student_id, feature_versions[i]), {'$set': {
+            'prediction': {
+                'class': int(prediction_classes[i]),
+                'probability': float(probabilities[i][1]),
+                'recommendations': recommendations[i],
+                'explanation': explanation,
+                'model_used': model_label,
+                'model_path': model_path,
+                'model_version': model_version,
+                'feature_version': 0 if pd.isna(feature_versions[i]) else int(feature_versions[i]),
+                'timestamp': scored_at
+            }
+        }})
+        for i, student_id in enumerate(students['_id'])
+    ]
+
+
+def score_students(db, model_path: str, model_label: str, chunk_size: int | None = None,
+                   start_after_id=None, on_chunk=None, dataset_name: str | None = None,
+                   inference_backend: str | None = None, stale_only: bool = False,
+                   explanation: str | None = None) -> dict:
+    """
+    Scores every student with `ml_features` using the given model, reading
+    their features from the feature store. Each chunk is transformed, predicted and explained as one matrix and
+    written back with a single unordered bulk_write.
+
+    Missing numeric fields are filled with `dataset_name`'s regression imputers
+    when it is given. Students are visited in `_id` order, so a run can be resumed from the last
+    written `_id` with `start_after_id`. `on_chunk(scored, last_id)` is called
+    after every chunk is written; returning False stops the run early.
+
+    With `stale_only`, students whose prediction already matches their current
+    feature version and the model version are skipped, so a refresh costs as
+    much as the churn since the last run. A student whose features change while
+    its chunk is being scored keeps its old prediction and stays stale.
+
+    `explanation` defaults to BULK_EXPLANATION_LEVEL; students scored without an
+    exact explanation get one lazily when their details are opened.
+    """
+    chunk_size = chunk_size or Config.BULK_SCORING_CHUNK_SIZE
+    explanation = explanation or Config.BULK_EXPLANATION_LEVEL
+    query = scoring_query(model_path, stale_only, start_after_id)
+
+    started = time.perf_counter()
+    timer = PhaseTimer()
+    scored = 0
+    stopped = False
+
+    chunks = iter_student_chunks(db, chunk_size, query)
+    while True:
+        with timer.phase('read'):
+            students = next(chunks, None)
+        if students is None:
+            break
+        operations = score_chunk(students, model_path, model_label, dataset_name, inference_backend, explanation, timer)
+        with timer.phase('write'):
+            db.students.bulk_write(operations, ordered=False)
+        scored += len(operations)
+        logger.info(f"Scored {scored} students with {model_label}.")
+
+        if on_chunk is not None and on_chunk(scored, students['_id'].iloc[-1]) is False:
+            stopped = True
+            break
+
+    elapsed = time.perf_counter() - started
+    return {
+        'scored': scored,
+        'stopped': stopped,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(scored / elapsed, 1) if elapsed > 0 else None,
+        'phases': timer.as_dict()
+    }
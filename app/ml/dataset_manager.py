@@ -3,7 +3,6 @@
 import logging
 import os
 from flask import current_app
-import joblib
 import pandas as pd
 from hashlib import sha256
 
@@ -12,6 +11,7 @@ from sklearn.impute import SimpleImputer
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
 
+from app.ml.artifact_cache import load_artifact
 from app.utils.mongodb_utils import delete_dataset_by_hash, insert_dataset
 
 logger = logging.getLogger(__name__)
@@ -37,6 +37,8 @@ PREPROCESSOR_PATH = os.path.join(MODEL_DIR, 'preprocessor.pkl')
 
 PROCESSED_FEATURE_NAMES_PATH = os.path.join(MODEL_DIR, 'processed_feature_names.pkl')
 
+BACKGROUND_DATA_PATH = os.path.join(MODEL_DIR, 'shap_background_data.pkl')
+
 CATEGORICAL_COLUMNS = [
     'gender', 'part_time_job', 'diet_quality', 'exercise_frequency', 
     'parental_education', 'internet_quality', 'extracurricular_activities'
@@ -48,6 +50,22 @@ REGRESSION_TARGETS_LIST = [
     'exam_score'
 ]
 
+# One preprocessor per dataset, fitted on every column, is shared by all regression
+# imputers; each imputer drops its own target's output column.
+REGRESSION_PREPROCESSOR_FILE = 'regression_preprocessor.pkl'
+REGRESSION_FEATURES_FILE = 'regression_features.pkl'
+
+# The dropout preprocessor and SHAP background above belong to whichever dataset was
+# trained last; these per-dataset copies are what that dataset's models were trained
+# with, and incremental updates of its models use them.
+DROPOUT_PREPROCESSOR_FILE = 'dropout_preprocessor.pkl'
+DROPOUT_FEATURES_FILE = 'dropout_features.pkl'
+DROPOUT_BACKGROUND_FILE = 'dropout_shap_background.pkl'
+
+
+def dataset_artifact_path(dataset_name: str, file_name: str) -> str:
+    return os.path.join(MODEL_DIR, dataset_name, file_name).replace("\\", "/")
+
 
 def hash_dataframe(df: pd.DataFrame):
     structure_hash = sha256((",".join(df.columns)).encode()).hexdigest()
@@ -117,26 +135,22 @@ def str_to_bool(val):
     return False
 
 
-def load_and_prepare_student_data():
+def load_and_prepare_student_data(version: int | None = None):
+    """
+    Dropout training rows (raw features and target) of every student, read from
+    the feature store; train_dropout_models fits the preprocessor on them.
+    `version` pins a stored feature store version to repeat an earlier run;
+    the version read is kept in the frame's attrs['feature_store_version'].
+    """
+    from app.ml.feature_store import load_features
+
     db = current_app.db
-    students_data = list(db.students.find({}))
-    if not students_data:
-        logger.warning("No student data found in MongoDB for ML processing.")
+    df_ml, meta = load_features(db, NUMERICAL_FEATURES + CATEGORICAL_FEATURES + [TARGET_FEATURE], version)
+    if df_ml.empty:
+        logger.warning("No student data found in the feature store for ML processing.")
         return pd.DataFrame()
 
-    df = pd.DataFrame(students_data)
-
-    for feature in NUMERICAL_FEATURES + CATEGORICAL_FEATURES:
-        if feature in ['highSchoolGPA', 'currentGPA']:
-            if feature not in df.columns:
-                df[feature] = None
-            continue
-
-    if TARGET_FEATURE not in df.columns:
-        df[TARGET_FEATURE] = False
-        logger.warning(f"'{TARGET_FEATURE}' column not found in data, defaulting to False.")
-
-    df_ml = df[NUMERICAL_FEATURES + CATEGORICAL_FEATURES + [TARGET_FEATURE]].copy()
+    df_ml[TARGET_FEATURE] = df_ml[TARGET_FEATURE].fillna(False).astype(bool)
 
     for col in ['part_time_job', 'extracurricular_activities']:
         if col in df_ml.columns:
@@ -145,35 +159,17 @@ def load_and_prepare_student_data():
     for col in NUMERICAL_FEATURES:
         if col in df_ml.columns and df_ml[col].isnull().any():
             mean_val = df_ml[col].mean()
-            df_ml[col].fillna(mean_val, inplace=True)
+            df_ml[col] = df_ml[col].fillna(mean_val)
             logger.info(f"Imputed missing values in '{col}' with mean: {mean_val:.2f}")
 
     for col in CATEGORICAL_FEATURES:
         if col in df_ml.columns and df_ml[col].isnull().any():
-            df_ml[col].fillna('missing', inplace=True)
+            df_ml[col] = df_ml[col].fillna('missing')
             logger.info(f"Imputed missing values in '{col}' with 'missing' category.")
 
-    try:
-        X = df_ml[NUMERICAL_FEATURES + CATEGORICAL_FEATURES]
-        y = df_ml[TARGET_FEATURE]
-
-        preprocessor = build_preprocessor()
-        preprocessor.fit(X)
-        X_processed = preprocessor.transform(X)
-
-        feature_names = preprocessor.named_steps['preprocessor'].get_feature_names_out()
-        df_processed = pd.DataFrame(X_processed, columns=feature_names, index=df_ml.index)
-        df_processed[TARGET_FEATURE] = y
-
-        joblib.dump(preprocessor, PREPROCESSOR_PATH)
-        logger.info(f"Preprocessor saved to {PREPROCESSOR_PATH}")
-
-        logger.info(f"Data loaded and preprocessed. Shape: {df_processed.shape}")
-        return df_processed
-
-    except Exception as e:
-        logger.error(f"Error during data preprocessing: {e}", exc_info=True)
-        return pd.DataFrame()
+    df_ml.attrs['feature_store_version'] = meta['version']
+    logger.info(f"Data loaded from feature store version {meta['version']}. Shape: {df_ml.shape}")
+    return df_ml
 
 def get_feature_names_after_preprocessing(preprocessor: ColumnTransformer) -> list:
     """
@@ -191,7 +187,11 @@ def get_feature_names_after_preprocessing(preprocessor: ColumnTransformer) -> li
     return feature_names
 
 
-def build_preprocessor(X: pd.DataFrame, target_to_exclude: str) -> tuple[ColumnTransformer, list]:
+# Part of the feature cache key (app.ml.feature_cache): bump it whenever build_preprocessor changes its output.
+PREPROCESSING_VERSION = 1
+
+
+def build_preprocessor(X: pd.DataFrame, target_to_exclude: str | None) -> tuple[ColumnTransformer, list]:
 
     logger.info("Building preprocessor...")
     
@@ -229,6 +229,19 @@ def build_preprocessor(X: pd.DataFrame, target_to_exclude: str) -> tuple[ColumnT
     return preprocessor, processed_feature_names
 
 
+def regression_target_column(preprocessor: ColumnTransformer, target: str) -> int | None:
+    """
+    Position of `target` in the output of the shared regression preprocessor,
+    or None if it is not a numeric input. Numeric columns come first in the
+    output, in the order they were fitted.
+    """
+    for name, _, columns in preprocessor.transformers_:
+        if name == 'num':
+            columns = list(columns)
+            return columns.index(target) if target in columns else None
+    return None
+
+
 def load_preprocessor(preprocessor_path: str, features_path: str) -> tuple[ColumnTransformer | None, list | None]:
 
     preprocessor = None
@@ -236,8 +249,8 @@ def load_preprocessor(preprocessor_path: str, features_path: str) -> tuple[Colum
     
     if os.path.exists(preprocessor_path):
         try:
-            preprocessor = joblib.load(preprocessor_path)
-            logger.info(f"Preprocessor loaded from {preprocessor_path}")
+            preprocessor = load_artifact(preprocessor_path)
+            logger.debug(f"Preprocessor loaded from {preprocessor_path}")
         except Exception as e:
             logger.error(f"Error loading preprocessor from {preprocessor_path}: {e}", exc_info=True)
             preprocessor = None
@@ -246,8 +259,8 @@ def load_preprocessor(preprocessor_path: str, features_path: str) -> tuple[Colum
 
     if os.path.exists(features_path):
         try:
-            processed_feature_names = joblib.load(features_path)
-            logger.info(f"Processed feature names loaded from {features_path}")
+            processed_feature_names = load_artifact(features_path)
+            logger.debug(f"Processed feature names loaded from {features_path}")
         except Exception as e:
             logger.error(f"Error loading processed feature names from {features_path}: {e}", exc_info=True)
             processed_feature_names = None
@@ -255,3 +268,20 @@ def load_preprocessor(preprocessor_path: str, features_path: str) -> tuple[Colum
         logger.warning(f"No processed feature names found at {features_path}.")
 
     return preprocessor, processed_feature_names
+
+
+def align_to_preprocessor(data: pd.DataFrame, preprocessor) -> pd.DataFrame:
+    """
+    Reorders columns to what the preprocessor was fitted on, adding missing ones as NaN.
+    Numeric columns holding strings are coerced to numbers, and categorical columns
+    that arrived as floats (e.g. all missing) are cast to object so the
+    'missing' constant imputer accepts them.
+    """
+    aligned = data.reindex(columns=preprocessor.feature_names_in_)
+    for name, _, columns in preprocessor.transformers_:
+        for col in columns if name in ('num', 'cat') else []:
+            if name == 'num' and not pd.api.types.is_numeric_dtype(aligned[col]):
+                aligned[col] = pd.to_numeric(aligned[col], errors='coerce')
+            elif name == 'cat' and pd.api.types.is_float_dtype(aligned[col]):
+                aligned[col] = aligned[col].astype(object)
+    return aligned
@@ -0,0 +1,91 @@
+# app/ml/explainers.py
+
+import logging
+import os
+import numpy as np
+import shap
+
+from config import Config
+from app.ml.artifact_cache import artifact_cache, dump_artifact, load_artifact
+from app.ml.dataset_manager import BACKGROUND_DATA_PATH
+
+logger = logging.getLogger(__name__)
+
+# How much explanation work a prediction does, from cheapest to most precise.
+EXPLANATION_LEVELS = ['none', 'approximate', 'exact']
+
+
+def explainer_path_for(model_path: str) -> str:
+    """The explainer for `.../dropout_random_forest.pkl` lives at `.../dropout_random_forest_explainer.pkl`."""
+    root, ext = os.path.splitext(model_path)
+    return f"{root}_explainer{ext or '.pkl'}".replace("\\", "/")
+
+
+def build_explainer(model, background_data=None):
+    """
+    Builds the cheapest exact SHAP explainer for the model.
+    Linear models get a LinearExplainer (TreeExplainer cannot handle them),
+    everything else is treated as a tree ensemble.
+    """
+    if hasattr(model, 'coef_'):
+        if background_data is None:
+            # No saved background data: fall back to the mean of the standardized numeric features.
+            background_data = np.zeros((1, model.coef_.shape[1]))
+        return shap.LinearExplainer(model, background_data)
+    return shap.TreeExplainer(model)
+
+
+def save_explainer(model, model_path: str, background_data=None) -> str | None:
+    """Builds the explainer once at training time and stores it next to the model."""
+    explainer_path = explainer_path_for(model_path)
+    try:
+        explainer = build_explainer(model, background_data)
+        # Written uncompressed when served memory-mapped (see load_explainer).
+        dump_artifact(explainer, explainer_path, mmap_mode=Config.MODEL_MMAP_MODE)
+        logger.info(f"SHAP explainer saved to {explainer_path}")
+        return explainer_path
+    except Exception as e:
+        logger.error(f"Failed to build SHAP explainer for {model_path}: {e}", exc_info=True)
+        return None
+
+
+def load_explainer(model_path: str, model=None):
+    """
+    Loads the persisted explainer for a model through the artifact cache.
+    Models trained before explainers were persisted get one built from the
+    model and the saved SHAP background data; it is cached like any other artifact.
+    """
+    explainer_path = explainer_path_for(model_path)
+    if os.path.exists(explainer_path):
+        # Explainer node arrays are plain numpy arrays, so they can be shared read-only via mmap.
+        return load_artifact(explainer_path, mmap_mode=Config.MODEL_MMAP_MODE)
+
+    sources = [model_path]
+    if os.path.exists(BACKGROUND_DATA_PATH):
+        sources.append(BACKGROUND_DATA_PATH)
+
+    def build():
+        logger.warning(f"No persisted explainer at {explainer_path}; building one in memory.")
+        background_data = load_artifact(BACKGROUND_DATA_PATH) if len(sources) > 1 else None
+        return build_explainer(model if model is not None else load_artifact(model_path), background_data)
+
+    return artifact_cache.get(explainer_path, sources, build)
+
+
+def positive_class_contributions(explainer, X, approximate: bool = False) -> np.ndarray:
+    """
+    Returns SHAP values for the dropout class as an (n_rows, n_features) array.
+    With `approximate`, tree models use Saabas path attributions instead of exact
+    TreeSHAP; linear explanations are exact and cheap either way.
+    """
+    if approximate and isinstance(explainer, shap.TreeExplainer):
+        shap_values = explainer.shap_values(X, approximate=True)
+    else:
+        shap_values = explainer.shap_values(X)
+    if isinstance(shap_values, list):
+        # Older shap releases return one array per class.
+        shap_values = shap_values[-1]
+    shap_values = np.asarray(shap_values)
+    if shap_values.ndim == 3:
+        shap_values = shap_values[:, :, -1]
+    return shap_values
@@ -0,0 +1,139 @@
+# app/ml/feature_cache.py
+
+import json
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+from hashlib import sha256
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+
+from config import Config
+from app.ml.dataset_manager import PREPROCESSING_VERSION, build_preprocessor
+
+logger = logging.getLogger(__name__)
+
+# Cached matrices live in <dataset model dir>/features/<kind>-<key>/.
+FEATURE_CACHE_DIR = 'features'
+
+
+def content_key(X: pd.DataFrame, y, target_to_exclude: str | None) -> str:
+    """
+    Hash of the training data (values, column names and dtypes, which decide
+    how columns are preprocessed) and of the preprocessing configuration.
+    """
+    digest = sha256()
+    digest.update(repr((PREPROCESSING_VERSION, sklearn.__version__, target_to_exclude,
+                        list(X.columns), [str(dtype) for dtype in X.dtypes])).encode())
+    digest.update(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    if y is not None:
+        digest.update(pd.util.hash_pandas_object(pd.Series(y), index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:32]
+
+
+def preprocess(X: pd.DataFrame, y, dataset_dir: str, kind: str, target_to_exclude: str | None) -> dict:
+    """
+    Fits the preprocessor on `X` and transforms it, or reuses the result of an
+    earlier call on the same data. The matrix and labels are kept as .npy files
+    under `dataset_dir` and reloaded memory-mapped, so training and search page
+    in only the rows they touch. The returned arrays are read-only.
+
+    Returns {'preprocessor', 'feature_names', 'X', 'y', 'key', 'cached'}; `y` is
+    None when no labels were given.
+    """
+    if not Config.FEATURE_CACHE_ENABLED:
+        return _fit_transform(X, y, target_to_exclude)
+
+    key = content_key(X, y, target_to_exclude)
+    cache_root = os.path.join(dataset_dir, FEATURE_CACHE_DIR)
+    entry_dir = os.path.join(cache_root, f"{kind}-{key}")
+    try:
+        result = _load_entry(entry_dir, has_labels=y is not None)
+        # The modification time orders entries for pruning, so a hit keeps its entry.
+        os.utime(entry_dir)
+        logger.info(f"Reusing preprocessed {kind} features {key} ({result['X'].shape[0]} rows) from {entry_dir}")
+        return result
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Discarding unreadable feature cache entry {entry_dir}: {e}")
+        shutil.rmtree(entry_dir, ignore_errors=True)
+
+    result = _fit_transform(X, y, target_to_exclude)
+    result['key'] = key
+    try:
+        _save_entry(result, cache_root, entry_dir)
+        _prune(cache_root, kind)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not cache preprocessed {kind} features in {entry_dir}: {e}")
+    return result
+
+
+def _fit_transform(X: pd.DataFrame, y, target_to_exclude: str | None) -> dict:
+    preprocessor, feature_names = build_preprocessor(X, target_to_exclude=target_to_exclude)
+    return {
+        'preprocessor': preprocessor,
+        'feature_names': feature_names,
+        'X': preprocessor.transform(X),
+        'y': None if y is None else np.asarray(y),
+        'key': None,
+        'cached': False
+    }
+
+
+def _load_entry(entry_dir: str, has_labels: bool) -> dict:
+    with open(os.path.join(entry_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    return {
+        'preprocessor': joblib.load(os.path.join(entry_dir, 'preprocessor.pkl')),
+        'feature_names': meta['feature_names'],
+        'X': np.load(os.path.join(entry_dir, 'X.npy'), mmap_mode='r'),
+        'y': np.load(os.path.join(entry_dir, 'y.npy'), mmap_mode='r') if has_labels else None,
+        'key': meta['key'],
+        'cached': True
+    }
+
+
+def _save_entry(result: dict, cache_root: str, entry_dir: str):
+    """Writes the entry into a scratch directory renamed into place, so readers never see a partial entry."""
+    for name in ('X', 'y'):
+        if result[name] is not None and result[name].dtype == object:
+            raise ValueError(f"{name} has mixed-type columns and cannot be memory-mapped")
+
+    tmp_dir = os.path.join(cache_root, f".tmp-{uuid.uuid4().hex[:12]}")
+    os.makedirs(tmp_dir)
+    try:
+        np.save(os.path.join(tmp_dir, 'X.npy'), result['X'])
+        if result['y'] is not None:
+            np.save(os.path.join(tmp_dir, 'y.npy'), result['y'])
+        joblib.dump(result['preprocessor'], os.path.join(tmp_dir, 'preprocessor.pkl'), compress=Config.ARTIFACT_COMPRESSION)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({
+                'key': result['key'],
+                'rows': int(result['X'].shape[0]),
+                'columns': int(result['X'].shape[1]),
+                'feature_names': list(result['feature_names']),
+                'created_at': datetime.now(timezone.utc).isoformat()
+            }, f)
+        # Fails if a concurrent training of the same data got there first; its entry is identical.
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        if os.path.isdir(entry_dir):
+            return
+        raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    logger.info(f"Cached preprocessed features ({result['X'].shape[0]} rows) in {entry_dir}")
+
+
+def _prune(cache_root: str, kind: str):
+    """Keeps the FEATURE_CACHE_KEEP most recently used entries of `kind`."""
+    entries = [entry for entry in os.scandir(cache_root) if entry.is_dir() and entry.name.startswith(f"{kind}-")]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[max(Config.FEATURE_CACHE_KEEP, 1):]:
+        shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,222 @@
+# app/ml/feature_store.py
+
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bson.objectid import ObjectId
+
+from config import Config
+from app.ml.dataset_manager import CATEGORICAL_FEATURES, NUMERICAL_FEATURES, TARGET_FEATURE
+from app.ml.feature_versions import FEATURE_UPDATED_AT_FIELD, FEATURE_VERSION_FIELD
+from app.ml.student_loader import FEATURE_COLUMNS, ages_from_dates_of_birth, load_students
+
+logger = logging.getLogger(__name__)
+
+# A materialized, versioned table of the students' ML features: one row per
+# student with `ml_features` flattened into typed columns and age derived from
+# dateOfBirth. Training, anomaly detection and bulk scoring read the columns
+# they need from its Parquet file instead of scanning the students collection.
+# Each refresh that changes anything writes a new version; older versions stay
+# on disk (FEATURE_STORE_KEEP) so a training run can be repeated on the same rows.
+
+IDENTITY_COLUMNS = ['student_id', 'studentID', 'name']
+STORE_COLUMNS = ['_id', *IDENTITY_COLUMNS, FEATURE_VERSION_FIELD, FEATURE_UPDATED_AT_FIELD, 'date_of_birth',
+                 *FEATURE_COLUMNS, TARGET_FEATURE]
+
+SCHEMA = pa.schema(
+    [('_id', pa.string())]
+    + [(col, pa.string()) for col in IDENTITY_COLUMNS]
+    + [(FEATURE_VERSION_FIELD, pa.int64()),
+       (FEATURE_UPDATED_AT_FIELD, pa.timestamp('ms', tz='UTC')),
+       ('date_of_birth', pa.timestamp('ms', tz='UTC'))]
+    + [(col, pa.float64()) for col in NUMERICAL_FEATURES]
+    + [(col, pa.string()) for col in CATEGORICAL_FEATURES]
+    + [(TARGET_FEATURE, pa.bool_())]
+)
+# Nullable integers and booleans stay nullable instead of turning into floats and objects.
+_PANDAS_TYPES = {pa.int64(): pd.Int64Dtype(), pa.bool_(): pd.BooleanDtype()}.get
+
+TABLE_FILE = 'features.parquet'
+META_FILE = 'meta.json'
+CURRENT_FILE = 'CURRENT'
+
+_refresh_lock = threading.Lock()
+
+
+def _version_dir(version: int) -> str:
+    return os.path.join(Config.FEATURE_STORE_DIR, f"v{version:06d}")
+
+
+def current_version() -> int | None:
+    try:
+        with open(os.path.join(Config.FEATURE_STORE_DIR, CURRENT_FILE)) as f:
+            return int(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def read_meta(version: int | None) -> dict | None:
+    if version is None:
+        return None
+    try:
+        with open(os.path.join(_version_dir(version), META_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _read_table(version: int, columns: list | None = None) -> pd.DataFrame:
+    table = pq.read_table(os.path.join(_version_dir(version), TABLE_FILE), columns=columns)
+    return table.to_pandas(types_mapper=_PANDAS_TYPES)
+
+
+def _write_version(rows: pd.DataFrame, meta: dict) -> dict:
+    """Writes `rows` as the next version and makes it current; returns its meta."""
+    store_dir = Config.FEATURE_STORE_DIR
+    os.makedirs(store_dir, exist_ok=True)
+    rows = rows.sort_values('_id', kind='stable').reset_index(drop=True)
+    table = pa.Table.from_pandas(rows[STORE_COLUMNS], schema=SCHEMA, preserve_index=False)
+
+    tmp_dir = os.path.join(store_dir, f".tmp-{os.getpid()}-{threading.get_ident()}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    pq.write_table(table, os.path.join(tmp_dir, TABLE_FILE))
+
+    version = (current_version() or 0) + 1
+    while True:
+        meta = {**meta, 'version': version, 'rows': len(rows),
+                'bytes': os.path.getsize(os.path.join(tmp_dir, TABLE_FILE))}
+        with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+            json.dump(meta, f, indent=2)
+        try:
+            # Another process may have taken this number in the meantime.
+            os.rename(tmp_dir, _version_dir(version))
+            break
+        except OSError:
+            if not os.path.isdir(_version_dir(version)):
+                raise
+            version += 1
+
+    current_tmp = os.path.join(store_dir, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(current_tmp, 'w') as f:
+        f.write(str(version))
+    os.replace(current_tmp, os.path.join(store_dir, CURRENT_FILE))
+    _prune(version)
+    logger.info(f"Feature store version {version}: {meta['rows']} students, {meta['changed_rows']} changed, "
+                f"{meta['removed_rows']} removed")
+    return meta
+
+
+def _prune(current: int):
+    versions = sorted(int(name[1:]) for name in os.listdir(Config.FEATURE_STORE_DIR)
+                      if name.startswith('v') and name[1:].isdigit())
+    for version in versions[:-max(Config.FEATURE_STORE_KEEP, 1)]:
+        if version != current:
+            shutil.rmtree(_version_dir(version), ignore_errors=True)
+
+
+def _watermark(rows: pd.DataFrame) -> str | None:
+    latest = rows[FEATURE_UPDATED_AT_FIELD].max()
+    return None if pd.isna(latest) else latest.isoformat()
+
+
+def _read_students(db, query: dict, as_of: datetime) -> pd.DataFrame:
+    """Store rows for the students matching `query`."""
+    rows = load_students(db, STORE_COLUMNS, query, as_of=as_of)
+    rows['_id'] = [str(student_id) for student_id in rows['_id']]
+    return rows
+
+
+def _build(db, as_of: datetime, parent: int | None) -> dict:
+    rows = _read_students(db, {}, as_of)
+    return _write_version(rows, {'parent': parent, 'created_at': as_of.isoformat(), 'as_of': as_of.date().isoformat(),
+                                 'watermark': _watermark(rows), 'full': True, 'changed_rows': len(rows),
+                                 'removed_rows': 0})
+
+
+def refresh(db, full: bool = False) -> dict:
+    """
+    Brings the store up to date with the students collection and returns the
+    meta of the current version. Only students whose features were written
+    since the last version (through stamp_feature_version) are read in full;
+    inserts and deletes are found by comparing the stored ids with an id-only
+    scan of the collection. A new version is only written when rows changed or
+    the date moved on, which changes ages. `full` rebuilds from every student.
+    """
+    with _refresh_lock:
+        as_of = datetime.now(timezone.utc)
+        version = current_version()
+        meta = read_meta(version)
+        if full or meta is None:
+            return _build(db, as_of, version)
+
+        rows = _read_table(version)
+        query = {FEATURE_UPDATED_AT_FIELD: {'$exists': True}}
+        if meta.get('watermark'):
+            # Stored as naive UTC like the datetimes pymongo returns. Students re-read within the lag are
+            # dropped below as unchanged, so reading them again is harmless.
+            watermark = datetime.fromisoformat(meta['watermark']).astimezone(timezone.utc).replace(tzinfo=None)
+            watermark -= timedelta(seconds=Config.FEATURE_STORE_WATERMARK_LAG_SECONDS)
+            query = {FEATURE_UPDATED_AT_FIELD: {'$gte': watermark}}
+        updates = _read_students(db, query, as_of)
+
+        # Students read again at the watermark without a new write are not changes.
+        known = rows.set_index('_id')[FEATURE_VERSION_FIELD]
+        previous = known.reindex(updates['_id']).to_numpy()
+        is_new = ~updates['_id'].isin(known.index).to_numpy()
+        rewritten = (pd.array(previous, dtype='Int64').fillna(-1) != updates[FEATURE_VERSION_FIELD].fillna(-1)).to_numpy(dtype=bool)
+        updates = updates[is_new | rewritten]
+        rows = pd.concat([rows[~rows['_id'].isin(updates['_id'])], updates], ignore_index=True)
+
+        # Always compared: a delete and an insert between two refreshes leave the count unchanged.
+        batch_size = Config.STUDENT_LOAD_BATCH_SIZE
+        ids = {str(student['_id']) for student in db.students.find({}, {'_id': 1}).batch_size(batch_size)}
+        present = rows['_id'].isin(ids)
+        removed = int((~present).sum())
+        missing = list(ids - set(rows['_id']))
+        rows = rows[present]
+        for start in range(0, len(missing), batch_size):
+            batch = [ObjectId(student_id) for student_id in missing[start:start + batch_size]]
+            added = _read_students(db, {'_id': {'$in': batch}}, as_of)
+            updates = pd.concat([updates, added], ignore_index=True)
+            rows = pd.concat([rows, added], ignore_index=True)
+
+        new_day = meta.get('as_of') != as_of.date().isoformat()
+        if updates.empty and not removed and not new_day:
+            return meta
+        if new_day:
+            rows = rows.reset_index(drop=True)
+            ages = ages_from_dates_of_birth(rows['date_of_birth'], as_of)
+            rows['age'] = ages.where(ages.notna(), rows['age']).astype(np.float64).to_numpy()
+
+        return _write_version(rows, {'parent': version, 'created_at': as_of.isoformat(),
+                                     'as_of': as_of.date().isoformat(),
+                                     'watermark': _watermark(rows) or meta.get('watermark'), 'full': False,
+                                     'changed_rows': len(updates), 'removed_rows': removed})
+
+
+def load_features(db=None, columns: list | None = None, version: int | None = None) -> tuple[pd.DataFrame, dict]:
+    """
+    The store's rows, restricted to `columns` (all by default), and the meta of
+    the version they come from. With `db` the store is refreshed first, so the
+    rows reflect every write to the students collection; a pinned `version`
+    is read as stored, to reproduce a training run.
+    """
+    if version is not None:
+        meta = read_meta(version)
+    elif db is not None:
+        meta = refresh(db)
+    else:
+        meta = read_meta(current_version())
+    if meta is None:
+        raise LookupError(f"Feature store version {version} not found." if version is not None
+                          else "The feature store has not been built yet.")
+    return _read_table(meta['version'], columns), meta
@@ -0,0 +1,34 @@
+# app/ml/feature_versions.py
+
+FEATURE_VERSION_FIELD = 'ml_features_version'
+# Server time of the last write to `ml_features`; the feature store reads students written since its last refresh.
+FEATURE_UPDATED_AT_FIELD = 'ml_features_updated_at'
+
+
+def stamp_feature_version(update: dict) -> dict:
+    """
+    Adds a bump of the student's feature version to a `students` update document.
+    Every write to `ml_features` should go through this so stored predictions
+    can tell whether they were computed from the current features, and the
+    feature store can pick the change up.
+    """
+    stamped = dict(update)
+    stamped['$inc'] = {**update.get('$inc', {}), FEATURE_VERSION_FIELD: 1}
+    stamped['$currentDate'] = {**update.get('$currentDate', {}), FEATURE_UPDATED_AT_FIELD: True}
+    return stamped
+
+
+def stale_predictions_query(model_path: str, model_version: str) -> dict:
+    """
+    Students whose stored prediction is missing, came from another model or
+    model version, or was computed from an older feature version. Students
+    written before versioning count as version 0 on both sides.
+    """
+    return {'$or': [
+        {'prediction.model_path': {'$ne': model_path}},
+        {'prediction.model_version': {'$ne': model_version}},
+        {'$expr': {'$ne': [
+            {'$ifNull': ['$prediction.feature_version', 0]},
+            {'$ifNull': [f'${FEATURE_VERSION_FIELD}', 0]}
+        ]}}
+    ]}
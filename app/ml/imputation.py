@@ -0,0 +1,118 @@
+# app/ml/imputation.py
+
+import logging
+import os
+import joblib
+import numpy as np
+import pandas as pd
+from flask import current_app
+
+from app.ml.artifact_cache import artifact_cache
+from app.ml.dataset_manager import (REGRESSION_PREPROCESSOR_FILE, REGRESSION_TARGETS_LIST, align_to_preprocessor,
+                                    regression_target_column)
+
+logger = logging.getLogger(__name__)
+
+
+class ImputerBundle:
+    """
+    The regression imputers of one dataset, loaded together.
+    `imputers` maps each target column to its (preprocessor, regression model,
+    target column) triple. Imputers trained on the dataset's shared
+    `preprocessor` drop `target column` from its output; datasets trained
+    before it existed have a preprocessor per target and no column to drop.
+    """
+
+    def __init__(self, dataset_name: str, imputers: dict, preprocessor=None):
+        self.dataset_name = dataset_name
+        self.imputers = imputers
+        self.preprocessor = preprocessor
+
+    def impute(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Fills missing values of every regression target present in `df`.
+        Rows with any missing target go through the shared preprocessor once;
+        each target is then predicted for all of its missing rows with one
+        predict call, using only the observed values as inputs.
+        """
+        imputed = df.copy()
+        targets = [col for col in REGRESSION_TARGETS_LIST if col in imputed.columns]
+        for col in targets:
+            imputed[col] = pd.to_numeric(imputed[col], errors='coerce')
+        observed = imputed.copy()
+        incomplete = observed[targets].isna().any(axis=1)
+        shared = {}
+
+        def shared_transform():
+            if 'X' not in shared:
+                rows = observed.loc[incomplete]
+                shared['X'] = self.preprocessor.transform(align_to_preprocessor(rows, self.preprocessor))
+            return shared['X']
+
+        for target in targets:
+            missing = observed[target].isna()
+            if not missing.any():
+                continue
+
+            if target not in self.imputers:
+                logger.warning(f"Regression model for {target} not found for dataset '{self.dataset_name}'. Falling back to 0.")
+                imputed.loc[missing, target] = 0
+                continue
+
+            preprocessor, regression_model, target_column = self.imputers[target]
+            try:
+                if preprocessor is self.preprocessor:
+                    X_reg = shared_transform()[missing[incomplete].to_numpy()]
+                    if target_column is not None:
+                        X_reg = np.delete(X_reg, target_column, axis=1)
+                else:
+                    X_reg = preprocessor.transform(align_to_preprocessor(observed.loc[missing], preprocessor))
+                imputed.loc[missing, target] = regression_model.predict(X_reg)
+            except Exception as e:
+                logger.warning(f"Error predicting missing {target} using regression model: {e}. Falling back to 0.", exc_info=True)
+                imputed.loc[missing, target] = 0
+
+        return imputed
+
+
+def _imputer_paths(dataset_dir: str) -> tuple[str | None, dict]:
+    """
+    The dataset's shared preprocessor path (None for the old layout) and a map
+    of each regression target with saved artifacts to its (preprocessor path, model path).
+    """
+    shared_path = os.path.join(dataset_dir, REGRESSION_PREPROCESSOR_FILE).replace("\\", "/")
+    if not os.path.exists(shared_path):
+        shared_path = None
+    paths = {}
+    for target in REGRESSION_TARGETS_LIST:
+        preprocessor_path = shared_path or os.path.join(dataset_dir, f"preprocessor_{target}.pkl").replace("\\", "/")
+        model_path = os.path.join(dataset_dir, "lr", f"{target}.pkl").replace("\\", "/")
+        if os.path.exists(preprocessor_path) and os.path.exists(model_path):
+            paths[target] = (preprocessor_path, model_path)
+    return shared_path, paths
+
+
+def load_imputer_bundle(dataset_name: str) -> ImputerBundle:
+    """Loads every regression imputer of a dataset once and keeps the bundle in the artifact cache."""
+    dataset_dir = os.path.join(current_app.config['MODEL_DIR'], dataset_name).replace("\\", "/")
+    shared_path, paths = _imputer_paths(dataset_dir)
+    sources = sorted({path for pair in paths.values() for path in pair})
+
+    def build():
+        shared_preprocessor = joblib.load(shared_path) if shared_path else None
+        imputers = {}
+        for target, (preprocessor_path, model_path) in paths.items():
+            if shared_preprocessor is not None:
+                imputers[target] = (shared_preprocessor, joblib.load(model_path),
+                                    regression_target_column(shared_preprocessor, target))
+            else:
+                imputers[target] = (joblib.load(preprocessor_path), joblib.load(model_path), None)
+        logger.info(f"Loaded {len(imputers)} regression imputers for dataset '{dataset_name}'.")
+        return ImputerBundle(dataset_name, imputers, shared_preprocessor)
+
+    return artifact_cache.get(f"imputers:{dataset_dir}", sources, build)
+
+
+def impute_missing_fields(df: pd.DataFrame, dataset_name: str) -> pd.DataFrame:
+    """Imputes missing numeric fields for a whole batch of rows with the dataset's regression models."""
+    return load_imputer_bundle(dataset_name).impute(df)
@@ -0,0 +1,255 @@
+# app/ml/incremental.py
+
+import logging
+import math
+import os
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier, HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+
+from config import Config
+from app.ml.artifact_cache import load_artifact
+from app.ml.dataset_manager import (DROPOUT_BACKGROUND_FILE, DROPOUT_FEATURES_FILE, DROPOUT_PREPROCESSOR_FILE,
+                                    TARGET_FEATURE, align_to_preprocessor, dataset_artifact_path, load_preprocessor)
+from app.ml.profiling import ResourceMeter
+from app.ml.trainer import (classification_metrics, encode_target, run_resources, save_classifier_artifacts,
+                            train_all_models_and_save, trained_models_collection, training_resources)
+
+logger = logging.getLogger(__name__)
+
+
+def latest_run(dataset_name: str) -> dict | None:
+    return trained_models_collection.find_one({"dataset": dataset_name}, sort=[("created_at", -1)])
+
+
+def feature_drift(preprocessor, new_rows: pd.DataFrame) -> dict:
+    """
+    How far a batch of new rows is from the data the preprocessor was fitted on.
+    For numeric features, the shift of the batch mean in training standard
+    deviations and, since small batches are noisy, the same shift in standard
+    errors of the batch mean (its z-score); the feature reported is the most
+    shifted one whose z-score clears INCREMENTAL_DRIFT_Z_SCORE, or the most
+    shifted one if none does. For categorical features, the number and share of
+    rows holding a category never seen in training.
+    """
+    aligned = align_to_preprocessor(new_rows, preprocessor)
+    drift = {"max_mean_shift": 0.0, "mean_shift_z": 0.0, "shifted_feature": None,
+             "unseen_category_rows": 0, "unseen_category_rate": 0.0}
+    unseen = np.zeros(len(aligned), dtype=bool)
+
+    for name, transformer, columns in preprocessor.transformers_:
+        columns = list(columns)
+        if name == 'num' and columns:
+            scaler = transformer.named_steps['scaler']
+            values = aligned[columns].astype(float)
+            shifts = np.nan_to_num(np.abs((values.mean().to_numpy() - scaler.mean_) / scaler.scale_))
+            # The batch mean's standard error is sd / sqrt(n), so the shift in standard errors is shift * sqrt(n).
+            z_scores = shifts * np.sqrt(values.notna().sum().to_numpy())
+            significant = z_scores > Config.INCREMENTAL_DRIFT_Z_SCORE
+            best = int(np.where(significant, shifts, -1.0).argmax() if significant.any() else shifts.argmax())
+            drift.update({"max_mean_shift": round(float(shifts[best]), 4),
+                          "mean_shift_z": round(float(z_scores[best]), 2),
+                          "shifted_feature": columns[best]})
+        elif name == 'cat':
+            encoder = transformer.named_steps['onehot']
+            for col, categories in zip(columns, encoder.categories_):
+                values = aligned[col].astype(object).where(aligned[col].notna(), 'missing')
+                unseen |= ~np.isin(values.to_numpy(), categories)
+
+    drift["unseen_category_rows"] = int(unseen.sum())
+    drift["unseen_category_rate"] = round(float(unseen.mean()), 4) if len(aligned) else 0.0
+    return drift
+
+
+def full_retrain_reason(run: dict | None, new_rows: int, drift: dict | None) -> str | None:
+    """Why the dataset needs a full retrain instead of an incremental update, or None if an update is enough."""
+    if run is None or not run.get("rows_at_full_train"):
+        return "no full training run to update"
+    if drift is None:
+        return "no preprocessor for the current models"
+    changed = run.get("rows_since_full_train", 0) + new_rows
+    change_ratio = changed / run["rows_at_full_train"]
+    if change_ratio > Config.INCREMENTAL_MAX_CHANGE_RATIO:
+        return f"{changed} rows appended since the last full training ({change_ratio:.0%} of its data)"
+    if (drift["max_mean_shift"] > Config.INCREMENTAL_DRIFT_THRESHOLD
+            and drift.get("mean_shift_z", 0.0) > Config.INCREMENTAL_DRIFT_Z_SCORE):
+        return (f"'{drift['shifted_feature']}' shifted by {drift['max_mean_shift']:.2f} standard deviations "
+                f"(z = {drift['mean_shift_z']:.1f})")
+    if (drift["unseen_category_rate"] > Config.INCREMENTAL_UNSEEN_CATEGORY_RATE
+            and drift.get("unseen_category_rows", 0) >= Config.INCREMENTAL_UNSEEN_CATEGORY_MIN_ROWS):
+        return (f"{drift['unseen_category_rate']:.0%} of new rows ({drift['unseen_category_rows']}) "
+                f"have categories unseen in training")
+    return None
+
+
+def _incremental_linear(model: LogisticRegression, rows_seen: int) -> SGDClassifier:
+    """
+    LogisticRegression has no partial_fit; this continues from its solution as
+    an equivalent log-loss SGDClassifier, whose L2 penalty matches C over the
+    rows the model has seen. Later updates partial_fit the SGDClassifier directly.
+    """
+    sgd = SGDClassifier(loss='log_loss', alpha=1.0 / (model.C * max(rows_seen, 1)),
+                        learning_rate='constant', eta0=Config.INCREMENTAL_SGD_LEARNING_RATE)
+    sgd.coef_ = model.coef_.copy()
+    sgd.intercept_ = model.intercept_.copy()
+    sgd.classes_ = model.classes_
+    sgd.n_features_in_ = model.n_features_in_
+    sgd.t_ = 1.0
+    return sgd
+
+
+def update_classifier(model, X_new, y_new, rows_seen: int, class_weight: dict | None = None):
+    """
+    Updates a fitted classifier with new rows only, so the cost is proportional to the batch.
+    RandomForest grows trees in proportion to the batch's share of the data,
+    both boosting engines continue boosting with as many new stages, and
+    linear models take one partial_fit pass. Returns (model, change) where change
+    describes the update, or (model, None) if this batch cannot update the model.
+
+    A model trained with 'balanced' class weights keeps the weights of its full
+    training (`class_weight`, as recorded by the trainer); balancing the batch's
+    own class mix would weight the new trees differently from the rest.
+    """
+    if getattr(model, 'class_weight', None) in ('balanced', 'balanced_subsample'):
+        if not class_weight:
+            raise ValueError("no class weights were recorded for this model's full training")
+        model.class_weight = {int(cls): weight for cls, weight in class_weight.items()}
+    if isinstance(model, (RandomForestClassifier, GradientBoostingClassifier)):
+        # A single-class batch would build trees that disagree with the ensemble on the number of classes.
+        if len(np.unique(y_new)) < 2:
+            return model, None
+        if isinstance(model, GradientBoostingClassifier) and not hasattr(model, 'train_score_'):
+            # Saved artifacts drop the training scores, but warm-start boosting extends them.
+            model.train_score_ = np.zeros(model.estimators_.shape[0])
+        added = max(1, math.ceil(model.n_estimators * len(y_new) / max(rows_seen, 1)))
+        model.set_params(warm_start=True, n_estimators=model.n_estimators + added)
+        if isinstance(model, RandomForestClassifier):
+            model.n_jobs = Config.TRAINING_RF_N_JOBS
+        model.fit(X_new, y_new)
+        if isinstance(model, RandomForestClassifier):
+            model.n_jobs = None
+        return model, {"estimators_added": added, "estimators": model.n_estimators}
+
+    if isinstance(model, HistGradientBoostingClassifier):
+        if len(np.unique(y_new)) < 2:
+            return model, None
+        if not hasattr(model, 'train_score_'):
+            # Stripped from saved artifacts, but warm starts append to it.
+            model.train_score_ = np.zeros(model.n_iter_ + 1)
+        added = max(1, math.ceil(model.n_iter_ * len(y_new) / max(rows_seen, 1)))
+        # The iterations to add are fixed above, and a small batch is too small for early stopping's validation split.
+        model.set_params(warm_start=True, max_iter=model.n_iter_ + added, early_stopping=False)
+        model.fit(X_new, y_new)
+        return model, {"iterations_added": added, "iterations": model.n_iter_}
+
+    if isinstance(model, LogisticRegression):
+        model = _incremental_linear(model, rows_seen)
+    if isinstance(model, SGDClassifier):
+        model.partial_fit(X_new, y_new, classes=model.classes_)
+        return model, {"partial_fit_rows": len(y_new)}
+    return model, None
+
+
+def load_dropout_artifacts(dataset_name: str) -> tuple:
+    """(preprocessor, SHAP background) the dataset's classifiers were trained with; either is None if missing."""
+    preprocessor, _ = load_preprocessor(dataset_artifact_path(dataset_name, DROPOUT_PREPROCESSOR_FILE),
+                                        dataset_artifact_path(dataset_name, DROPOUT_FEATURES_FILE))
+    background_path = dataset_artifact_path(dataset_name, DROPOUT_BACKGROUND_FILE)
+    background = load_artifact(background_path) if os.path.exists(background_path) else None
+    return preprocessor, background
+
+
+def update_dropout_models(new_df: pd.DataFrame, run: dict, preprocessor, background) -> list:
+    """Applies `update_classifier` to every classifier of a training run; regression imputers are carried over."""
+    X_new_df = new_df.drop(columns=[TARGET_FEATURE, 'student_id'], errors='ignore')
+    X_new = preprocessor.transform(align_to_preprocessor(X_new_df, preprocessor))
+    y_new = new_df[TARGET_FEATURE].astype(int).to_numpy()
+    rows_seen = run["rows_at_full_train"] + run.get("rows_since_full_train", 0)
+
+    details = []
+    for detail in run.get("details") or []:
+        if detail.get("type") != "classification":
+            details.append(detail)
+            continue
+        detail = dict(detail)
+        try:
+            # A private copy: served artifacts may be memory-mapped read-only.
+            model = joblib.load(detail["model_path"])
+            if getattr(model, 'n_features_in_', X_new.shape[1]) != X_new.shape[1]:
+                raise ValueError("model and current preprocessor disagree on the number of features")
+            # Scored before the update, so these are out-of-sample for the new rows.
+            detail["batch_metrics"] = classification_metrics(y_new, model.predict(X_new), model.predict_proba(X_new)[:, 1])
+
+            with ResourceMeter() as meter:
+                model, change = update_classifier(model, X_new, y_new, rows_seen, detail.get("class_weight"))
+            detail["fit_seconds"] = round(meter.wall_seconds, 3)
+            detail["update"] = change
+            # A LogisticRegression is saved as the SGDClassifier that continues it.
+            detail["estimator"] = type(model).__name__
+            if isinstance(model, HistGradientBoostingClassifier):
+                detail["n_iter"] = int(model.n_iter_)
+            if change is not None:
+                detail.update(save_classifier_artifacts(model, detail["model_path"], background, X_new))
+                detail["resources"] = training_resources(
+                    meter, X_new, [detail["model_path"], detail["explainer_path"], detail["arrays_path"]])
+            logger.info(f"Incremental update of {detail['model_path']}: {change}")
+        except Exception as e:
+            logger.error(f"Incremental update of {detail.get('model_path')} failed: {e}", exc_info=True)
+            detail["update"] = None
+            detail["update_error"] = str(e)
+        details.append(detail)
+    return details
+
+
+def update_or_retrain(new_df: pd.DataFrame, full_data_path: str, dataset_name: str, is_paid: bool,
+                      trained_by: dict) -> tuple[str, list]:
+    """
+    Folds appended rows into a dataset's models. The models are updated
+    incrementally from `new_df` unless the accumulated change or the drift of
+    the new rows crosses its threshold, in which case everything is retrained
+    on the dataset's CSV at `full_data_path`, which is only read then.
+    Returns ('incremental' or 'full', model details).
+    """
+    encode_target(new_df)
+    run = latest_run(dataset_name)
+    preprocessor, background = load_dropout_artifacts(dataset_name)
+    drift = None
+    if preprocessor is not None:
+        drift = feature_drift(preprocessor, new_df.drop(columns=[TARGET_FEATURE, 'student_id'], errors='ignore'))
+
+    reason = full_retrain_reason(run, len(new_df), drift)
+    if reason is None and background is None:
+        reason = "no SHAP background for the current models"
+    if reason is None:
+        with ResourceMeter() as meter:
+            details = update_dropout_models(new_df, run, preprocessor, background)
+        if not any(detail.get("update") for detail in details if detail.get("type") == "classification"):
+            reason = "no classifier could be updated with the new rows"
+
+    if reason is not None:
+        logger.info(f"Full retrain of {dataset_name}: {reason}")
+        return "full", train_all_models_and_save(pd.read_csv(full_data_path), dataset_name, is_paid,
+                                                 trained_by=trained_by, retrain_reason=reason)
+
+    try:
+        trained_models_collection.insert_one({
+            "dataset": dataset_name,
+            "trained_by": trained_by,
+            "created_at": datetime.now(timezone.utc),
+            "is_paid": is_paid,
+            "details": details,
+            "training_mode": "incremental",
+            "drift": drift,
+            "rows_added": len(new_df),
+            "rows_at_full_train": run["rows_at_full_train"],
+            "rows_since_full_train": run.get("rows_since_full_train", 0) + len(new_df),
+            "resources": run_resources(meter, len(new_df), details)
+        })
+    except Exception as e:
+        logger.error(f"Failed to save incremental training results to DB: {e}", exc_info=True)
+    logger.info(f"Incrementally updated {dataset_name} with {len(new_df)} rows (drift {drift}).")
+    return "incremental", details
@@ -0,0 +1,56 @@
+# app/ml/job_heartbeat.py
+
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Liveness of background job documents (bulk prediction, upload-and-train).
+# While a worker is on a job it refreshes the job's `updated_at` from a
+# background thread; the thread dies with the worker, so an active job that
+# stops being refreshed has no worker left and can be failed, resumed or
+# cancelled instead of blocking new jobs forever.
+
+STALE_JOB_ERROR = 'The worker running this job stopped responding.'
+
+
+def stale_jobs_query(statuses: list) -> dict:
+    """Jobs in one of `statuses` that no worker has updated for JOB_STALE_AFTER_SECONDS."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=Config.JOB_STALE_AFTER_SECONDS)
+    return {'status': {'$in': statuses}, 'updated_at': {'$lt': cutoff}}
+
+
+def fail_stale_jobs(collection, statuses: list, query: dict | None = None, **fields) -> int:
+    """Marks the stale jobs among those matching `query` as failed, with `fields`; returns how many."""
+    now = datetime.now(timezone.utc)
+    result = collection.update_many({**(query or {}), **stale_jobs_query(statuses)}, {'$set': {
+        'status': 'failed', 'error': STALE_JOB_ERROR, 'finished_at': now, 'updated_at': now, **fields
+    }})
+    if result.modified_count:
+        logger.warning(f"Marked {result.modified_count} stale job(s) in '{collection.name}' as failed.")
+    return result.modified_count
+
+
+@contextmanager
+def heartbeat(collection, job_filter: dict):
+    """Refreshes `updated_at` of the job matching `job_filter` every JOB_HEARTBEAT_SECONDS while the block runs."""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(Config.JOB_HEARTBEAT_SECONDS):
+            try:
+                collection.update_one(job_filter, {'$set': {'updated_at': datetime.now(timezone.utc)}})
+            except Exception as e:
+                logger.warning(f"Could not refresh the heartbeat of job {job_filter.get('_id')}: {e}")
+
+    thread = threading.Thread(target=beat, name='job-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,140 @@
+# app/ml/prediction_cache.py
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from app.ml.artifact_cache import artifact_version
+
+logger = logging.getLogger(__name__)
+
+
+def feature_hashes(aligned: pd.DataFrame) -> np.ndarray:
+    """
+    Stable 64-bit hash of every row of a preprocessor-aligned feature frame.
+    Numeric columns are hashed as float64 so an int from a form and a float
+    from Mongo produce the same key.
+    """
+    canonical = aligned.copy()
+    for col in canonical.columns:
+        if pd.api.types.is_numeric_dtype(canonical[col]):
+            canonical[col] = canonical[col].astype(np.float64)
+    return pd.util.hash_pandas_object(canonical, index=False).to_numpy()
+
+
+class PredictionCache:
+    """
+    Process-wide LRU cache of per-row prediction results, keyed by
+    (model path, feature hash).
+
+    Every entry stores the artifact version it was computed with; an entry
+    whose model, explainer or preprocessor files have since been rewritten is
+    dropped on lookup. Entries also expire after `ttl_seconds`.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # (model_path, feature_hash) -> (version, expires_at, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def get_many(self, model_path: str, version: str, hashes, accept=None) -> list:
+        """
+        Cached result for every hash, or None where there is no valid entry.
+        Entries for which `accept(result)` is False count as misses but are kept.
+        """
+        if not self.enabled:
+            return [None] * len(hashes)
+        now = time.monotonic()
+        results = []
+        with self._lock:
+            for feature_hash in hashes:
+                key = (model_path, int(feature_hash))
+                entry = self._entries.get(key)
+                if entry is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                entry_version, expires_at, result = entry
+                if entry_version != version or expires_at <= now:
+                    del self._entries[key]
+                    if entry_version != version:
+                        self.invalidations += 1
+                    else:
+                        self.expirations += 1
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                if accept is not None and not accept(result):
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                results.append(result)
+        return results
+
+    def put_many(self, model_path: str, version: str, hashes, results):
+        if not self.enabled:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for feature_hash, result in zip(hashes, results):
+                key = (model_path, int(feature_hash))
+                self._entries[key] = (version, expires_at, result)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_model(self, model_path: str):
+        """Drops every cached result of one model."""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == model_path]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+prediction_cache = PredictionCache(
+    max_entries=Config.PREDICTION_CACHE_MAX_ENTRIES,
+    ttl_seconds=Config.PREDICTION_CACHE_TTL_SECONDS
+)
+
+
+def prediction_version(model_path: str, explainer_path: str, preprocessor_path: str, features_path: str) -> str:
+    """Version of everything a cached prediction depends on; changes whenever any of them is retrained."""
+    return artifact_version([model_path, explainer_path, preprocessor_path, features_path])
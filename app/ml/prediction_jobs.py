@@ -0,0 +1,196 @@
+# app/ml/prediction_jobs.py
+
+import logging
+import time
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+from flask import current_app
+from pymongo import ReturnDocument
+
+from app import celery_app
+from app.ml.bulk_scoring import score_students, scoring_query
+from app.ml.job_heartbeat import fail_stale_jobs, heartbeat, stale_jobs_query
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = 'prediction_jobs'
+
+ACTIVE_STATUSES = ['queued', 'running']
+RESUMABLE_STATUSES = ['failed', 'cancelled']
+
+
+def create_prediction_job(db, model_path: str, model_label: str, user_id: str | None,
+                          dataset_name: str | None = None, inference_backend: str | None = None,
+                          stale_only: bool = False, explanation: str | None = None) -> str:
+    """Records a queued bulk-prediction job and returns its id."""
+    result = db[JOBS_COLLECTION].insert_one({
+        'model_path': model_path,
+        'model_label': model_label,
+        'dataset_name': dataset_name,
+        'inference_backend': inference_backend,
+        'stale_only': stale_only,
+        'explanation': explanation,
+        'status': 'queued',
+        'created_by': ObjectId(user_id) if user_id else None,
+        'created_at': datetime.now(timezone.utc),
+        'updated_at': datetime.now(timezone.utc),
+        'total': None,
+        'rows_scored': 0,
+        'rows_per_second': None,
+        'eta_seconds': None,
+        'last_scored_id': None,
+        'cancel_requested': False,
+        'error': None
+    })
+    return str(result.inserted_id)
+
+
+def get_prediction_job(db, job_id: str) -> dict | None:
+    if not ObjectId.is_valid(job_id):
+        return None
+    return db[JOBS_COLLECTION].find_one({'_id': ObjectId(job_id)})
+
+
+def expire_stale_jobs(db) -> int:
+    """Fails active jobs whose worker stopped responding, so they can be resumed and stop blocking new runs."""
+    return fail_stale_jobs(db[JOBS_COLLECTION], ACTIVE_STATUSES)
+
+
+def request_cancel(db, job_id: str) -> bool:
+    """
+    Flags an active job for cancellation; the worker stops after the chunk it
+    is scoring. A job whose worker stopped responding is cancelled right away.
+    """
+    now = datetime.now(timezone.utc)
+    orphaned = db[JOBS_COLLECTION].update_one(
+        {'_id': ObjectId(job_id), **stale_jobs_query(ACTIVE_STATUSES)},
+        {'$set': {'status': 'cancelled', 'cancel_requested': True, 'finished_at': now, 'updated_at': now}}
+    )
+    if orphaned.modified_count == 1:
+        return True
+    result = db[JOBS_COLLECTION].update_one(
+        {'_id': ObjectId(job_id), 'status': {'$in': ACTIVE_STATUSES}},
+        {'$set': {'cancel_requested': True, 'updated_at': datetime.now(timezone.utc)}}
+    )
+    return result.modified_count == 1
+
+
+def requeue_job(db, job_id: str) -> bool:
+    """Moves a failed or cancelled job back to queued so it resumes from its checkpoint."""
+    expire_stale_jobs(db)
+    result = db[JOBS_COLLECTION].update_one(
+        {'_id': ObjectId(job_id), 'status': {'$in': RESUMABLE_STATUSES}},
+        {'$set': {'status': 'queued', 'cancel_requested': False, 'error': None,
+                  'updated_at': datetime.now(timezone.utc)}}
+    )
+    return result.modified_count == 1
+
+
+def enqueue_prediction_job(db, job_id: str):
+    task = run_bulk_prediction_job.delay(job_id)
+    db[JOBS_COLLECTION].update_one({'_id': ObjectId(job_id)}, {'$set': {'celery_task_id': task.id}})
+
+
+def job_to_dict(job: dict) -> dict:
+    """JSON-friendly view of a job document for the dashboard."""
+    return {
+        'job_id': str(job['_id']),
+        'status': job.get('status'),
+        'model_label': job.get('model_label'),
+        'stale_only': job.get('stale_only', False),
+        'explanation': job.get('explanation'),
+        'total': job.get('total'),
+        'rows_scored': job.get('rows_scored', 0),
+        'rows_per_second': job.get('rows_per_second'),
+        'eta_seconds': job.get('eta_seconds'),
+        'cancel_requested': job.get('cancel_requested', False),
+        'error': job.get('error'),
+        'phase_seconds': job.get('phase_seconds'),
+        'created_at': job['created_at'].isoformat() if job.get('created_at') else None,
+        'finished_at': job['finished_at'].isoformat() if job.get('finished_at') else None
+    }
+
+
+@celery_app.task(bind=True)
+def run_bulk_prediction_job(self, job_id):
+    db = current_app.db
+    jobs = db[JOBS_COLLECTION]
+    if get_prediction_job(db, job_id) is None:
+        logger.error(f"Prediction job {job_id} not found.")
+        return {'status': 'FAILURE', 'message': 'Job not found.'}
+
+    # Claim the job; a stale task for a job that was expired and resumed meanwhile finds it taken.
+    run_id = self.request.id or str(ObjectId())
+    job = jobs.find_one_and_update(
+        {'_id': ObjectId(job_id), 'status': 'queued'},
+        {'$set': {'status': 'running', 'run_id': run_id, 'updated_at': datetime.now(timezone.utc)}},
+        return_document=ReturnDocument.AFTER
+    )
+    if job is None:
+        logger.warning(f"Prediction job {job_id} is no longer queued; skipping this run.")
+        return {'status': 'SKIPPED'}
+
+    # Every later update only applies while this run still owns the job.
+    job_filter = {'_id': job['_id'], 'run_id': run_id, 'status': 'running'}
+    if job.get('cancel_requested'):
+        jobs.update_one(job_filter, {'$set': {'status': 'cancelled', 'finished_at': datetime.now(timezone.utc)}})
+        return {'status': 'CANCELLED'}
+
+    # Resume after the last checkpoint if this job has run before.
+    start_after_id = job.get('last_scored_id')
+    already_scored = job.get('rows_scored', 0)
+    stale_only = job.get('stale_only', False)
+    remaining = db.students.count_documents(scoring_query(job['model_path'], stale_only, start_after_id))
+
+    jobs.update_one(job_filter, {'$set': {
+        'started_at': job.get('started_at') or datetime.now(timezone.utc),
+        'total': already_scored + remaining,
+        'updated_at': datetime.now(timezone.utc)
+    }})
+    started = time.perf_counter()
+
+    def on_chunk(scored, last_id):
+        elapsed = time.perf_counter() - started
+        rate = scored / elapsed if elapsed > 0 else None
+        result = jobs.update_one(job_filter, {'$set': {
+            'rows_scored': already_scored + scored,
+            'last_scored_id': last_id,
+            'rows_per_second': round(rate, 1) if rate else None,
+            'eta_seconds': round(max(remaining - scored, 0) / rate, 1) if rate else None,
+            'updated_at': datetime.now(timezone.utc)
+        }})
+        if result.matched_count == 0:
+            logger.warning(f"Prediction job {job_id} was expired or taken over; stopping this run.")
+            return False
+        current = jobs.find_one(job_filter, {'cancel_requested': 1})
+        return current is not None and not current.get('cancel_requested', False)
+
+    try:
+        with heartbeat(jobs, job_filter):
+            summary = score_students(db, job['model_path'], job['model_label'],
+                                     start_after_id=start_after_id, on_chunk=on_chunk,
+                                     dataset_name=job.get('dataset_name'),
+                                     inference_backend=job.get('inference_backend'),
+                                     stale_only=stale_only,
+                                     explanation=job.get('explanation'))
+    except Exception as e:
+        logger.error(f"Prediction job {job_id} failed: {e}", exc_info=True)
+        jobs.update_one(job_filter, {'$set': {
+            'status': 'failed',
+            'error': str(e),
+            'finished_at': datetime.now(timezone.utc),
+            'updated_at': datetime.now(timezone.utc)
+        }})
+        return {'status': 'FAILURE', 'message': str(e)}
+
+    status = 'cancelled' if summary['stopped'] else 'completed'
+    jobs.update_one(job_filter, {'$set': {
+        'status': status,
+        'eta_seconds': 0 if status == 'completed' else None,
+        'phase_seconds': summary['phases'],
+        'finished_at': datetime.now(timezone.utc),
+        'updated_at': datetime.now(timezone.utc)
+    }})
+    logger.info(f"Prediction job {job_id} {status}: {summary}")
+    return {'status': status.upper(), 'summary': summary}
@@ -2,16 +2,19 @@
 
 import os
 import logging
-from flask import current_app
+from functools import lru_cache
+import numpy as np
 import pandas as pd
-import joblib
-import shap
 from sklearn.metrics import r2_score
 from sklearn.ensemble import  RandomForestRegressor
 from sklearn.model_selection import train_test_split
 from app.ml.model_utils import load_model
-from app.ml.model_utils import load_model
-from app.ml.dataset_manager import PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH, TARGET_FEATURE, load_preprocessor, NUMERICAL_FEATURES, CATEGORICAL_FEATURES
+from app.ml.explainers import EXPLANATION_LEVELS, explainer_path_for, load_explainer, positive_class_contributions
+from app.ml.imputation import impute_missing_fields
+from app.ml.prediction_cache import feature_hashes, prediction_cache, prediction_version
+from app.ml.profiling import PhaseTimer, timed
+from app.ml.tree_arrays import load_serving_model
+from app.ml.dataset_manager import PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH, align_to_preprocessor, load_preprocessor, NUMERICAL_FEATURES, CATEGORICAL_FEATURES
 
 logger = logging.getLogger(__name__)
 
@@ -20,133 +23,216 @@ MODEL_DIR = os.path.join(os.getcwd(), "app", "ml", "models")
 GLOBAL_PREPROCESSOR_EXCLUDED_COLS = ['student_id']
 
 
+GENERAL_RECOMMENDATION = "Your current profile is well-balanced. Continue with your current academic and personal habits."
+
+TOP_CONTRIBUTIONS = 5
+
+
+def _recommendation_for(feature: str, contribution: float) -> str | None:
+    if contribution > 0:
+        # Positive contribution pushes towards dropout
+        if 'social_media' in feature:
+            return "Consider reducing time spent on social media to improve focus and well-being."
+        elif 'mental_health_score' in feature:
+            return "Seeking mental health support or wellness counseling could be beneficial."
+        elif 'part_time_job_Yes' == feature:
+            return "Review your part-time work schedule to ensure it doesn't conflict with your studies."
+    elif contribution < 0:
+        # Negative contribution pushes away from dropout
+        if 'currentGPA' in feature or 'highSchoolGPA' in feature:
+            return "You are doing well academically. Continue to focus on your studies to maintain your GPA."
+        elif 'study_hours' in feature:
+            return "Increasing your dedicated study hours could further reduce your risk."
+        elif 'attendance' in feature:
+            return "Your strong attendance is a positive factor. Keep this up."
+    return None
+
+
 def generate_recommendations(feature_contributions: pd.Series) -> list:
     """Generates recommendations based on feature contributions."""
-    recommendations = []
+    return generate_batch_recommendations(
+        feature_contributions.to_numpy().reshape(1, -1),
+        list(feature_contributions.index)
+    )[0]
+
+
+@lru_cache(maxsize=32)
+def _recommendation_table(feature_names: tuple) -> tuple:
+    """Per-feature recommendation for a positive and for a negative contribution."""
+    positive = np.array([_recommendation_for(f, 1.0) for f in feature_names], dtype=object)
+    negative = np.array([_recommendation_for(f, -1.0) for f in feature_names], dtype=object)
+    return positive, negative
+
+
+def generate_batch_recommendations(contributions: np.ndarray, feature_names: list) -> list:
+    """
+    Generates recommendations for every row of an (n_rows, n_features) contribution matrix.
+    The top features are picked for all rows at once; only the final de-duplication is per row.
+    """
+    positive, negative = _recommendation_table(tuple(feature_names))
+    contributions = np.asarray(contributions, dtype=float)
+
     # Sort by absolute SHAP value to prioritize most impactful features
-    top_contributions = feature_contributions.abs().sort_values(ascending=False).head(5)
-
-    for feature in top_contributions.index:
-        contribution = feature_contributions[feature]
-        if contribution > 0:
-            # Positive contribution pushes towards dropout
-            if 'social_media' in feature:
-                recommendations.append("Consider reducing time spent on social media to improve focus and well-being.")
-            elif 'mental_health_score' in feature:
-                recommendations.append("Seeking mental health support or wellness counseling could be beneficial.")
-            elif 'part_time_job_Yes' == feature:
-                recommendations.append("Review your part-time work schedule to ensure it doesn't conflict with your studies.")
-        elif contribution < 0:
-            # Negative contribution pushes away from dropout
-            if 'currentGPA' in feature or 'highSchoolGPA' in feature:
-                recommendations.append("You are doing well academically. Continue to focus on your studies to maintain your GPA.")
-            elif 'study_hours' in feature:
-                recommendations.append("Increasing your dedicated study hours could further reduce your risk.")
-            elif 'attendance' in feature:
-                 recommendations.append("Your strong attendance is a positive factor. Keep this up.")
-
-    # Add a general recommendation if no specific ones are generated
-    if not recommendations:
-        recommendations.append("Your current profile is well-balanced. Continue with your current academic and personal habits.")
-
-    # Remove duplicates
-    return list(dict.fromkeys(recommendations))
-
-def predict(data: pd.DataFrame, model_name: str) -> tuple:
-    data_for_prediction = data.copy()
-
-    cols_to_drop = [col for col in ['studentName'] + GLOBAL_PREPROCESSOR_EXCLUDED_COLS + [TARGET_FEATURE] if col in data_for_prediction.columns]
-    data_for_prediction.drop(columns=cols_to_drop, inplace=True, errors='ignore')
+    top_k = min(TOP_CONTRIBUTIONS, contributions.shape[1])
+    top_idx = np.argsort(-np.abs(contributions), axis=1, kind='stable')[:, :top_k]
+    top_values = np.take_along_axis(contributions, top_idx, axis=1)
+    messages = np.where(top_values > 0, positive[top_idx], np.where(top_values < 0, negative[top_idx], None))
 
+    recommendations = []
+    for row in messages:
+        # Remove duplicates, and add a general recommendation if no specific ones are generated
+        row_recommendations = list(dict.fromkeys(m for m in row if m is not None))
+        recommendations.append(row_recommendations or [GENERAL_RECOMMENDATION])
+    return recommendations
+
+
+def top_contributions(contributions: np.ndarray, feature_names: list, k: int = TOP_CONTRIBUTIONS) -> list:
+    """The `k` largest absolute contributions of every row as [{feature, contribution}, ...]."""
+    contributions = np.asarray(contributions, dtype=float)
+    top_idx = np.argsort(-np.abs(contributions), axis=1, kind='stable')[:, :min(k, contributions.shape[1])]
+    return [
+        [{'feature': feature_names[j], 'contribution': float(row[j])} for j in idx]
+        for row, idx in zip(contributions, top_idx)
+    ]
+
+
+def _score_rows(aligned: pd.DataFrame, model_name: str, inference_backend: str | None,
+                preprocessor, loaded_features, explanation: str = 'exact', timer: PhaseTimer | None = None) -> tuple:
+    """Runs transform, predict_proba and, unless `explanation` is 'none', SHAP for already aligned rows."""
     try:
-        model = joblib.load(model_name)
+        with timed(timer, 'load'):
+            model = load_serving_model(model_name, inference_backend)
     except Exception as e:
         logger.error(f"Error loading model from {model_name}: {e}", exc_info=True)
         raise RuntimeError(f"Failed to load model from {model_name}") from e
 
-    preprocessor, loaded_features = load_preprocessor(PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH)
-    if preprocessor is None:
-        raise ValueError("Preprocessor could not be loaded. Aborting prediction.")
-
     try:
-        df_transformed = preprocessor.transform(data_for_prediction)
+        with timed(timer, 'transform'):
+            df_transformed = preprocessor.transform(aligned)
     except Exception as e:
         logger.error(f"Error transforming data with preprocessor: {e}", exc_info=True)
         raise RuntimeError(f"Failed to preprocess data: {e}") from e
 
     try:
-        prediction_class = model.predict(df_transformed)[0]
-        probabilities = model.predict_proba(df_transformed)[0] if hasattr(model, "predict_proba") else None
+        with timed(timer, 'predict'):
+            if hasattr(model, "predict_proba"):
+                probabilities = model.predict_proba(df_transformed)
+                prediction_classes = model.classes_[probabilities.argmax(axis=1)]
+            else:
+                probabilities = None
+                prediction_classes = model.predict(df_transformed)
+
+        if explanation == 'none':
+            return prediction_classes, probabilities, [None] * len(df_transformed)
 
-        # Create a SHAP explainer and get the SHAP values
-        explainer = shap.TreeExplainer(model)
-        shap_values = explainer.shap_values(df_transformed)
-        
-        # Get the SHAP values for the positive class (dropout)
-        shap_values_class_1 = shap_values.flatten()
+        # Reuse the explainer persisted at training time and get the SHAP values
+        # for the positive class (dropout)
+        with timed(timer, 'load'):
+            explainer = load_explainer(model_name)
+        with timed(timer, 'explain'):
+            contributions = positive_class_contributions(explainer, df_transformed,
+                                                         approximate=explanation == 'approximate')
 
-        # Combine feature names and SHAP values into a Series for easy analysis
-        feature_contributions = pd.Series(shap_values_class_1, index=loaded_features)
+            # Generate recommendations based on the feature contributions
+            recommendations = generate_batch_recommendations(contributions, loaded_features)
 
-        # Generate recommendations based on the feature contributions
-        recommendations = generate_recommendations(feature_contributions)
-        
-        return prediction_class, probabilities, recommendations
+        return prediction_classes, probabilities, recommendations
 
     except Exception as e:
         logger.error(f"Error during model prediction: {e}", exc_info=True)
         raise RuntimeError(f"Failed to make prediction: {e}") from e
 
+
+def prediction_model_version(model_name: str) -> str:
+    """Version of the model, explainer and preprocessor a prediction from `model_name` depends on."""
+    return prediction_version(model_name, explainer_path_for(model_name),
+                              PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH)
+
+
+def predict_batch(data: pd.DataFrame, model_name: str, inference_backend: str | None = None,
+                  explanation: str = 'exact', timer: PhaseTimer | None = None) -> tuple:
+    """
+    Scores every row of `data` with one preprocessor call, one predict_proba call
+    and one SHAP call. Returns (classes, probabilities, recommendations) with one
+    entry per row; probabilities is None for models without predict_proba.
+    `inference_backend` is the model's 'compiled' / 'sklearn' choice from trained_models.
+
+    `explanation` is one of EXPLANATION_LEVELS: 'exact' TreeSHAP, 'approximate'
+    path attributions, or 'none', which skips SHAP and returns None recommendations.
+
+    Rows already scored by the same model version at the same or a more precise
+    explanation level are served from the prediction cache and skip all of that work.
+    Pass a PhaseTimer as `timer` to collect load/transform/predict/explain times.
+    """
+    if explanation not in EXPLANATION_LEVELS:
+        raise ValueError(f"Unknown explanation level '{explanation}'. Use one of {EXPLANATION_LEVELS}.")
+
+    with timed(timer, 'load'):
+        preprocessor, loaded_features = load_preprocessor(PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH)
+    if preprocessor is None:
+        raise ValueError("Preprocessor could not be loaded. Aborting prediction.")
+
+    with timed(timer, 'transform'):
+        aligned = align_to_preprocessor(data, preprocessor)
+    if not prediction_cache.enabled:
+        return _score_rows(aligned, model_name, inference_backend, preprocessor, loaded_features, explanation, timer)
+
+    version = prediction_model_version(model_name)
+    hashes = feature_hashes(aligned)
+    level = EXPLANATION_LEVELS.index(explanation)
+    results = prediction_cache.get_many(model_name, version, hashes,
+                                        accept=lambda result: EXPLANATION_LEVELS.index(result[3]) >= level)
+    missing = [i for i, result in enumerate(results) if result is None]
+
+    if missing:
+        classes, probabilities, recommendations = _score_rows(
+            aligned.iloc[missing], model_name, inference_backend, preprocessor, loaded_features, explanation, timer
+        )
+        scored = [
+            (classes[j], probabilities[j].copy() if probabilities is not None else None, recommendations[j], explanation)
+            for j in range(len(missing))
+        ]
+        prediction_cache.put_many(model_name, version, hashes[missing], scored)
+        for i, result in zip(missing, scored):
+            results[i] = result
+
+    prediction_classes = np.array([result[0] for result in results])
+    probabilities = None if results and results[0][1] is None else np.array([result[1] for result in results])
+    if explanation == 'none':
+        recommendations = [None] * len(results)
+    else:
+        recommendations = [list(result[2]) for result in results]
+    return prediction_classes, probabilities, recommendations
+
+
+def explain_batch(data: pd.DataFrame, model_name: str, top_k: int = TOP_CONTRIBUTIONS) -> list:
+    """
+    Exact SHAP explanation of every row of `data`, for rows that were scored
+    without one. Returns [{'top_contributions': [...], 'recommendations': [...]}, ...].
+    """
+    preprocessor, loaded_features = load_preprocessor(PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH)
+    if preprocessor is None:
+        raise ValueError("Preprocessor could not be loaded. Aborting explanation.")
+
+    df_transformed = preprocessor.transform(align_to_preprocessor(data, preprocessor))
+    contributions = positive_class_contributions(load_explainer(model_name), df_transformed)
+    return [
+        {'top_contributions': top, 'recommendations': recommendations}
+        for top, recommendations in zip(top_contributions(contributions, loaded_features, top_k),
+                                        generate_batch_recommendations(contributions, loaded_features))
+    ]
+
+
+def predict(data: pd.DataFrame, model_name: str, inference_backend: str | None = None,
+            timer: PhaseTimer | None = None) -> tuple:
+    prediction_classes, probabilities, recommendations = predict_batch(data.iloc[:1], model_name, inference_backend,
+                                                                       timer=timer)
+    return (
+        prediction_classes[0],
+        probabilities[0] if probabilities is not None else None,
+        recommendations[0]
+    )
+
 def predict_missing_fields(input_data: dict, dataset_name: str) -> dict:
-    df_single_row = pd.DataFrame([input_data])
-
-    imputed_data = df_single_row.copy()
-
-    numeric_cols_in_input = df_single_row.select_dtypes(include=['int64', 'float64']).columns.tolist()
-
-    for col_to_predict in numeric_cols_in_input:
-        if imputed_data[col_to_predict].isnull().any():
-            if col_to_predict in GLOBAL_PREPROCESSOR_EXCLUDED_COLS or col_to_predict == TARGET_FEATURE or col_to_predict == 'studentName':
-                continue
-
-            regression_model_path_lr = os.path.join(
-                current_app.config['MODEL_DIR'],
-                dataset_name,
-                "lr",
-                f"{col_to_predict}.pkl"
-            ).replace("\\", "/")
-
-            if os.path.exists(regression_model_path_lr):
-                try:
-                    regression_model = joblib.load(regression_model_path_lr)
-
-                    X_reg_raw = imputed_data.drop(
-                        columns=[col_to_predict] + GLOBAL_PREPROCESSOR_EXCLUDED_COLS + [TARGET_FEATURE],
-                        errors='ignore'
-                    ).copy()
-                    
-                    for col_reg in X_reg_raw.columns:
-                        X_reg_raw[col_reg] = X_reg_raw[col_reg].apply(try_convert_float)
-                    X_reg_raw = X_reg_raw.fillna(0)
-
-                    if X_reg_raw.empty or X_reg_raw.shape[1] == 0:
-                        imputed_data.at[0, col_to_predict] = 0
-                        continue
-
-                    predicted_value = regression_model.predict(X_reg_raw)[0]
-                    imputed_data.at[0, col_to_predict] = predicted_value
-                except Exception as e:
-                    logger.warning(f"Error predicting missing {col_to_predict} using regression model: {e}. Falling back to 0.", exc_info=True)
-                    imputed_data.at[0, col_to_predict] = 0
-            else:
-                logger.warning(f"Regression model for {col_to_predict} not found at {regression_model_path_lr}. Falling back to 0.")
-                imputed_data.at[0, col_to_predict] = 0
-                    
+    imputed_data = impute_missing_fields(pd.DataFrame([input_data]), dataset_name)
     return imputed_data.iloc[0].to_dict()
-
-# try_convert_float helper function
-def try_convert_float(value):
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return None
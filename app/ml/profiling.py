@@ -0,0 +1,97 @@
+# app/ml/profiling.py
+
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+# Phases reported for prediction work, in pipeline order. 'read' is fetching
+# student documents, 'load' is getting artifacts from disk or the cache.
+PREDICTION_PHASES = ['read', 'load', 'transform', 'predict', 'explain', 'write']
+
+
+class PhaseTimer:
+    """Accumulates wall-clock seconds per named phase across many calls."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - started
+
+    def as_dict(self) -> dict:
+        return {name: round(seconds, 6) for name, seconds in self.seconds.items()}
+
+
+def timed(timer: PhaseTimer | None, name: str):
+    """`timer.phase(name)`, or a no-op when no timer is being collected."""
+    return timer.phase(name) if timer is not None else nullcontext()
+
+
+def resident_memory_mb() -> float | None:
+    """Current resident set size of this process in MB, or None where /proc/self/statm is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class ResourceMeter:
+    """
+    Wall time, CPU time and peak resident memory of a block of work, for the
+    whole process: while several models are fitted at once, each one's CPU and
+    memory figures include the others'. Memory is sampled every
+    `sample_seconds`, so spikes shorter than that can be missed.
+    """
+
+    def __init__(self, sample_seconds: float = 0.05):
+        self.sample_seconds = sample_seconds
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.start_rss_mb = None
+        self.peak_rss_mb = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def __enter__(self):
+        self.start_rss_mb = self.peak_rss_mb = resident_memory_mb()
+        if self.start_rss_mb is not None:
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall_seconds = time.perf_counter() - self._started
+        self.cpu_seconds = time.process_time() - self._cpu_started
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._record_rss()
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_seconds):
+            self._record_rss()
+
+    def _record_rss(self):
+        rss = resident_memory_mb()
+        if rss is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss)
+
+    def as_dict(self) -> dict:
+        return {
+            'wall_seconds': round(self.wall_seconds, 3),
+            'cpu_seconds': round(self.cpu_seconds, 3),
+            'peak_rss_mb': round(self.peak_rss_mb, 1) if self.peak_rss_mb is not None else None,
+            'rss_growth_mb': round(self.peak_rss_mb - self.start_rss_mb, 1) if self.peak_rss_mb is not None else None
+        }
@@ -0,0 +1,199 @@
+# app/ml/spark_export.py
+
+import logging
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import shap
+from sklearn.linear_model import LogisticRegression
+
+from config import Config
+from app.ml.artifact_cache import dump_artifact
+from app.ml.dataset_manager import build_preprocessor, get_feature_names_after_preprocessing
+from app.ml.explainers import explainer_path_for, save_explainer
+from app.ml.tree_arrays import TreeArrayModel, layout_tree_arrays, write_tree_arrays
+
+logger = logging.getLogger(__name__)
+
+# Converts models trained by spark_train.py into the artifacts the prediction engine serves.
+# Nothing here imports pyspark: tree ensembles arrive as the node table MLlib writes
+# under <saved model>/data, linear models and preprocessing as plain numbers.
+
+# Spark labels are the doubles 0.0 / 1.0; the served models use the integer classes of the pandas trainer.
+SPARK_CLASSES = [0, 1]
+
+
+def spark_trees(nodes: pd.DataFrame) -> list:
+    """
+    Trees of a saved MLlib ensemble, shaped like sklearn's `tree_`, from its
+    node table: one row per node with treeID, id, prediction, impurityStats,
+    leftChild, rightChild, featureIndex, leftCategoriesOrThreshold and numCategories.
+
+    MLlib treats one-hot columns as binary categorical features; their splits
+    ('category in {0}' or 'in {1}') become thresholds at 0.5, so every split is
+    'go left if x <= threshold' as in sklearn.
+    """
+    if 'treeID' not in nodes.columns:
+        nodes = nodes.assign(treeID=0)
+    trees = []
+    for _, tree_nodes in nodes.sort_values(['treeID', 'id']).groupby('treeID', sort=True):
+        n_nodes = len(tree_nodes)
+        if not np.array_equal(tree_nodes['id'].to_numpy(), np.arange(n_nodes)):
+            raise ValueError("Node ids of a tree must run from 0 to its node count.")
+        left = tree_nodes['leftChild'].to_numpy().astype(np.int64)
+        right = tree_nodes['rightChild'].to_numpy().astype(np.int64)
+        feature = tree_nodes['featureIndex'].fillna(-1).to_numpy().astype(np.int64)
+        threshold = np.zeros(n_nodes)
+
+        splits = zip(tree_nodes['numCategories'], tree_nodes['leftCategoriesOrThreshold'])
+        for node, (n_categories, left_values) in enumerate(splits):
+            if left[node] < 0:
+                continue
+            if n_categories is None or n_categories < 0:
+                threshold[node] = left_values[0]
+            elif n_categories == 2 and list(left_values) in ([0.0], [1.0]):
+                threshold[node] = 0.5
+                if left_values[0] == 1.0:
+                    left[node], right[node] = right[node], left[node]
+            else:
+                raise ValueError(f"Split on a categorical feature with {n_categories} categories cannot be exported.")
+
+        trees.append(SimpleNamespace(
+            children_left=np.where(left < 0, -1, left),
+            children_right=np.where(right < 0, -1, right),
+            feature=np.where(left < 0, 0, feature),
+            threshold=threshold,
+            node_count=n_nodes,
+            max_depth=_max_depth(left, right),
+            stats=np.vstack(tree_nodes['impurityStats'].to_numpy()).astype(np.float64),
+            prediction=tree_nodes['prediction'].to_numpy().astype(np.float64)
+        ))
+    return trees
+
+
+def _max_depth(left: np.ndarray, right: np.ndarray) -> int:
+    depth = np.zeros(len(left), dtype=np.int64)
+    # Preorder ids: a child always comes after its parent.
+    for node in range(len(left)):
+        if left[node] >= 0:
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+    return int(depth.max())
+
+
+def forest_export(nodes: pd.DataFrame, n_features: int) -> tuple[dict, dict, dict]:
+    """
+    (arrays, meta, explainer model) for a RandomForestClassificationModel.
+    MLlib averages each tree's normalized class counts, exactly like the 'forest' layout.
+    """
+    trees = spark_trees(nodes)
+    for tree in trees:
+        tree.values = tree.stats / tree.stats.sum(axis=1, keepdims=True)
+        tree.cover = tree.stats.sum(axis=1)
+    arrays, meta = layout_tree_arrays(trees, lambda tree: tree.values, {'kind': 'forest', 'input_dtype': 'float64'},
+                                      n_features, SPARK_CLASSES)
+    explainer_model = _explainer_model(trees, [tree.values / len(trees) for tree in trees], tree_output='probability')
+    return arrays, meta, explainer_model
+
+
+def boosting_export(nodes: pd.DataFrame, tree_weights, n_features: int) -> tuple[dict, dict, dict]:
+    """
+    (arrays, meta, explainer model) for a binary GBTClassificationModel. MLlib's
+    margin is the weighted sum of its regression trees and P(dropout) is
+    1 / (1 + exp(-2 * margin)), so each leaf's log-odds contribution is 2 * weight * prediction.
+    """
+    trees = spark_trees(nodes)
+    if len(trees) != len(tree_weights):
+        raise ValueError(f"{len(trees)} trees but {len(tree_weights)} tree weights.")
+    for tree, weight in zip(trees, tree_weights):
+        tree.values = (2.0 * weight * tree.prediction).reshape(-1, 1)
+        # Variance impurity statistics are (count, sum, sum of squares).
+        tree.cover = tree.stats[:, 0]
+    meta = {'kind': 'boosting', 'init_raw': 0.0, 'learning_rate': 1.0, 'input_dtype': 'float64'}
+    arrays, meta = layout_tree_arrays(trees, lambda tree: tree.values, meta, n_features, SPARK_CLASSES)
+    explainer_model = _explainer_model(trees, [tree.values for tree in trees], tree_output='log_odds',
+                                       objective='binary_crossentropy')
+    return arrays, meta, explainer_model
+
+
+def _explainer_model(trees: list, values: list, **model_fields) -> dict:
+    """The dictionary form of a tree ensemble that shap.TreeExplainer accepts."""
+    return {
+        'trees': [{
+            'children_left': tree.children_left,
+            'children_right': tree.children_right,
+            # Imputation runs before training, so no split ever sees a missing value.
+            'children_default': tree.children_left,
+            'features': np.where(tree.children_left < 0, -2, tree.feature),
+            'thresholds': tree.threshold,
+            'values': tree_values,
+            'node_sample_weight': tree.cover
+        } for tree, tree_values in zip(trees, values)],
+        'base_offset': 0.0,
+        **model_fields
+    }
+
+
+def linear_model(coefficients, intercept: float) -> LogisticRegression:
+    """A LogisticRegression serving an MLlib binary LogisticRegressionModel's coefficients."""
+    model = LogisticRegression()
+    model.coef_ = np.asarray(coefficients, dtype=np.float64).reshape(1, -1)
+    model.intercept_ = np.array([float(intercept)])
+    model.classes_ = np.array(SPARK_CLASSES)
+    model.n_features_in_ = model.coef_.shape[1]
+    return model
+
+
+def serving_preprocessor(numeric_features: list, imputer_means: list, scaler_means: list, scaler_stds: list,
+                         categorical_features: list, category_labels: list) -> tuple:
+    """
+    A fitted ColumnTransformer reproducing the Spark preprocessing (mean
+    imputation and standardization of the numeric columns, one-hot encoding of
+    the 'missing'-filled categorical columns with unseen categories as all
+    zeros) with the statistics Spark fitted. Returns (preprocessor, feature names).
+
+    Category labels must be in StringIndexer 'alphabetAsc' order, the order
+    OneHotEncoder sorts them into.
+    """
+    # Fit on a stand-in frame holding every category, then swap in Spark's statistics.
+    n_rows = max([2] + [len(labels) for labels in category_labels])
+    stand_in = pd.DataFrame({col: np.resize([0.0, 1.0], n_rows) for col in numeric_features})
+    for col, labels in zip(categorical_features, category_labels):
+        stand_in[col] = pd.Series(np.resize(np.array(labels, dtype=object), n_rows), dtype=object)
+    preprocessor, _ = build_preprocessor(stand_in, target_to_exclude=None)
+
+    numeric = preprocessor.named_transformers_['num']
+    numeric.named_steps['imputer'].statistics_ = np.asarray(imputer_means, dtype=np.float64)
+    scaler = numeric.named_steps['scaler']
+    stds = np.asarray(scaler_stds, dtype=np.float64)
+    scaler.mean_ = np.asarray(scaler_means, dtype=np.float64)
+    scaler.var_ = stds ** 2
+    # A constant column scales to 0 in Spark; sklearn gets the same from a unit scale.
+    scaler.scale_ = np.where(stds == 0, 1.0, stds)
+
+    if categorical_features:
+        encoder = preprocessor.named_transformers_['cat'].named_steps['onehot']
+        for col, labels, categories in zip(categorical_features, category_labels, encoder.categories_):
+            if list(categories) != list(labels):
+                raise ValueError(f"Categories of '{col}' are not in the order Spark indexed them.")
+    return preprocessor, get_feature_names_after_preprocessing(preprocessor)
+
+
+def save_tree_model(arrays: dict, meta: dict, explainer_model: dict, model_path: str) -> tuple[str, str]:
+    """
+    Writes an exported tree ensemble the way trainer.save_classifier_artifacts
+    writes sklearn ones: the memory-mapped array layout for the 'compiled'
+    backend, the same model pickled at `model_path` for the 'sklearn' backend,
+    and its SHAP explainer. Returns (arrays_dir, explainer_path).
+    """
+    arrays_dir = write_tree_arrays(arrays, meta, model_path)
+    dump_artifact(TreeArrayModel(arrays, meta), model_path)
+    explainer_path = explainer_path_for(model_path)
+    dump_artifact(shap.TreeExplainer(explainer_model), explainer_path, mmap_mode=Config.MODEL_MMAP_MODE)
+    return arrays_dir, explainer_path
+
+
+def save_linear_model(model: LogisticRegression, model_path: str, background_data) -> str | None:
+    """Writes an exported linear model and its explainer; returns the explainer path."""
+    dump_artifact(model, model_path)
+    return save_explainer(model, model_path, background_data)
@@ -0,0 +1,167 @@
+# app/ml/student_loader.py
+
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from app.ml.dataset_manager import CATEGORICAL_FEATURES, NUMERICAL_FEATURES, TARGET_FEATURE
+from app.ml.feature_versions import FEATURE_UPDATED_AT_FIELD, FEATURE_VERSION_FIELD
+
+logger = logging.getLogger(__name__)
+
+# Loads students for the ML code as a DataFrame of typed columns. Only the
+# fields behind the requested columns are projected (enrollment history,
+# attendance records and notes never leave Mongo), documents are fetched in
+# large cursor batches, and each batch is flattened column by column into
+# arrays instead of building a row dict per student.
+
+FEATURE_COLUMNS = NUMERICAL_FEATURES + CATEGORICAL_FEATURES
+
+# Document field and type of every column the loader can produce. Fields under
+# ml_features are projected individually, so unused features are not sent either.
+COLUMNS = {
+    '_id': ('_id', 'id'),
+    'student_id': ('student_id', 'string'),
+    'studentID': ('studentID', 'string'),
+    'name': ('name', 'string'),
+    FEATURE_VERSION_FIELD: (FEATURE_VERSION_FIELD, 'version'),
+    FEATURE_UPDATED_AT_FIELD: (FEATURE_UPDATED_AT_FIELD, 'timestamp'),
+    'date_of_birth': ('dateOfBirth', 'timestamp'),
+    **{col: (f'ml_features.{col}', 'number') for col in NUMERICAL_FEATURES},
+    **{col: (f'ml_features.{col}', 'category') for col in CATEGORICAL_FEATURES},
+    # Older documents keep the label inside ml_features, newer ones next to it.
+    TARGET_FEATURE: (f'ml_features.{TARGET_FEATURE}', 'label')
+}
+
+# MongoDB keeps datetimes to the millisecond.
+TIMESTAMP_DTYPE = 'datetime64[ms, UTC]'
+
+_EMPTY = {}
+
+
+def ages_from_dates_of_birth(dates_of_birth, as_of: datetime | None = None) -> pd.Series:
+    """Vectorized version of the age calculation used by the student views, as of `as_of` (default now)."""
+    dob = pd.to_datetime(pd.Series(list(dates_of_birth), dtype=object), utc=True, errors='coerce')
+    today = as_of or datetime.now(timezone.utc)
+    birthday_not_reached = (dob.dt.month > today.month) | ((dob.dt.month == today.month) & (dob.dt.day > today.day))
+    return today.year - dob.dt.year - birthday_not_reached.astype(int)
+
+
+def projection(columns: list) -> dict:
+    """The Mongo projection holding exactly the fields `columns` are read from."""
+    fields = {COLUMNS[column][0]: 1 for column in columns}
+    if 'age' in columns:
+        fields['dateOfBirth'] = 1
+    if TARGET_FEATURE in columns:
+        fields[TARGET_FEATURE] = 1
+    if '_id' not in columns:
+        fields['_id'] = 0
+    return fields
+
+
+def _missing(value) -> bool:
+    return value is None or (value.__class__ is float and value != value)
+
+
+def _numbers(values: list) -> np.ndarray:
+    try:
+        # None becomes NaN and numeric strings are parsed in one pass.
+        numbers = np.array(values, dtype=np.float64)
+        if numbers.ndim == 1:
+            return numbers
+    except (TypeError, ValueError):
+        pass
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _category(value):
+    """Categorical values as strings; booleans are spelled 'Yes' / 'No' like the uploaded datasets."""
+    if value.__class__ is str:
+        return value
+    if _missing(value):
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return 'Yes' if value else 'No'
+    return str(value)
+
+
+def _label(value):
+    if _missing(value):
+        return pd.NA
+    if isinstance(value, str):
+        return value.strip().lower() in ['yes', 'true', '1']
+    return bool(value)
+
+
+def _timestamps(values: list):
+    return pd.to_datetime(pd.Series(values, dtype=object), utc=True, errors='coerce').astype(TIMESTAMP_DTYPE).array
+
+
+_CONVERTERS = {
+    'id': lambda values: np.array(values, dtype=object),
+    'string': lambda values: np.array([None if value is None else str(value) for value in values], dtype=object),
+    'version': lambda values: pd.array(values, dtype='Int64'),
+    'timestamp': _timestamps,
+    'number': _numbers,
+    'category': lambda values: np.array([_category(value) for value in values], dtype=object),
+    'label': lambda values: pd.array([_label(value) for value in values], dtype='boolean')
+}
+
+
+def _field_values(students: list, field: str, parents: dict) -> list:
+    """One field of every document; subdocuments of dotted fields are looked up once per batch."""
+    parent, _, key = field.rpartition('.')
+    if not parent:
+        return [student.get(key) for student in students]
+    if parent not in parents:
+        parents[parent] = [student.get(parent) or _EMPTY for student in students]
+    return [subdocument.get(key) for subdocument in parents[parent]]
+
+
+def frame_from_documents(students: list, columns: list | None = None, as_of: datetime | None = None) -> pd.DataFrame:
+    """
+    Typed columns for student documents, read with `projection(columns)` or in
+    full. Age comes from dateOfBirth (as of `as_of`) where there is one.
+    """
+    columns = columns or list(COLUMNS)
+    parents = {}
+    data = {}
+    for column in columns:
+        field, kind = COLUMNS[column]
+        values = _field_values(students, field, parents)
+        if column == TARGET_FEATURE:
+            values = [feature if not _missing(feature) else label
+                      for feature, label in zip(values, _field_values(students, TARGET_FEATURE, parents))]
+        data[column] = _CONVERTERS[kind](values)
+    frame = pd.DataFrame(data, index=pd.RangeIndex(len(students)), columns=columns)
+
+    if 'age' in columns:
+        ages = ages_from_dates_of_birth(_field_values(students, 'dateOfBirth', parents), as_of)
+        frame['age'] = ages.where(ages.notna(), frame['age']).astype(np.float64)
+    return frame
+
+
+def load_students(db, columns: list | None = None, query: dict | None = None, batch_size: int | None = None,
+                  as_of: datetime | None = None) -> pd.DataFrame:
+    """
+    The students matching `query` as a DataFrame of `columns` (every column in
+    COLUMNS by default). Documents arrive STUDENT_LOAD_BATCH_SIZE at a time
+    and each batch is converted to typed arrays before the next is read, so
+    only one batch of documents is held in memory.
+    """
+    columns = columns or list(COLUMNS)
+    batch_size = batch_size or Config.STUDENT_LOAD_BATCH_SIZE
+    cursor = db.students.find(query or {}, projection(columns)).batch_size(batch_size)
+
+    frames, batch = [], []
+    for student in cursor:
+        batch.append(student)
+        if len(batch) >= batch_size:
+            frames.append(frame_from_documents(batch, columns, as_of))
+            batch = []
+    if batch or not frames:
+        frames.append(frame_from_documents(batch, columns, as_of))
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
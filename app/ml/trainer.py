@@ -1,20 +1,34 @@
 
 import logging
 import os
+import time
 from flask import session
 import pandas as pd
-import joblib
+from joblib import Parallel, delayed
 import shap
 from sklearn.linear_model import LinearRegression, LogisticRegression
-from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier, RandomForestRegressor
+from sklearn.ensemble import (GradientBoostingClassifier, HistGradientBoostingClassifier, RandomForestClassifier,
+                              RandomForestRegressor)
 from sklearn.metrics import f1_score, mean_squared_error, precision_score, r2_score, recall_score, roc_auc_score, accuracy_score
 from datetime import datetime, timezone
 import numpy as np
 from sklearn.model_selection import train_test_split
+from sklearn.utils.class_weight import compute_class_weight
 
+from config import Config
 from app import mongo
-from app.ml.dataset_manager import CATEGORICAL_COLUMNS, PREPROCESSOR_PATH, REGRESSION_TARGETS_LIST, TARGET_FEATURE, build_preprocessor
+from app.ml.dataset_manager import (BACKGROUND_DATA_PATH, CATEGORICAL_COLUMNS, DROPOUT_BACKGROUND_FILE,
+                                    DROPOUT_FEATURES_FILE, DROPOUT_PREPROCESSOR_FILE, PREPROCESSOR_PATH,
+                                    REGRESSION_FEATURES_FILE, REGRESSION_PREPROCESSOR_FILE, REGRESSION_TARGETS_LIST,
+                                    TARGET_FEATURE, dataset_artifact_path, regression_target_column)
 from app.ml.model_utils import save_model
+from app.ml.artifact_cache import dump_artifact, manifest_entry
+from app.ml.explainers import save_explainer
+from app.ml.feature_cache import preprocess
+from app.ml.prediction_cache import prediction_cache
+from app.ml.profiling import ResourceMeter
+from app.ml.tree_arrays import export_serving_arrays
+from app.ml.tuning import FoldCache, SearchBudget, default_budget, successive_halving
 
 logger = logging.getLogger(__name__)
 
@@ -37,7 +51,6 @@ MODEL_PATHS = {
 }
 
 PROCESSED_FEATURE_NAMES_PATH = os.path.join(MODEL_DIR, 'processed_feature_names.pkl')
-BACKGROUND_DATA_PATH = os.path.join(MODEL_DIR, 'shap_background_data.pkl')
 
 def try_convert_float(value):
     try:
@@ -45,17 +58,26 @@ def try_convert_float(value):
     except:
         return np.nan
 
-def train_dropout_models(df: pd.DataFrame, dataset_name: str):
+def train_dropout_models(df: pd.DataFrame, dataset_name: str, budget: SearchBudget | None = None):
+    """
+    Trains the dropout classifiers in parallel on one shared split. With a
+    search budget, each classifier's hyperparameters are tuned on the training
+    rows first (see app.ml.tuning) and the winner is fitted.
+    """
     EXCLUDED_COLUMNS = [col for col in ['student_id'] if col in df.columns]
     X = df.drop(columns=[TARGET_FEATURE] + EXCLUDED_COLUMNS, errors='ignore')
-    y = df[TARGET_FEATURE]
 
-    preprocessor, processed_feature_names = build_preprocessor(X, target_to_exclude=TARGET_FEATURE)
-    X_transformed = preprocessor.transform(X)
+    # Unchanged data reuses the memory-mapped matrix of an earlier run (see app.ml.feature_cache).
+    features = preprocess(X, df[TARGET_FEATURE], os.path.join(MODEL_DIR, dataset_name), 'dropout', TARGET_FEATURE)
+    preprocessor, processed_feature_names = features['preprocessor'], features['feature_names']
+    X_transformed, y = features['X'], features['y']
 
+    os.makedirs(os.path.join(MODEL_DIR, dataset_name), exist_ok=True)
     try:
-        joblib.dump(preprocessor, PREPROCESSOR_PATH)
-        joblib.dump(processed_feature_names, PROCESSED_FEATURE_NAMES_PATH)
+        dump_artifact(preprocessor, PREPROCESSOR_PATH)
+        dump_artifact(processed_feature_names, PROCESSED_FEATURE_NAMES_PATH)
+        dump_artifact(preprocessor, dataset_artifact_path(dataset_name, DROPOUT_PREPROCESSOR_FILE))
+        dump_artifact(processed_feature_names, dataset_artifact_path(dataset_name, DROPOUT_FEATURES_FILE))
         logger.info(f"Main preprocessor and feature names saved to {PREPROCESSOR_PATH}")
     except Exception as e:
         logger.error(f"Error saving main preprocessor files: {e}", exc_info=True)
@@ -66,165 +88,331 @@ def train_dropout_models(df: pd.DataFrame, dataset_name: str):
         shap_background_data = X_transformed
 
     try:
-        joblib.dump(shap_background_data, BACKGROUND_DATA_PATH)
+        dump_artifact(shap_background_data, BACKGROUND_DATA_PATH)
+        dump_artifact(shap_background_data, dataset_artifact_path(dataset_name, DROPOUT_BACKGROUND_FILE))
         logger.info(f"SHAP background data saved to {BACKGROUND_DATA_PATH}")
     except Exception as e:
         logger.error(f"Error saving SHAP background data to {BACKGROUND_DATA_PATH}: {e}", exc_info=True)
 
 
+    # One split shared by every model, so their metrics are computed on the same test rows.
+    X_train, X_test, y_train, y_test = train_test_split(X_transformed, y, test_size=0.2, random_state=42, stratify=y)
+
+    engine, engine_reason = boosting_engine(len(y_train))
     models = {
-        'random_forest': RandomForestClassifier(class_weight='balanced', random_state=42),
+        'random_forest': RandomForestClassifier(class_weight='balanced', random_state=42, n_jobs=Config.TRAINING_RF_N_JOBS),
         'logistic_regression': LogisticRegression(max_iter=1000),
-        'gradient_boosting': GradientBoostingClassifier()
+        'gradient_boosting': boosting_model(engine)
+    }
+
+    # Threads rather than processes: the fits release the GIL, the training data is not copied,
+    # and Celery's prefork workers are daemonic and cannot start child processes.
+    fold_cache = FoldCache(y_train, Config.TUNING_CV_FOLDS) if budget is not None else None
+
+    started = time.perf_counter()
+    workers = training_workers(len(models))
+    results = Parallel(n_jobs=workers, backend='threading')(
+        delayed(_train_classifier)(name, model, X_train, X_test, y_train, y_test, dataset_name, shap_background_data,
+                                   budget, fold_cache)
+        for name, model in models.items()
+    )
+    model_results = [result for result in results if result is not None]
+    for result in model_results:
+        if result["model_name"] == 'gradient_boosting':
+            result.update({"boosting_engine": engine, "boosting_engine_reason": engine_reason})
+    logger.info(f"Trained {len(model_results)}/{len(models)} classifiers for {dataset_name} with {workers} workers "
+                f"in {time.perf_counter() - started:.2f}s")
+
+    return model_results
+
+
+def boosting_engine(n_rows: int) -> tuple[str, str]:
+    """
+    ('exact' or 'histogram', reason) for the dropout gradient-boosting model.
+    BOOSTING_ENGINE forces one; 'auto' uses the histogram engine from
+    HISTOGRAM_BOOSTING_MIN_ROWS training rows, where exact boosting becomes the slowest fit.
+    """
+    if Config.BOOSTING_ENGINE in ('exact', 'histogram'):
+        return Config.BOOSTING_ENGINE, f"BOOSTING_ENGINE is set to '{Config.BOOSTING_ENGINE}'"
+    if n_rows >= Config.HISTOGRAM_BOOSTING_MIN_ROWS:
+        return 'histogram', f"{n_rows} training rows, at least HISTOGRAM_BOOSTING_MIN_ROWS ({Config.HISTOGRAM_BOOSTING_MIN_ROWS})"
+    return 'exact', f"{n_rows} training rows, below HISTOGRAM_BOOSTING_MIN_ROWS ({Config.HISTOGRAM_BOOSTING_MIN_ROWS})"
+
+
+def boosting_model(engine: str):
+    if engine == 'histogram':
+        # Binned, multithreaded (OpenMP) boosting that stops once a held-out share of the training rows stops improving.
+        return HistGradientBoostingClassifier(max_iter=Config.HISTOGRAM_BOOSTING_MAX_ITER, early_stopping=True,
+                                              validation_fraction=Config.HISTOGRAM_VALIDATION_FRACTION,
+                                              n_iter_no_change=Config.HISTOGRAM_N_ITER_NO_CHANGE, random_state=42)
+    return GradientBoostingClassifier()
+
+
+def training_workers(n_models: int) -> int:
+    """TRAINING_WORKERS if set, otherwise one worker per model up to the number of cores."""
+    if Config.TRAINING_WORKERS > 0:
+        return min(Config.TRAINING_WORKERS, n_models)
+    return max(1, min(n_models, os.cpu_count() or 1))
+
+
+def balanced_class_weight(model, y) -> dict | None:
+    """
+    The weights a 'balanced' class_weight gave the classes of `y`, keyed by
+    class as strings for Mongo; incremental updates reuse them (see
+    app.ml.incremental). None if the model was not fitted with balanced weights.
+    """
+    if getattr(model, 'class_weight', None) not in ('balanced', 'balanced_subsample'):
+        return None
+    classes = np.unique(y)
+    weights = compute_class_weight('balanced', classes=classes, y=np.asarray(y))
+    return {str(int(cls)): round(float(weight), 6) for cls, weight in zip(classes, weights)}
+
+
+def classification_metrics(y_true, y_pred, y_proba) -> dict:
+    metrics = {
+        "accuracy": accuracy_score(y_true, y_pred),
+        "precision": precision_score(y_true, y_pred, zero_division=0),
+        "recall": recall_score(y_true, y_pred, zero_division=0),
+        "f1_score": f1_score(y_true, y_pred, zero_division=0)
     }
+    # ROC AUC is undefined when the evaluated rows hold a single class (possible for small incremental batches)
+    metrics["roc_auc"] = roc_auc_score(y_true, y_proba) if len(np.unique(y_true)) > 1 else None
+    return metrics
+
+
+def save_classifier_artifacts(model, model_path: str, shap_background_data, X_check) -> dict:
+    """
+    Saves a fitted classifier with everything served alongside it: the SHAP
+    explainer and, for tree ensembles, the compiled arrays with the backend
+    choice verified on `X_check`. Returns those fields for the model's details.
+    """
+    dump_artifact(model, model_path)
+    prediction_cache.invalidate_model(model_path)
+    explainer_path = save_explainer(model, model_path, shap_background_data)
+    arrays_path, inference_backend, compiled_max_abs_diff = export_serving_arrays(model, model_path, X_check)
+    return {
+        "explainer_path": explainer_path,
+        "arrays_path": arrays_path,
+        "inference_backend": inference_backend,
+        "compiled_max_abs_diff": compiled_max_abs_diff
+    }
+
+
+def training_resources(meter: ResourceMeter, X, artifact_paths: list) -> dict:
+    """
+    Resource figures stored with a model's details: what its fit cost, the rows
+    and features it was fitted on, and the size and measured load time of each
+    artifact it is served from, as recorded in the artifact manifest.
+    """
+    artifacts = []
+    for path in artifact_paths:
+        entry = manifest_entry(path) if path else None
+        if entry is not None:
+            artifacts.append({"name": os.path.basename(path), "bytes": entry["bytes"],
+                              "load_seconds": entry["load_seconds"]})
+    return {
+        **meter.as_dict(),
+        "rows": int(X.shape[0]),
+        "features": int(X.shape[1]),
+        "artifact_bytes": sum(artifact["bytes"] for artifact in artifacts),
+        "load_seconds": round(sum(artifact["load_seconds"] for artifact in artifacts), 4),
+        "artifacts": artifacts
+    }
+
+
+def run_resources(meter: ResourceMeter, rows: int, details: list) -> dict:
+    """Totals of a training run for its trained_models document."""
+    return {
+        **meter.as_dict(),
+        "rows": rows,
+        "models": len(details),
+        "artifact_bytes": sum((detail.get("resources") or {}).get("artifact_bytes", 0) for detail in details)
+    }
+
+
+def encode_target(df: pd.DataFrame) -> pd.DataFrame:
+    """Maps Yes/No and boolean dropout labels to 1/0 in place."""
+    try:
+        df[TARGET_FEATURE] = df[TARGET_FEATURE].replace({
+            'Yes': 1, 'yes': 1,
+            'No': 0, 'no': 0,
+            True: 1,
+            False: 0
+        })
+        logger.info(f"Successfully converted '{TARGET_FEATURE}' column to 1/0 format.")
 
-    model_results = []
+    except Exception as e:
+        logger.warning(f"Error during conversion of '{TARGET_FEATURE}': {e}")
+    return df
+
+
+def _train_classifier(name, model, X_train, X_test, y_train, y_test, dataset_name, shap_background_data,
+                      budget=None, fold_cache=None):
+    """Tunes (with a budget), fits, evaluates and saves one classifier; returns its details or None."""
+    try:
+        tuning = None
+        if budget is not None:
+            space = 'hist_gradient_boosting' if isinstance(model, HistGradientBoostingClassifier) else name
+            best_params, tuning = successive_halving(space, model, X_train, np.asarray(y_train), budget, fold_cache)
+            model.set_params(**best_params)
 
-    for name, model in models.items():
-        try:
-            X_train, X_test, y_train, y_test = train_test_split(X_transformed, y, test_size=0.2, random_state=42, stratify=y)
+        with ResourceMeter() as meter:
             model.fit(X_train, y_train)
-            y_pred = model.predict(X_test)
-            y_proba = model.predict_proba(X_test)[:, 1]
-
-            model_dir = os.path.join(MODEL_DIR, dataset_name, name)
-            os.makedirs(model_dir, exist_ok=True)
-            model_path = os.path.join(model_dir, f"{TARGET_FEATURE}_{name}.pkl").replace("\\", "/")
-            joblib.dump(model, model_path)
-
-            model_results.append({
-                "type": "classification",
-                "target": TARGET_FEATURE,
-                "model_name": name,
-                "metrics": {
-                    "accuracy": accuracy_score(y_test, y_pred),
-                    "precision": precision_score(y_test, y_pred, zero_division=0),
-                    "recall": recall_score(y_test, y_pred, zero_division=0),
-                    "f1_score": f1_score(y_test, y_pred, zero_division=0),
-                    "roc_auc": roc_auc_score(y_test, y_proba)
-                },
-                "model_path": model_path
-            })
-
-        except Exception as e:
-            logger.error(f"Failed to train {name}: {e}")
+        fit_seconds = meter.wall_seconds
+        if hasattr(model, 'n_jobs'):
+            # Served models predict a row or a chunk at a time; a thread pool per call only adds latency.
+            model.n_jobs = None
+        y_pred = model.predict(X_test)
+        y_proba = model.predict_proba(X_test)[:, 1]
+
+        model_dir = os.path.join(MODEL_DIR, dataset_name, name)
+        os.makedirs(model_dir, exist_ok=True)
+        model_path = os.path.join(model_dir, f"{TARGET_FEATURE}_{name}.pkl").replace("\\", "/")
+        artifacts = save_classifier_artifacts(model, model_path, shap_background_data, X_test)
+        logger.info(f"Trained {name} for {dataset_name}: fit {fit_seconds:.2f}s")
+
+        return {
+            "type": "classification",
+            "target": TARGET_FEATURE,
+            "model_name": name,
+            "metrics": classification_metrics(y_test, y_pred, y_proba),
+            "model_path": model_path,
+            **artifacts,
+            "fit_seconds": round(fit_seconds, 3),
+            "estimator": type(model).__name__,
+            # Boosting iterations kept by early stopping
+            "n_iter": int(model.n_iter_) if isinstance(model, HistGradientBoostingClassifier) else None,
+            "class_weight": balanced_class_weight(model, y_train),
+            "resources": training_resources(meter, X_train,
+                                            [model_path, artifacts["explainer_path"], artifacts["arrays_path"]]),
+            "tuning": tuning
+        }
 
-    return model_results
+    except Exception as e:
+        logger.error(f"Failed to train {name}: {e}")
+        return None
 
 
 def train_regression_models(df: pd.DataFrame, dataset_name: str):
     """
-    Trains regression models for various features in the dataset.
-    Each model gets its own preprocessor and is saved to a unique file path.
+    Trains one linear regression imputer per numeric feature of the dataset.
+    A single preprocessor is fitted on all columns and saved once per dataset;
+    each imputer is trained on its output without the target's own column.
+    Targets are trained in parallel.
     """
     EXCLUDED_COLUMNS = [col for col in ['student_id'] if col in df.columns]
-    df_cleaned = df.copy()
-      
-    # CRITICAL FIX: Only apply the float conversion to non-categorical columns
-    numeric_cols_to_convert = [col for col in df_cleaned.columns if col not in EXCLUDED_COLUMNS + CATEGORICAL_COLUMNS]
-    for col in numeric_cols_to_convert:
-        if col in df_cleaned.columns:
-            df_cleaned[col] = df_cleaned[col].apply(try_convert_float)
-            
+    df_cleaned = df.drop(columns=EXCLUDED_COLUMNS)
+
+    # Only non-categorical columns are coerced to float; anything unparseable becomes NaN
+    numeric_cols_to_convert = [col for col in df_cleaned.columns if col not in CATEGORICAL_COLUMNS]
+    df_cleaned[numeric_cols_to_convert] = df_cleaned[numeric_cols_to_convert].apply(
+        lambda col: pd.to_numeric(col, errors='coerce').astype('float64'))
+
     # Convert categorical columns to the 'category' dtype for consistency
     for col in CATEGORICAL_COLUMNS:
         if col in df_cleaned.columns:
             df_cleaned[col] = df_cleaned[col].astype('category')
 
-    regression_targets = REGRESSION_TARGETS_LIST
     dataset_dir = os.path.join(MODEL_DIR, dataset_name).replace("\\", "/")
-    os.makedirs(dataset_dir, exist_ok=True)
-    model_results = []
-    
-    for target in regression_targets:
-        try:
-            X = df_cleaned.drop(columns=[target] + EXCLUDED_COLUMNS, errors='ignore')
-            y = df_cleaned[target]
-            
-            data_subset = pd.concat([X, y], axis=1).dropna(subset=[target])
-            if len(data_subset) < 10:
-                logger.warning(f"Insufficient data for regression on {target}. Skipping.")
-                continue
-
-            X_subset = data_subset.drop(columns=[target], errors='ignore')
-            y_subset = data_subset[target]
-
-            preprocessor, processed_feature_names = build_preprocessor(X_subset, target_to_exclude=target)
-            X_transformed = preprocessor.transform(X_subset)
-
-            preprocessor_path = os.path.join(dataset_dir, f"preprocessor_{target}.pkl").replace("\\", "/")
-            features_path = os.path.join(dataset_dir, f"features_{target}.pkl").replace("\\", "/")
-
-            # Save the preprocessor and feature names to their unique paths
-            joblib.dump(preprocessor, preprocessor_path)
-            joblib.dump(processed_feature_names, features_path)
-            logger.info(f"Saved preprocessor and features for {target} to unique paths.")
-
-            X_train, X_test, y_train, y_test = train_test_split(X_transformed, y_subset, test_size=0.2, random_state=42)
-
-            # Linear Regression
-            lr = LinearRegression()
-            lr.fit(X_train, y_train)
-            y_pred_lr = lr.predict(X_test)
-            lr_model_dir = os.path.join(dataset_dir, "lr")
-            os.makedirs(lr_model_dir, exist_ok=True)
-            lr_model_path = os.path.join(lr_model_dir, f"{target}.pkl").replace("\\", "/")
-            joblib.dump(lr, lr_model_path)
-            logger.info(f"Trained and saved Linear Regression model for {target} to {lr_model_path}")
-
-            model_results.append({
-                "type": "regression",
-                "target": target,
-                "model_name": "linear_regression",
-                "metrics": {
-                    "mse": mean_squared_error(y_test, y_pred_lr),
-                    "r2_score": r2_score(y_test, y_pred_lr)
-                },
-                "model_path": lr_model_path
-            })
-
-            # Random Forest Regressor
-            # rf = RandomForestRegressor(n_estimators=100, random_state=42)
-            # rf.fit(X_train, y_train)
-            # y_pred_rf = rf.predict(X_test)
-            # rf_model_dir = os.path.join(dataset_dir, "rf")
-            # os.makedirs(rf_model_dir, exist_ok=True)
-            # rf_model_path = os.path.join(rf_model_dir, f"{target}.pkl").replace("\\", "/")
-            # joblib.dump(rf, rf_model_path)
-            # logger.info(f"Trained and saved Random Forest Regressor model for {target} to {rf_model_path}")
-
-            # model_results.append({
-            #     "type": "regression",
-            #     "target": target,
-            #     "model_name": "random_forest",
-            #     "metrics": {
-            #         "mse": mean_squared_error(y_test, y_pred_rf),
-            #         "r2_score": r2_score(y_test, y_pred_rf)
-            #     },
-            #     "model_path": rf_model_path
-            # })
-
-        except Exception as e:
-            logger.error(f"Regression failed for {target}: {e}")
-
+    os.makedirs(os.path.join(dataset_dir, "lr"), exist_ok=True)
+
+    features = preprocess(df_cleaned, None, dataset_dir, 'regression', None)
+    preprocessor, processed_feature_names, X_all = features['preprocessor'], features['feature_names'], features['X']
+    preprocessor_path = os.path.join(dataset_dir, REGRESSION_PREPROCESSOR_FILE).replace("\\", "/")
+    dump_artifact(preprocessor, preprocessor_path)
+    dump_artifact(processed_feature_names, os.path.join(dataset_dir, REGRESSION_FEATURES_FILE).replace("\\", "/"))
+    logger.info(f"Saved the shared regression preprocessor for {dataset_name} to {preprocessor_path}")
+
+    targets = [target for target in REGRESSION_TARGETS_LIST if target in df_cleaned.columns]
+    started = time.perf_counter()
+    workers = training_workers(len(targets))
+    results = Parallel(n_jobs=workers, backend='threading')(
+        delayed(_train_regressor)(target, X_all, df_cleaned[target].to_numpy(),
+                                  regression_target_column(preprocessor, target), dataset_dir, preprocessor_path)
+        for target in targets
+    )
+    model_results = [result for result in results if result is not None]
+    logger.info(f"Trained {len(model_results)}/{len(targets)} regression imputers for {dataset_name} "
+                f"with {workers} workers in {time.perf_counter() - started:.2f}s")
+
+    _remove_legacy_regression_artifacts(dataset_dir, trained_targets={result["target"] for result in model_results})
     return model_results
 
-def train_all_models_and_save(df: pd.DataFrame, dataset_name: str, is_paid: bool):
 
+def _train_regressor(target, X_all, y_all, target_column, dataset_dir, preprocessor_path):
+    """Fits and saves the imputer of one target on the rows where it is observed; returns its details or None."""
     try:
-        df[TARGET_FEATURE] = df[TARGET_FEATURE].replace({
-            'Yes': 1, 'yes': 1,
-            'No': 0, 'no': 0,
-            True: 1,
-            False: 0
-        })        
-        logger.info(f"Successfully converted '{TARGET_FEATURE}' column to 1/0 format.")
+        observed = ~np.isnan(y_all)
+        if observed.sum() < 10:
+            logger.warning(f"Insufficient data for regression on {target}. Skipping.")
+            return None
+
+        X = X_all[observed] if target_column is None else np.delete(X_all[observed], target_column, axis=1)
+        X_train, X_test, y_train, y_test = train_test_split(X, y_all[observed], test_size=0.2, random_state=42)
+
+        lr = LinearRegression()
+        with ResourceMeter() as meter:
+            lr.fit(X_train, y_train)
+        fit_seconds = meter.wall_seconds
+        y_pred_lr = lr.predict(X_test)
+
+        lr_model_path = os.path.join(dataset_dir, "lr", f"{target}.pkl").replace("\\", "/")
+        dump_artifact(lr, lr_model_path)
+        logger.info(f"Trained and saved Linear Regression model for {target} to {lr_model_path}")
+
+        return {
+            "type": "regression",
+            "target": target,
+            "model_name": "linear_regression",
+            "metrics": {
+                "mse": mean_squared_error(y_test, y_pred_lr),
+                "r2_score": r2_score(y_test, y_pred_lr)
+            },
+            "model_path": lr_model_path,
+            "preprocessor_path": preprocessor_path,
+            "fit_seconds": round(fit_seconds, 3),
+            "resources": training_resources(meter, X_train, [lr_model_path])
+        }
 
     except Exception as e:
-        logger.warning(f"Error during conversion of '{TARGET_FEATURE}': {e}")
+        logger.error(f"Regression failed for {target}: {e}")
+        return None
 
-    classification_results = train_dropout_models(df, dataset_name)
-    regression_results = train_regression_models(df, dataset_name)
+
+def _remove_legacy_regression_artifacts(dataset_dir: str, trained_targets: set):
+    """
+    Deletes the per-target preprocessors of the old layout, and imputers of
+    targets that were not retrained, so none of them is loaded against the
+    new shared preprocessor.
+    """
+    for target in REGRESSION_TARGETS_LIST:
+        stale = [f"preprocessor_{target}.pkl", f"features_{target}.pkl"]
+        if target not in trained_targets:
+            stale.append(os.path.join("lr", f"{target}.pkl"))
+        for name in stale:
+            path = os.path.join(dataset_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+def train_all_models_and_save(df: pd.DataFrame, dataset_name: str, is_paid: bool, trained_by: dict | None = None,
+                              retrain_reason: str | None = None, tune: bool | None = None):
+    """
+    Trains every model of a dataset and records the run in trained_models.
+    `trained_by` ({'userId', 'username'}) defaults to the logged-in user of the
+    current request; background jobs, which have no session, pass it explicitly.
+    The run is the baseline later incremental updates are measured against.
+    `tune` (default TUNING_ENABLED) runs the budgeted hyperparameter search first.
+    Returns the model details of the run.
+    """
+    if trained_by is None:
+        trained_by = {"userId": session["user_id"], "username": session["username"]}
+
+    encode_target(df)
+
+    budget = default_budget() if (Config.TUNING_ENABLED if tune is None else tune) else None
+    with ResourceMeter() as meter:
+        classification_results = train_dropout_models(df, dataset_name, budget)
+        regression_results = train_regression_models(df, dataset_name)
 
     all_models = classification_results + regression_results
 
@@ -232,16 +420,20 @@ def train_all_models_and_save(df: pd.DataFrame, dataset_name: str, is_paid: bool
         # Assuming `trained_models_collection` is a MongoDB collection object
         trained_models_collection.insert_one({
             "dataset": dataset_name,
-            "trained_by": {
-                "userId": session["user_id"], # Ensure 'session' is accessible (from Flask context)
-                "username": session["username"]
-            },
+            "trained_by": trained_by,
             "created_at": datetime.now(timezone.utc),
             "is_paid": is_paid,
-            "details": all_models
+            "details": all_models,
+            "training_mode": "full",
+            "retrain_reason": retrain_reason,
+            "rows_at_full_train": len(df),
+            "rows_since_full_train": 0,
+            "tuning": budget.summary() if budget is not None else None,
+            "resources": run_resources(meter, len(df), all_models)
         })
         logger.info(f"Model training results saved to DB for dataset: {dataset_name}")
     except Exception as e:
         logger.error(f"Failed to save model training results to DB: {e}", exc_info=True)
     
-    logger.info(f"Completed full model training for dataset: {dataset_name}")
\ No newline at end of file
+    logger.info(f"Completed full model training for dataset: {dataset_name}")
+    return all_models
\ No newline at end of file
@@ -0,0 +1,315 @@
+# app/ml/training_jobs.py
+
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+from bson.objectid import ObjectId
+from celery import chain
+from flask import current_app
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from config import Config
+from app import celery_app
+from app.ml.artifact_cache import temp_path_for
+from app.ml.dataset_manager import validate_columns
+from app.ml.incremental import update_or_retrain
+from app.ml.job_heartbeat import fail_stale_jobs, heartbeat
+from app.ml.trainer import train_all_models_and_save
+from app.utils.mongodb_utils import save_dataset_to_mongodb
+from app.utils.notifications import send_role_notification
+
+logger = logging.getLogger(__name__)
+
+JOBS_COLLECTION = 'training_jobs'
+
+# Stages run in this order, each as its own Celery task; a stage only starts once the previous one succeeded.
+PIPELINE_STAGES = ['ingest', 'train', 'persist', 'notify']
+ACTIVE_STATUSES = ['queued', 'running']
+# 'full' trains on the uploaded file alone; 'append' adds its rows to the dataset's existing data and models.
+TRAINING_MODES = ['full', 'append']
+# Holds the dataset name while a job is active and None once it ended; a unique
+# index on it (see create_app) allows one active job per dataset.
+ACTIVE_DATASET_FIELD = 'active_dataset'
+
+
+def staging_path(uploads_dir: str, job_id: str) -> str:
+    """Where the raw uploaded file waits for the ingest stage."""
+    return os.path.join(uploads_dir, 'pending', f"{job_id}.csv")
+
+
+def increment_path(uploads_dir: str, job_id: str) -> str:
+    """Where an appended upload's new rows wait for the train and persist stages."""
+    return os.path.join(uploads_dir, 'pending', f"{job_id}.increment.csv")
+
+
+def create_training_job(db, dataset_name: str, uploads_dir: str, user_id: str, username: str, is_paid: bool,
+                        mode: str = 'full', tune: bool | None = None) -> str | None:
+    """
+    Records a queued upload-and-train job and returns its id, or None when the
+    dataset already has an active job. The caller saves the upload to `staging_path`.
+    """
+    expire_stale_jobs(db)
+    job_id = ObjectId()
+    try:
+        db[JOBS_COLLECTION].insert_one({
+            '_id': job_id,
+            'dataset_name': dataset_name,
+            ACTIVE_DATASET_FIELD: dataset_name,
+            'staging_path': staging_path(uploads_dir, str(job_id)),
+            'upload_path': os.path.join(uploads_dir, f"{dataset_name}.csv"),
+            'increment_path': increment_path(uploads_dir, str(job_id)),
+            'mode': mode,
+            'tune': tune,
+            'training_mode': None,
+            'is_paid': is_paid,
+            'created_by': ObjectId(user_id) if user_id else None,
+            'created_by_username': username,
+            'status': 'queued',
+            'current_stage': None,
+            'stages': {stage: {'status': 'pending', 'attempts': 0, 'seconds': None, 'error': None}
+                       for stage in PIPELINE_STAGES},
+            'rows': None,
+            'total_rows': None,
+            'models_trained': None,
+            'error': None,
+            'created_at': datetime.now(timezone.utc),
+            'updated_at': datetime.now(timezone.utc)
+        })
+    except DuplicateKeyError:
+        return None
+    return str(job_id)
+
+
+def get_training_job(db, job_id: str) -> dict | None:
+    if not ObjectId.is_valid(job_id):
+        return None
+    return db[JOBS_COLLECTION].find_one({'_id': ObjectId(job_id)})
+
+
+def expire_stale_jobs(db) -> int:
+    """Fails active jobs whose worker stopped responding, so their dataset can be trained again."""
+    return fail_stale_jobs(db[JOBS_COLLECTION], ACTIVE_STATUSES, **{ACTIVE_DATASET_FIELD: None})
+
+
+def fail_training_job(db, job_id: str, error: str):
+    """Marks a job that never reached a worker as failed, freeing its dataset."""
+    db[JOBS_COLLECTION].update_one({'_id': ObjectId(job_id)}, {'$set': {
+        'status': 'failed', 'error': error, ACTIVE_DATASET_FIELD: None, 'updated_at': datetime.now(timezone.utc)
+    }})
+
+
+def enqueue_training_job(db, job_id: str):
+    pipeline = chain(ingest_stage.si(job_id), train_stage.si(job_id), persist_stage.si(job_id), notify_stage.si(job_id))
+    result = pipeline.apply_async()
+    db[JOBS_COLLECTION].update_one({'_id': ObjectId(job_id)}, {'$set': {'celery_task_id': result.id}})
+
+
+def job_to_dict(job: dict) -> dict:
+    """JSON-friendly view of a job document for the upload page."""
+    return {
+        'job_id': str(job['_id']),
+        'dataset_name': job.get('dataset_name'),
+        'mode': job.get('mode', 'full'),
+        'training_mode': job.get('training_mode'),
+        'status': job.get('status'),
+        'current_stage': job.get('current_stage'),
+        'stages': [_stage_to_dict(stage, job.get('stages', {}).get(stage, {})) for stage in PIPELINE_STAGES],
+        'rows': job.get('rows'),
+        'total_rows': job.get('total_rows'),
+        'models_trained': job.get('models_trained'),
+        'error': job.get('error'),
+        'total_seconds': job.get('total_seconds'),
+        'created_at': job['created_at'].isoformat() if job.get('created_at') else None,
+        'finished_at': job['finished_at'].isoformat() if job.get('finished_at') else None
+    }
+
+
+def _stage_to_dict(name: str, stage: dict) -> dict:
+    started_at = stage.get('started_at')
+    return {
+        'name': name,
+        'status': stage.get('status'),
+        'attempts': stage.get('attempts', 0),
+        'seconds': stage.get('seconds'),
+        'error': stage.get('error'),
+        'started_at': started_at.isoformat() if started_at else None
+    }
+
+
+def _run_stage(task, job_id: str, stage: str, work):
+    """
+    Runs `work(db, job)` as one pipeline stage, recording its attempts, wall
+    time and outcome on the job. A failing stage is retried up to the task's
+    max_retries; when retries are exhausted the job is marked failed and the
+    exception propagates so Celery does not run the remaining stages.
+    """
+    db = current_app.db
+    jobs = db[JOBS_COLLECTION]
+    if get_training_job(db, job_id) is None:
+        logger.error(f"Training job {job_id} not found.")
+        raise LookupError(f"Training job {job_id} not found.")
+
+    # A job that failed, possibly as stale while this task waited in the queue, is not picked up again.
+    job = jobs.find_one_and_update({'_id': ObjectId(job_id), 'status': {'$in': ACTIVE_STATUSES}}, {
+        '$set': {'status': 'running', 'current_stage': stage, f'stages.{stage}.status': 'running',
+                 f'stages.{stage}.started_at': datetime.now(timezone.utc),
+                 'updated_at': datetime.now(timezone.utc)},
+        '$min': {'started_at': datetime.now(timezone.utc)},
+        '$inc': {f'stages.{stage}.attempts': 1}
+    }, return_document=ReturnDocument.AFTER)
+    if job is None:
+        logger.warning(f"Training job {job_id} is no longer active; skipping stage '{stage}'.")
+        return
+    job_filter = {'_id': job['_id']}
+    started = time.perf_counter()
+    try:
+        with heartbeat(jobs, {**job_filter, 'status': 'running'}):
+            fields = work(db, job) or {}
+    except Exception as e:
+        seconds = round(time.perf_counter() - started, 3)
+        if task.request.retries < task.max_retries:
+            logger.warning(f"Training job {job_id} stage '{stage}' failed, retrying: {e}")
+            jobs.update_one(job_filter, {'$set': {
+                f'stages.{stage}.status': 'retrying', f'stages.{stage}.error': str(e),
+                f'stages.{stage}.seconds': seconds, 'updated_at': datetime.now(timezone.utc)
+            }})
+            raise task.retry(exc=e)
+        logger.error(f"Training job {job_id} failed in stage '{stage}': {e}", exc_info=True)
+        jobs.update_one(job_filter, {'$set': {
+            'status': 'failed', 'error': f"{stage}: {e}", ACTIVE_DATASET_FIELD: None,
+            f'stages.{stage}.status': 'failed', f'stages.{stage}.error': str(e),
+            f'stages.{stage}.seconds': seconds,
+            'finished_at': datetime.now(timezone.utc), 'updated_at': datetime.now(timezone.utc)
+        }})
+        raise
+
+    seconds = round(time.perf_counter() - started, 3)
+    update = {f'stages.{stage}.status': 'completed', f'stages.{stage}.seconds': seconds,
+              f'stages.{stage}.error': None, 'updated_at': datetime.now(timezone.utc), **fields}
+    if stage == PIPELINE_STAGES[-1]:
+        finished_at = datetime.now(timezone.utc)
+        started_at = job.get('started_at') or finished_at
+        if started_at.tzinfo is None:
+            started_at = started_at.replace(tzinfo=timezone.utc)
+        update.update({'status': 'completed', 'current_stage': None, ACTIVE_DATASET_FIELD: None,
+                       'finished_at': finished_at,
+                       'total_seconds': round((finished_at - started_at).total_seconds(), 3)})
+    jobs.update_one(job_filter, {'$set': update})
+    logger.info(f"Training job {job_id} stage '{stage}' finished in {seconds:.2f}s")
+
+
+def _ingest(db, job):
+    """
+    Parses and validates the staged upload and moves it to the dataset's CSV in
+    uploads/. An appended upload is added to the existing CSV and its rows are
+    kept aside for the incremental update.
+    """
+    df = pd.read_csv(job['staging_path'])
+    missing = validate_columns(df)
+    if missing:
+        os.remove(job['staging_path'])
+        raise ValueError(f"Dataset is missing required columns: {', '.join(missing)}")
+    if job.get('mode') == 'append':
+        _append_rows(df, job['upload_path'])
+        os.replace(job['staging_path'], job['increment_path'])
+        previous = db[JOBS_COLLECTION].find_one({'dataset_name': job['dataset_name'], 'status': 'completed'},
+                                                {'total_rows': 1}, sort=[('created_at', -1)])
+        total_rows = previous.get('total_rows') if previous else None
+        return {'rows': len(df), 'total_rows': total_rows + len(df) if total_rows is not None else None}
+    tmp_path = temp_path_for(job['upload_path'])
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, job['upload_path'])
+    os.remove(job['staging_path'])
+    return {'rows': len(df), 'total_rows': len(df)}
+
+
+def _append_rows(df: pd.DataFrame, csv_path: str):
+    """
+    Adds `df`, aligned to the CSV's header, to the end of the CSV without
+    parsing its existing rows. The copy that receives the rows replaces the
+    original in one rename, so a crash never leaves a half-written dataset.
+    """
+    header = pd.read_csv(csv_path, nrows=0).columns
+    tmp_path = temp_path_for(csv_path)
+    try:
+        shutil.copyfile(csv_path, tmp_path)
+        with open(tmp_path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+        df.reindex(columns=header).to_csv(tmp_path, mode='a', header=False, index=False)
+        os.replace(tmp_path, csv_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _train(db, job):
+    trained_by = {'userId': str(job['created_by']) if job.get('created_by') else None,
+                  'username': job.get('created_by_username')}
+    if job.get('mode') == 'append':
+        # The full dataset is only read if the update turns into a full retrain.
+        training_mode, details = update_or_retrain(pd.read_csv(job['increment_path']), job['upload_path'],
+                                                   job['dataset_name'], job['is_paid'], trained_by)
+    else:
+        training_mode = 'full'
+        details = train_all_models_and_save(pd.read_csv(job['upload_path']), dataset_name=job['dataset_name'],
+                                            is_paid=job['is_paid'], trained_by=trained_by, tune=job.get('tune'))
+    if not any(detail.get('type') == 'classification' for detail in details):
+        raise RuntimeError("No classifier could be trained on this dataset.")
+    return {'models_trained': len(details), 'training_mode': training_mode}
+
+
+def _persist(db, job):
+    """Stores the uploaded rows; an appended upload stores only its new rows."""
+    appended = job.get('mode') == 'append'
+    df = pd.read_csv(job['increment_path'] if appended else job['upload_path'])
+    user_id = str(job['created_by']) if job.get('created_by') else None
+    save_dataset_to_mongodb(df, job['dataset_name'], user_id, job['is_paid'])
+    if appended:
+        os.remove(job['increment_path'])
+
+
+def _notify(db, job):
+    message = f"The model '{job['dataset_name']}' has been successfully trained."
+    send_role_notification(title="📢 New Model Trained", body=message, role="admin", url="/my-models")
+    db.alerts.insert_one({
+        "title": "📢 New Model Trained",
+        "body": message,
+        "role": "admin",
+        "created_at": datetime.now(timezone.utc),
+        "created_by": job.get('created_by')
+    })
+
+
+_retry_options = dict(max_retries=Config.TRAINING_STAGE_MAX_RETRIES,
+                      default_retry_delay=Config.TRAINING_STAGE_RETRY_DELAY_SECONDS)
+
+
+# A file that does not parse fails the same way on every attempt, so ingest is not retried.
+@celery_app.task(bind=True, max_retries=0)
+def ingest_stage(self, job_id):
+    _run_stage(self, job_id, 'ingest', _ingest)
+
+
+@celery_app.task(bind=True, **_retry_options)
+def train_stage(self, job_id):
+    _run_stage(self, job_id, 'train', _train)
+
+
+@celery_app.task(bind=True, **_retry_options)
+def persist_stage(self, job_id):
+    _run_stage(self, job_id, 'persist', _persist)
+
+
+@celery_app.task(bind=True, **_retry_options)
+def notify_stage(self, job_id):
+    _run_stage(self, job_id, 'notify', _notify)
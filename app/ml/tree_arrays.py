@@ -0,0 +1,280 @@
+# app/ml/tree_arrays.py
+
+import json
+import logging
+import os
+import uuid
+
+import numpy as np
+from scipy.special import expit
+from sklearn.ensemble import ExtraTreesClassifier, GradientBoostingClassifier, RandomForestClassifier
+
+from config import Config
+from app.ml.artifact_cache import artifact_cache, load_artifact, record_artifact, temp_path_for
+
+logger = logging.getLogger(__name__)
+
+ARRAY_FIELDS = ['feature', 'threshold', 'left', 'right', 'value', 'roots']
+TREE_LEAF = -1
+FORMAT_VERSION = 2
+
+INFERENCE_BACKENDS = ['compiled', 'sklearn']
+
+
+def arrays_dir_for(model_path: str) -> str:
+    """The array layout for `.../dropout_random_forest.pkl` lives in `.../dropout_random_forest_arrays/`."""
+    root, _ = os.path.splitext(model_path)
+    return f"{root}_arrays".replace("\\", "/")
+
+
+def _flatten_trees(trees: list, node_values, value_dtype=np.float64) -> dict:
+    """
+    Concatenates sklearn trees into flat node arrays with global child indices.
+    Leaves point to themselves, so traversal recognises them by left[node] == node
+    and extra steps past a leaf are harmless.
+    """
+    offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+    feature, threshold, left, right, value = [], [], [], [], []
+    for offset, tree in zip(offsets, trees):
+        is_leaf = tree.children_left == TREE_LEAF
+        own_index = np.arange(tree.node_count) + offset
+        feature.append(np.where(is_leaf, 0, tree.feature))
+        threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+        left.append(np.where(is_leaf, own_index, tree.children_left + offset))
+        right.append(np.where(is_leaf, own_index, tree.children_right + offset))
+        value.append(node_values(tree))
+    return {
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold).astype(np.float64),
+        'left': np.concatenate(left).astype(np.int32),
+        'right': np.concatenate(right).astype(np.int32),
+        'value': np.concatenate(value).astype(value_dtype),
+        'roots': offsets[:-1].astype(np.int32)
+    }
+
+
+def _class_distribution(tree):
+    value = tree.value[:, 0, :]
+    return value / value.sum(axis=1, keepdims=True)
+
+
+def compile_tree_arrays(model, value_dtype=np.float64) -> tuple[dict, dict] | None:
+    """
+    Converts a fitted forest or binary gradient-boosting classifier into
+    (arrays, meta), storing node values as `value_dtype`. Returns None for
+    models without a tree layout.
+    """
+    if isinstance(model, (RandomForestClassifier, ExtraTreesClassifier)):
+        trees = [est.tree_ for est in model.estimators_]
+        return layout_tree_arrays(trees, _class_distribution, {'kind': 'forest'},
+                                  model.n_features_in_, model.classes_.tolist(), value_dtype)
+    if isinstance(model, GradientBoostingClassifier) and model.n_classes_ == 2:
+        trees = [est.tree_ for est in model.estimators_[:, 0]]
+        if model.init_ == 'zero':
+            init_raw = 0.0
+        else:
+            prior = model.init_.predict_proba(np.zeros((1, model.n_features_in_)))[0, 1]
+            init_raw = float(np.log(prior / (1 - prior)))
+        meta = {'kind': 'boosting', 'init_raw': init_raw, 'learning_rate': float(model.learning_rate)}
+        return layout_tree_arrays(trees, lambda tree: tree.value[:, 0, :], meta,
+                                  model.n_features_in_, model.classes_.tolist(), value_dtype)
+    return None
+
+
+def layout_tree_arrays(trees: list, node_values, meta: dict, n_features: int, classes: list,
+                       value_dtype=np.float64) -> tuple[dict, dict]:
+    """
+    (arrays, meta) for any trees shaped like sklearn's `tree_` (children_left,
+    children_right, feature, threshold, node_count, max_depth), with
+    `node_values(tree)` giving each node's value rows. `meta` holds the
+    'kind' and, for boosting, 'init_raw' and 'learning_rate'.
+    """
+    arrays = _flatten_trees(trees, node_values, value_dtype)
+    meta.update({
+        'format_version': FORMAT_VERSION,
+        'n_features': int(n_features),
+        'classes': list(classes),
+        'n_trees': int(len(arrays['roots'])),
+        'max_depth': int(max(tree.max_depth for tree in trees)),
+        'n_nodes': int(len(arrays['feature'])),
+        'value_dtype': arrays['value'].dtype.name
+    })
+    return arrays, meta
+
+
+def export_tree_arrays(model, model_path: str, value_dtype=np.float64) -> str | None:
+    """
+    Writes the array layout next to the model.
+    Each write gets a new version suffix and meta.json is swapped in last, so
+    workers that already mapped the previous files keep reading a consistent copy.
+    """
+    compiled = compile_tree_arrays(model, value_dtype)
+    if compiled is None:
+        return None
+    return write_tree_arrays(*compiled, model_path)
+
+
+def write_tree_arrays(arrays: dict, meta: dict, model_path: str) -> str:
+    """Writes an (arrays, meta) layout to the model's arrays directory; see export_tree_arrays."""
+    arrays_dir = arrays_dir_for(model_path)
+    os.makedirs(arrays_dir, exist_ok=True)
+    meta['version'] = uuid.uuid4().hex[:12]
+
+    for field in ARRAY_FIELDS:
+        np.save(os.path.join(arrays_dir, f"{field}.{meta['version']}.npy"), arrays[field])
+
+    meta_path = os.path.join(arrays_dir, 'meta.json')
+    tmp_meta_path = temp_path_for(meta_path)
+    with open(tmp_meta_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta_path, meta_path)
+
+    for file_name in os.listdir(arrays_dir):
+        if file_name.endswith('.npy') and f".{meta['version']}." not in file_name:
+            os.remove(os.path.join(arrays_dir, file_name))
+
+    artifact_cache.invalidate(meta_path)
+    record_artifact(arrays_dir, lambda: TreeArrayModel.load(arrays_dir, Config.MODEL_MMAP_MODE),
+                    mmap_mode=Config.MODEL_MMAP_MODE, value_dtype=meta['value_dtype'])
+    logger.info(f"Tree array layout ({meta['n_trees']} trees, {meta['n_nodes']} nodes) saved to {arrays_dir}")
+    return arrays_dir
+
+
+class TreeArrayModel:
+    """
+    Read-only tree ensemble evaluated straight from the array layout.
+    With mmap_mode='r' the arrays stay in the shared page cache, so every
+    worker process serving the model uses the same physical copy.
+    """
+
+    def __init__(self, arrays: dict, meta: dict):
+        self.meta = meta
+        self.classes_ = np.array(meta['classes'])
+        self.n_features_in_ = meta['n_features']
+        for field in ARRAY_FIELDS:
+            setattr(self, field, arrays[field])
+
+    @classmethod
+    def load(cls, arrays_dir: str, mmap_mode: str | None = 'r'):
+        with open(os.path.join(arrays_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Tree arrays in {arrays_dir} use format {meta.get('format_version')}, expected {FORMAT_VERSION}.")
+        arrays = {
+            field: np.load(os.path.join(arrays_dir, f"{field}.{meta['version']}.npy"), mmap_mode=mmap_mode)
+            for field in ARRAY_FIELDS
+        }
+        return cls(arrays, meta)
+
+    def apply(self, X) -> np.ndarray:
+        """
+        Leaf node index of every (row, tree) pair. All (row, tree) pairs advance
+        together one level per step and pairs that reached a leaf are dropped,
+        so the Python loop runs at most max_depth times for any batch size.
+        """
+        # sklearn compares float32 features against float64 thresholds; layouts
+        # exported from other trainers record the input precision they split on.
+        X = np.asarray(X, dtype=self.meta.get('input_dtype', 'float32'))
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n_rows, n_features = X.shape
+        n_trees = len(self.roots)
+        X_flat = X.ravel()
+        node = np.tile(self.roots.astype(np.intp), n_rows)
+        row_offset = np.repeat(np.arange(n_rows) * n_features, n_trees)
+        active = np.arange(node.size)
+        while active.size:
+            current = node[active]
+            go_left = X_flat[row_offset[active] + self.feature[current]] <= self.threshold[current]
+            current = np.where(go_left, self.left[current], self.right[current])
+            node[active] = current
+            active = active[self.left[current] != current]
+        return node.reshape(n_rows, n_trees)
+
+    def predict_proba(self, X) -> np.ndarray:
+        leaves = self.apply(X)
+        # Node values may be stored as float32; sums are always taken in float64.
+        if self.meta['kind'] == 'forest':
+            return self.value[leaves].mean(axis=1, dtype=np.float64)
+        raw = self.meta['init_raw'] + self.meta['learning_rate'] * self.value[leaves, 0].sum(axis=1, dtype=np.float64)
+        positive = expit(raw)
+        return np.column_stack([1 - positive, positive])
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def verify_tree_arrays(model, arrays_dir: str, X) -> float:
+    """Largest absolute difference between the compiled and sklearn probabilities on `X`."""
+    compiled = TreeArrayModel.load(arrays_dir, mmap_mode=None)
+    return float(np.abs(compiled.predict_proba(X) - model.predict_proba(X)).max())
+
+
+def select_inference_backend(model, arrays_dir: str | None, X) -> tuple[str, float | None]:
+    """
+    Picks the backend recorded for a freshly trained model: the compiled
+    arrays when they reproduce sklearn within tolerance, otherwise sklearn.
+    Returns (backend, max_abs_diff).
+    """
+    if arrays_dir is None:
+        return 'sklearn', None
+    try:
+        max_abs_diff = verify_tree_arrays(model, arrays_dir, X)
+    except Exception as e:
+        logger.warning(f"Could not verify tree arrays in {arrays_dir}: {e}", exc_info=True)
+        return 'sklearn', None
+    if max_abs_diff > Config.COMPILED_INFERENCE_TOLERANCE:
+        logger.warning(f"Tree arrays in {arrays_dir} differ from sklearn by {max_abs_diff:.2e}; serving with sklearn.")
+        return 'sklearn', max_abs_diff
+    return Config.DEFAULT_INFERENCE_BACKEND, max_abs_diff
+
+
+def export_serving_arrays(model, model_path: str, X) -> tuple[str | None, str, float | None]:
+    """
+    Exports the array layout of a freshly trained model and selects its backend.
+    With ARTIFACT_FLOAT32_TREE_VALUES node values are stored as float32 when that
+    layout reproduces sklearn within tolerance on `X`, halving the largest
+    array; otherwise they are exported as float64.
+    Returns (arrays_dir, backend, max_abs_diff).
+    """
+    if Config.ARTIFACT_FLOAT32_TREE_VALUES:
+        arrays_dir = export_tree_arrays(model, model_path, value_dtype=np.float32)
+        if arrays_dir is None:
+            return None, 'sklearn', None
+        try:
+            max_abs_diff = verify_tree_arrays(model, arrays_dir, X)
+        except Exception as e:
+            logger.warning(f"Could not verify float32 tree arrays in {arrays_dir}: {e}")
+            max_abs_diff = None
+        if max_abs_diff is not None and max_abs_diff <= Config.COMPILED_INFERENCE_TOLERANCE:
+            return arrays_dir, Config.DEFAULT_INFERENCE_BACKEND, max_abs_diff
+        logger.info(f"float32 node values in {arrays_dir} differ from sklearn by {max_abs_diff}; exporting float64.")
+    arrays_dir = export_tree_arrays(model, model_path)
+    return (arrays_dir, *select_inference_backend(model, arrays_dir, X))
+
+
+def inference_backend_for(model_doc: dict | None, model_path: str) -> str | None:
+    """The backend selected for `model_path` in its trained_models document, if any."""
+    for detail in (model_doc or {}).get('details', []):
+        if detail.get('model_path') == model_path:
+            return detail.get('inference_backend')
+    return None
+
+
+def load_serving_model(model_path: str, backend: str | None = None):
+    """
+    Model object used for predictions. The 'compiled' backend (the default when
+    arrays were exported) evaluates the memory-mapped array layout; 'sklearn',
+    or a model without arrays, uses the pickled sklearn model.
+    """
+    backend = backend or Config.DEFAULT_INFERENCE_BACKEND
+    arrays_dir = arrays_dir_for(model_path)
+    meta_path = os.path.join(arrays_dir, 'meta.json').replace("\\", "/")
+    if backend == 'compiled' and os.path.exists(meta_path):
+        try:
+            # Only meta.json counts against the cache budget: the arrays live in the page cache.
+            return artifact_cache.get(arrays_dir, [meta_path],
+                                      lambda: TreeArrayModel.load(arrays_dir, Config.MODEL_MMAP_MODE))
+        except ValueError as e:
+            logger.warning(f"{e} Falling back to the sklearn model.")
+    return load_artifact(model_path)
@@ -0,0 +1,190 @@
+# app/ml/tuning.py
+
+import logging
+import threading
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from scipy.stats import loguniform
+from sklearn.base import clone
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import ParameterSampler, StratifiedKFold
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Parameters searched per classifier; anything not listed keeps the value set in train_dropout_models.
+SEARCH_SPACES = {
+    'random_forest': {
+        'n_estimators': [100, 200, 300],
+        'max_depth': [None, 8, 16, 32],
+        'min_samples_leaf': [1, 2, 4, 8],
+        'max_features': ['sqrt', 'log2', 0.5]
+    },
+    'logistic_regression': {
+        'C': loguniform(1e-3, 1e2)
+    },
+    'gradient_boosting': {
+        'n_estimators': [100, 200, 300],
+        'learning_rate': loguniform(0.01, 0.3),
+        'max_depth': [2, 3, 4, 5],
+        'subsample': [0.7, 0.85, 1.0]
+    },
+    # The number of iterations is left to early stopping.
+    'hist_gradient_boosting': {
+        'learning_rate': loguniform(0.01, 0.3),
+        'max_leaf_nodes': [15, 31, 63],
+        'min_samples_leaf': [10, 20, 50],
+        'l2_regularization': [0.0, 0.1, 1.0]
+    }
+}
+
+
+class SearchBudget:
+    """
+    Wall-clock and CPU seconds the tuning of one training run may use, shared by
+    every model tuned in it. CPU time is the whole process's, so it counts all
+    threads doing search work.
+    """
+
+    def __init__(self, wall_seconds: float, cpu_seconds: float):
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.wall_spent = 0.0
+        self.cpu_spent = 0.0
+        self._lock = threading.Lock()
+
+    def wall_used(self) -> float:
+        return time.perf_counter() - self.started
+
+    def cpu_used(self) -> float:
+        return time.process_time() - self.cpu_started
+
+    def exhausted(self) -> bool:
+        return self.wall_used() >= self.wall_seconds or self.cpu_used() >= self.cpu_seconds
+
+    def record(self):
+        """Marks search work done up to now; the run's cost is taken at the last fold fitted by any search."""
+        with self._lock:
+            self.wall_spent = max(self.wall_spent, self.wall_used())
+            self.cpu_spent = max(self.cpu_spent, self.cpu_used())
+
+    def summary(self) -> dict:
+        return {
+            'wall_seconds_budget': self.wall_seconds,
+            'cpu_seconds_budget': self.cpu_seconds,
+            'wall_seconds': round(self.wall_spent, 3),
+            'cpu_seconds': round(self.cpu_spent, 3),
+            'exhausted': self.wall_spent >= self.wall_seconds or self.cpu_spent >= self.cpu_seconds
+        }
+
+
+def default_budget() -> SearchBudget:
+    return SearchBudget(Config.TUNING_WALL_SECONDS, Config.TUNING_CPU_SECONDS)
+
+
+class FoldCache:
+    """
+    Stratified CV folds computed once per subsample size and shared by every
+    candidate and every model searched on the same training rows. Subsamples
+    are prefixes of one stratified shuffle, so each rung's rows contain the
+    previous rung's.
+    """
+
+    def __init__(self, y, n_splits: int, random_state: int = 42):
+        self.y = np.asarray(y)
+        self.n_splits = n_splits
+        self.random_state = random_state
+        # Interleave the shuffled rows of each class so any prefix keeps the class balance.
+        rng = np.random.default_rng(random_state)
+        classes, y_idx = np.unique(self.y, return_inverse=True)
+        per_class = [rng.permutation(np.flatnonzero(y_idx == k)) for k in range(len(classes))]
+        positions = np.concatenate([np.arange(len(rows)) / len(rows) for rows in per_class])
+        self.order = np.concatenate(per_class)[np.argsort(positions, kind='stable')]
+        self._folds = {}
+        self._lock = threading.Lock()
+
+    def folds(self, n_rows: int) -> list:
+        with self._lock:
+            if n_rows not in self._folds:
+                rows = self.order[:n_rows]
+                splitter = StratifiedKFold(n_splits=self.n_splits, shuffle=True, random_state=self.random_state)
+                self._folds[n_rows] = [(rows[train], rows[test]) for train, test in splitter.split(rows, self.y[rows])]
+            return self._folds[n_rows]
+
+
+def _cv_score(estimator, params: dict, X, y, folds: list, budget: SearchBudget) -> float | None:
+    """Mean ROC AUC of one candidate over the folds, or None if the budget ran out before its last fold."""
+    scores = []
+    for train, test in folds:
+        if budget.exhausted():
+            return None
+        model = clone(estimator).set_params(**params)
+        model.fit(X[train], y[train])
+        scores.append(roc_auc_score(y[test], model.predict_proba(X[test])[:, 1]))
+        budget.record()
+    return float(np.mean(scores))
+
+
+def successive_halving(name: str, estimator, X, y, budget: SearchBudget, fold_cache: FoldCache) -> tuple[dict, dict]:
+    """
+    Successive-halving random search over SEARCH_SPACES[name]: every sampled
+    candidate is scored on a small stratified subsample, and the best
+    1/TUNING_FACTOR of them move on to TUNING_FACTOR times more rows; the last
+    rung, with TUNING_FACTOR or fewer candidates, uses all rows. Candidates are
+    scored in parallel. Each fold is only fitted while the budget lasts, so the
+    search overruns it by at most the fits already running when it runs out.
+    The winner is the best candidate of the last rung that scored any.
+
+    Returns (best params, search report). Best params are {} when nothing was
+    scored, leaving the estimator's defaults.
+    """
+    y = np.asarray(y)
+    factor = Config.TUNING_FACTOR
+    candidates = list(ParameterSampler(SEARCH_SPACES[name], n_iter=Config.TUNING_CANDIDATES, random_state=42))
+    rungs_needed, remaining = 1, len(candidates)
+    while remaining > factor:
+        remaining //= factor
+        rungs_needed += 1
+    n_rows = max(fold_cache.n_splits * 20, len(y) // factor ** (rungs_needed - 1))
+
+    wall_started = budget.wall_used()
+    rungs, best_params, best_score = [], {}, None
+    while candidates:
+        n_rows = min(n_rows, len(y))
+        folds = fold_cache.folds(n_rows)
+        scores = Parallel(n_jobs=Config.TUNING_N_JOBS, backend='threading')(
+            delayed(_cv_score)(estimator, params, X, y, folds, budget) for params in candidates
+        )
+        scored = [(score, params) for score, params in zip(scores, candidates) if score is not None]
+        if not scored:
+            break
+        scored.sort(key=lambda item: item[0], reverse=True)
+        best_score, best_params = scored[0]
+        rungs.append({'rows': n_rows, 'candidates': len(candidates), 'scored': len(scored), 'best_score': round(best_score, 4)})
+
+        candidates = [params for _, params in scored[:len(scored) // factor]]
+        if len(candidates) <= 1 or n_rows >= len(y) or budget.exhausted():
+            break
+        n_rows *= factor
+
+    report = {
+        'best_params': {key: _plain(value) for key, value in best_params.items()},
+        'best_cv_roc_auc': round(best_score, 4) if best_score is not None else None,
+        'rungs': rungs,
+        'candidates_scored': sum(rung['scored'] for rung in rungs),
+        'wall_seconds': round(budget.wall_used() - wall_started, 3),
+        'budget_exhausted': budget.exhausted()
+    }
+    logger.info(f"Tuned {name}: {report['best_params']} (CV ROC AUC {report['best_cv_roc_auc']}) "
+                f"in {report['wall_seconds']}s over {len(rungs)} rungs")
+    return best_params, report
+
+
+def _plain(value):
+    """Numpy scalars as plain Python values so the parameters can be stored in MongoDB."""
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,117 @@
+# app/ml/warmup.py
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from flask import current_app
+
+from config import Config
+from app.ml.artifact_cache import load_artifact
+from app.ml.dataset_manager import BACKGROUND_DATA_PATH, PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH, load_preprocessor
+from app.ml.explainers import load_explainer, positive_class_contributions
+from app.ml.imputation import load_imputer_bundle
+from app.ml.tree_arrays import load_serving_model
+
+logger = logging.getLogger(__name__)
+
+_state = {'status': 'pending', 'pid': None}
+_lock = threading.Lock()
+
+
+def warmup_state() -> dict:
+    """
+    Warm-up progress of this process. A process forked after warm-up started
+    (gunicorn --preload, Celery prefork) has not warmed its own copy yet and
+    reports 'pending'.
+    """
+    with _lock:
+        if _state.get('pid') != os.getpid():
+            return {'status': 'pending'}
+        return dict(_state)
+
+
+def active_models(db) -> list:
+    """(dataset, model_path, inference_backend) of every classifier in the latest training run of each dataset."""
+    latest_runs = db.trained_models.aggregate([
+        {'$sort': {'created_at': -1}},
+        {'$group': {'_id': '$dataset', 'details': {'$first': '$details'}}}
+    ])
+    models = []
+    for run in latest_runs:
+        for detail in run.get('details') or []:
+            if detail.get('type') == 'classification' and detail.get('model_path'):
+                models.append((run['_id'], detail['model_path'], detail.get('inference_backend')))
+    return models
+
+
+def warm_up(app):
+    """
+    Loads the preprocessor, every active model, its explainer and its dataset's
+    imputers into this process's caches. It also runs one background row
+    through each model and explainer, so the first request does not pay for
+    lazy imports and first-call setup. A failing model is logged and skipped.
+    """
+    with _lock:
+        _state.clear()
+        _state.update({'status': 'running', 'pid': os.getpid(),
+                       'started_at': datetime.now(timezone.utc).isoformat()})
+    started = time.perf_counter()
+    warmed, errors = 0, []
+
+    with app.app_context():
+        try:
+            load_preprocessor(PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH)
+            sample = np.asarray(load_artifact(BACKGROUND_DATA_PATH))[:1] if os.path.exists(BACKGROUND_DATA_PATH) else None
+            models = active_models(current_app.db)
+        except Exception as e:
+            logger.error(f"Model warm-up could not start: {e}", exc_info=True)
+            models, sample = [], None
+            errors.append(str(e))
+
+        warmed_datasets = set()
+        for dataset_name, model_path, inference_backend in models:
+            try:
+                model = load_serving_model(model_path, inference_backend)
+                explainer = load_explainer(model_path)
+                if sample is not None:
+                    model.predict_proba(sample)
+                    positive_class_contributions(explainer, sample)
+                if dataset_name not in warmed_datasets:
+                    load_imputer_bundle(dataset_name)
+                    warmed_datasets.add(dataset_name)
+                warmed += 1
+            except Exception as e:
+                logger.warning(f"Warm-up of {model_path} failed: {e}")
+                errors.append(f"{model_path}: {e}")
+
+    with _lock:
+        _state.update({'status': 'ready', 'finished_at': datetime.now(timezone.utc).isoformat(),
+                       'seconds': round(time.perf_counter() - started, 3), 'models': warmed, 'errors': errors})
+    logger.info(f"Model warm-up finished: {warmed} models in {time.perf_counter() - started:.2f}s, {len(errors)} errors.")
+
+
+def start_warm_up(app):
+    """
+    Starts warm-up according to MODEL_WARMUP: 'background' (default) warms in a
+    daemon thread while the process starts serving and /ready returns 503,
+    'blocking' warms before returning, 'off' marks the process ready at once.
+    """
+    with _lock:
+        if _state.get('pid') == os.getpid() and _state['status'] in ('running', 'ready'):
+            return
+        if Config.MODEL_WARMUP == 'off':
+            _state.clear()
+            _state.update({'status': 'ready', 'pid': os.getpid(), 'models': 0, 'errors': []})
+            return
+        # Claim the warm-up for this process before the thread starts.
+        _state.clear()
+        _state.update({'status': 'running', 'pid': os.getpid()})
+
+    if Config.MODEL_WARMUP == 'blocking':
+        warm_up(app)
+    else:
+        threading.Thread(target=warm_up, args=(app,), name='model-warmup', daemon=True).start()
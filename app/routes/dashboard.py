@@ -8,14 +8,22 @@ import numpy as np
 import pandas as pd
 import subprocess
 from config import Config
-from flask import Blueprint, json, jsonify, render_template, request, session, redirect, url_for, flash
+from flask import Blueprint, Response, json, jsonify, render_template, request, session, redirect, stream_with_context, url_for, flash
 from app.ml.dataset_manager import TARGET_FEATURE, validate_columns
-from app.ml.predictors import predict, predict_missing_fields
-from app.ml.trainer import train_all_models_and_save
+from app.ml.explainers import EXPLANATION_LEVELS
+from app.ml.imputation import impute_missing_fields
+from app.ml.predictors import predict, predict_batch, predict_missing_fields
+from app.ml.training_jobs import (
+    create_training_job, enqueue_training_job,
+    expire_stale_jobs as expire_stale_training_jobs, fail_training_job, get_training_job,
+    job_to_dict as training_job_to_dict, staging_path as training_staging_path
+)
 from app.ml.anomaly_detector import detect_anomalies_from_db, detect_anomalies_from_df, get_insights
+from app.ml.artifact_cache import artifact_cache, worker_memory
+from app.ml.prediction_cache import prediction_cache
+from app.ml.tree_arrays import INFERENCE_BACKENDS, arrays_dir_for, inference_backend_for
 from app.utils.auth_decorators import login_required
-from app.utils.mongodb_utils import save_dataset_to_mongodb
-from app.utils.notifications import send_role_notification
+from app.utils.batch_input import iter_batch_chunks
 from app.utils.hdfs import hdfs_file_count, hdfs_test, upload_file_to_hdfs_temp
 from app.utils.role_required import role_required
 from app import mongo
@@ -114,62 +122,64 @@ def dashboard_view():
 @login_required
 @role_required(["admin", "analyst"])
 def upload_data():
-    print('Route accessed')
     if request.method == "POST":
-        print('Route accessed by POST')
         file = request.files.get("dataset")
-        model_name = request.form.get("model_name").strip()
-        is_paid = True if request.form.get("is_paid") == "on" else False
+        model_name = (request.form.get("model_name") or "").strip()
+        is_paid = request.form.get("is_paid") in ("on", "true")
+        mode = "append" if request.form.get("append") in ("on", "true") else "full"
+        tune = True if request.form.get("tune") in ("on", "true") else None
 
         if not file or file.filename == "":
-            flash("No file selected.", "danger")
-            return redirect(request.url)
+            return jsonify({"success": False, "message": "No file selected."}), 400
+        if not model_name:
+            return jsonify({"success": False, "message": "Model name is required."}), 400
 
+        job_id = None
         try:
-            df = pd.read_csv(file)
-            missing = validate_columns(df)
+            # Only the header is read here; parsing the rows is the ingest stage's job.
+            missing = validate_columns(pd.read_csv(file.stream, nrows=0))
             if missing:
-                flash(f"Dataset is missing required columns: {', '.join(missing)}", "danger")
-                return redirect(request.url)
-
-            upload_path = os.path.join(UPLOADS_DIR, f"{model_name}.csv")
-            df.to_csv(upload_path, index=False)
-
-            df['dropout'] = df['dropout'].values
-
-            train_all_models_and_save(df, dataset_name=model_name, is_paid=is_paid)
-
-            save_dataset_to_mongodb(df, model_name, session['user_id'], is_paid)
-            # flash(f"✅ Model '{model_name}' trained and saved!", "success")
-            try:
-                send_role_notification(
-                    title="📢 New Model Trained",
-                    body=f"The model '{model_name}' has been successfully trained.",
-                    role="admin",
-                    url="/my-models"
-                )
-                db.alerts.insert_one({
-                    "title": "📢 New Model Trained",
-                    "body": f"The model '{model_name}' has been successfully trained.",
-                    "role": "admin",
-                    "created_at": datetime.now(timezone.utc),
-                    "created_by": ObjectId(session['user_id'])
-                })
-            except Exception as e:
-                logger.exception("Error sending notifications")
-                flash(f"Error: {e}", "danger")
-
-            # return redirect(url_for("dashboard.upload_data"))
-            return jsonify({"success": True, "message": f"Model '{model_name}' trained successfully."})
-
+                return jsonify({"success": False, "message": f"Dataset is missing required columns: {', '.join(missing)}"}), 400
+            file.stream.seek(0)
+
+            if mode == "append" and not os.path.exists(os.path.join(UPLOADS_DIR, f"{model_name}.csv")):
+                return jsonify({"success": False, "message": f"There is no dataset '{model_name}' to append to."}), 400
+
+            job_id = create_training_job(db, model_name, UPLOADS_DIR, session.get('user_id'), session.get('username'),
+                                         is_paid, mode=mode, tune=tune)
+            if job_id is None:
+                return jsonify({"success": False, "message": f"Model '{model_name}' is already being trained."}), 409
+            job_file = training_staging_path(UPLOADS_DIR, job_id)
+            os.makedirs(os.path.dirname(job_file), exist_ok=True)
+            file.save(job_file)
         except Exception as e:
             logger.exception("Error during upload:")
-            flash(f"Error processing file: {e}", "danger")
+            if job_id:
+                fail_training_job(db, job_id, str(e))
+            return jsonify({"success": False, "message": f"Error processing file: {e}"}), 500
 
-        return redirect(url_for("dashboard.upload_data"))
+        try:
+            enqueue_training_job(db, job_id)
+        except Exception as e:
+            logger.error(f"Failed to enqueue training job {job_id}: {e}", exc_info=True)
+            fail_training_job(db, job_id, str(e))
+            return jsonify({"success": False, "message": "Could not queue the training job."}), 500
+
+        logger.info(f"Queued training job {job_id} for dataset '{model_name}'.")
+        return jsonify({"success": True, "message": f"Training of '{model_name}' queued.", "job_id": job_id}), 202
 
     return render_template("dashboard/upload.html")
 
+@dashboard_bp.route("/api/training-jobs/<job_id>", methods=["GET"])
+@login_required
+@role_required(["admin", "analyst"])
+def training_job_status(job_id):
+    expire_stale_training_jobs(db)
+    job = get_training_job(db, job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+    return jsonify({"status": "success", "job": training_job_to_dict(job)}), 200
+
 # ===================================
 # VIEW AVAILABLE MODELS ROUTE
 # =================================== 
@@ -189,6 +199,9 @@ def my_models():
         if 'details' in model_doc and isinstance(model_doc['details'], list):
             filtered_details = []
             regression_model_added = False
+            # Only one regression card is shown per run; it lists the resources of every target.
+            model_doc['regression_details'] = [detail for detail in model_doc['details']
+                                               if detail.get('type') == 'regression']
             for detail in model_doc['details']:
                 if 'type' in detail:
                     detail['type'] = detail['type'].replace('_', ' ').title()
@@ -269,7 +282,10 @@ def predict_form():
             imputed_input_data_dict = predict_missing_fields(input_data, dataset_name_for_imputation)
             df_data = pd.DataFrame([imputed_input_data_dict])
 
-            prediction_class, probabilities, recommendations = predict(data=df_data, model_name=model_path)
+            prediction_class, probabilities, recommendations = predict(
+                data=df_data, model_name=model_path,
+                inference_backend=inference_backend_for(model_doc, model_path)
+            )
 
             logger.info(f"Prediction successful using model: {model_path}")
             return jsonify({
@@ -284,6 +300,122 @@ def predict_form():
 
     return render_template("dashboard/predict.html", available_models=available_models)
 
+@dashboard_bp.route("/api/model-cache-stats", methods=["GET"])
+@login_required
+@role_required(["admin"])
+def model_cache_stats():
+    return jsonify({
+        "status": "success",
+        "artifact_cache": artifact_cache.stats(),
+        "prediction_cache": prediction_cache.stats(),
+        "worker_memory": worker_memory()
+    })
+
+@dashboard_bp.route("/api/models/inference-backend", methods=["POST"])
+@login_required
+@role_required(["admin"])
+def set_inference_backend():
+    """Switches a trained model between the compiled tree arrays and the sklearn pickle."""
+    data = request.get_json() or {}
+    model_path = data.get("model_path")
+    backend = data.get("backend")
+    if not model_path or backend not in INFERENCE_BACKENDS:
+        return jsonify({"error": f"Provide model_path and a backend in {INFERENCE_BACKENDS}."}), 400
+
+    if backend == "compiled" and not os.path.exists(os.path.join(arrays_dir_for(model_path), "meta.json")):
+        return jsonify({"error": "This model has no compiled tree arrays."}), 400
+
+    result = db.trained_models.update_one(
+        {"details.model_path": model_path},
+        {"$set": {"details.$.inference_backend": backend}}
+    )
+    if result.matched_count == 0:
+        return jsonify({"error": "Model not found."}), 404
+
+    logger.info(f"Inference backend for {model_path} set to {backend}.")
+    return jsonify({"status": "success", "model_path": model_path, "inference_backend": backend})
+
+# ===================================
+# STREAMING BATCH PREDICTION API
+# ===================================
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+@dashboard_bp.route("/api/predict-batch", methods=["POST"])
+@login_required
+@role_required(["admin", "analyst"])
+def predict_batch_api():
+    """
+    Scores a CSV or NDJSON body of student feature rows with the model given in
+    ?model=<model_path>. Rows are read, imputed and scored in fixed-size chunks and
+    results are streamed back as NDJSON as each chunk finishes. ?explanation=
+    none|approximate|exact picks how recommendations are derived.
+    """
+    model_path = request.args.get("model")
+    if not model_path:
+        return jsonify({"error": "Invalid input. Model not specified."}), 400
+
+    model_doc = db.trained_models.find_one({"details.model_path": model_path})
+    if not model_doc:
+        logger.error(f"Model not found for path: {model_path}")
+        return jsonify({"error": "Model not found."}), 404
+
+    user = db.users.find_one({"_id": ObjectId(session["user_id"])})
+    user_plan = user.get("plan", "free") if user else "free"
+    if model_doc.get("is_paid") and user_plan != "premium":
+        return jsonify({"error": "This model requires a premium plan."}), 403
+
+    dataset_name = model_doc.get("dataset")
+    if not dataset_name:
+        logger.error("Dataset name for imputation missing in model document.")
+        return jsonify({"error": "Model dataset not specified for imputation."}), 400
+
+    chunks = iter_batch_chunks(request.stream, request.mimetype, Config.BATCH_API_CHUNK_SIZE)
+    if chunks is None:
+        return jsonify({"error": "Send text/csv or application/x-ndjson."}), 415
+    inference_backend = inference_backend_for(model_doc, model_path)
+    explanation = request.args.get("explanation", Config.BULK_EXPLANATION_LEVEL)
+    if explanation not in EXPLANATION_LEVELS:
+        return jsonify({"error": f"explanation must be one of {EXPLANATION_LEVELS}."}), 400
+
+    def generate():
+        started = datetime.now(timezone.utc)
+        rows_completed = 0
+        try:
+            for chunk in chunks:
+                chunk = impute_missing_fields(chunk, dataset_name)
+                prediction_classes, probabilities, recommendations = predict_batch(
+                    chunk, model_path, inference_backend, explanation
+                )
+                student_ids = chunk["student_id"].tolist() if "student_id" in chunk.columns else [None] * len(chunk)
+
+                lines = []
+                for i in range(len(chunk)):
+                    lines.append(json.dumps({
+                        "row": rows_completed + i,
+                        "student_id": _json_value(student_ids[i]),
+                        "prediction_class": int(prediction_classes[i]),
+                        "prediction_probability": float(probabilities[i][1]) if probabilities is not None else None,
+                        "recommendations": recommendations[i]
+                    }))
+                rows_completed += len(chunk)
+                yield "\n".join(lines) + "\n"
+        except Exception as e:
+            logger.exception("Error during streaming batch prediction.")
+            yield json.dumps({"error": str(e), "rows_completed": rows_completed}) + "\n"
+            return
+
+        seconds = (datetime.now(timezone.utc) - started).total_seconds()
+        logger.info(f"Batch API scored {rows_completed} rows with {model_path} in {seconds:.2f}s.")
+        yield json.dumps({"summary": {"rows": rows_completed, "seconds": round(seconds, 3)}}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 @dashboard_bp.route('/dataset')
 @login_required
 def dataset():
@@ -1,7 +1,19 @@
-from flask import Blueprint, redirect, render_template, session, url_for
+from flask import Blueprint, current_app, jsonify, redirect, render_template, session, url_for
+
+from app.ml.warmup import start_warm_up, warmup_state
 
 home_bp = Blueprint("home", __name__)
 
+@home_bp.route("/ready")
+def ready():
+        """Readiness probe for the load balancer: 200 once this worker has warmed its models, 503 before."""
+        state = warmup_state()
+        if state['status'] == 'pending':
+                # Forked from a process that warmed up before the fork; warm this copy now.
+                start_warm_up(current_app._get_current_object())
+                state = warmup_state()
+        return jsonify(state), 200 if state['status'] == 'ready' else 503
+
 @home_bp.route("/home")
 def home():
         return render_template("i_interface/home.html")
@@ -3,10 +3,19 @@ from datetime import datetime, timezone
 import logging
 from bson import ObjectId
 from flask import Blueprint, flash, jsonify, redirect, render_template, request, session, url_for
-import pandas as pd
 
 from app.ml.model_utils import get_classification_models_summary  
-from app.ml.predictors import predict
+from app.ml.prediction_jobs import (
+    ACTIVE_STATUSES, JOBS_COLLECTION, create_prediction_job, enqueue_prediction_job,
+    expire_stale_jobs, get_prediction_job, job_to_dict, request_cancel, requeue_job
+)
+from config import Config
+from app.ml.bulk_scoring import build_feature_frame
+from app.ml.explainers import EXPLANATION_LEVELS
+from app.ml.feature_versions import FEATURE_VERSION_FIELD, stamp_feature_version
+from app.ml.imputation import impute_missing_fields
+from app.ml.predictors import explain_batch
+from app.ml.tree_arrays import inference_backend_for
 from app.utils.auth_decorators import login_required
 from app.utils.role_required import role_required
 from app import mongo
@@ -53,7 +62,7 @@ def update_student(id):
         if student is None:
             flash("Student not found", "danger")
             return render_template("dashboard/view_all_students.html")
-        db.students.update_one({"_id": ObjectId(id)}, {"$set": {
+        db.students.update_one({"_id": ObjectId(id)}, stamp_feature_version({"$set": {
             "name": studentName,
             "ml_features.age": age,
             "ml_features.gender": gender,
@@ -61,7 +70,7 @@ def update_student(id):
             "ml_features.exam_score": exam_score,
             "ml_features.netflix_hours": netflix_hours,
             "ml_features.diet_quality": diet_quality
-        }})
+        }}))
         flash("Student data updated successfully", "success")
         return render_template("dashboard/view_all_students.html")
 
@@ -71,7 +80,10 @@ def update_student(id):
 @role_required(["admin", "analyst", "teacher"])
 def students_prediction_dashboard():
     models = get_classification_models_summary()
-    return render_template("dashboard/students_prediction.html", models=models)
+    expire_stale_jobs(db)
+    active_job = db[JOBS_COLLECTION].find_one({'status': {'$in': ACTIVE_STATUSES}}, {'_id': 1})
+    return render_template("dashboard/students_prediction.html", models=models,
+                           active_job_id=str(active_job['_id']) if active_job else None)
 
 
 @teacher_bp.route("/predict-all-students", methods=["POST"])
@@ -95,52 +107,75 @@ def predict_all_students():
 
         model_name = model_document.get('dataset', 'Unknown Dataset')
 
-        all_students = list(db.students.find({}))
-        
-        for student_data in all_students:
+        explanation = data.get('explanation') or Config.BULK_EXPLANATION_LEVEL
+        if explanation not in EXPLANATION_LEVELS:
+            return jsonify({"status": "error", "message": f"Explanation must be one of {EXPLANATION_LEVELS}."}), 400
 
-            if 'ml_features' not in student_data or not student_data['ml_features']:
-                logger.warning(f"Skipping student {student_data.get('studentID')} due to missing ml_features.")
-                continue
+        expire_stale_jobs(db)
+        active_job = db[JOBS_COLLECTION].find_one({'status': {'$in': ACTIVE_STATUSES}})
+        if active_job:
+            return jsonify({
+                "status": "info",
+                "message": "A bulk prediction job is already running.",
+                "job_id": str(active_job['_id'])
+            }), 409
 
-            dob = student_data.get('dateOfBirth')
-            age = None
-            if dob and isinstance(dob, datetime):
-                today = datetime.now(timezone.utc)
-                age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+        job_id = create_prediction_job(db, model_path, model_name, session.get('user_id'),
+                                       dataset_name=model_document.get('dataset'),
+                                       inference_backend=inference_backend_for(model_document, model_path),
+                                       stale_only=bool(data.get('stale_only')),
+                                       explanation=explanation)
+        try:
+            enqueue_prediction_job(db, job_id)
+        except Exception as e:
+            logger.error(f"Failed to enqueue prediction job {job_id}: {e}", exc_info=True)
+            db[JOBS_COLLECTION].update_one({'_id': ObjectId(job_id)}, {'$set': {'status': 'failed', 'error': str(e)}})
+            return jsonify({"status": "error", "message": "Could not queue the prediction job."}), 500
 
-            ml_features = student_data['ml_features'].copy()
-            if age is not None:
-                ml_features['age'] = age
-            
-            df_data = pd.DataFrame([ml_features])
-            
-            prediction_class, probabilities, recommendations = predict(
-                data=df_data,
-                model_name=model_path
-            )
-
-            db.students.update_one(
-                {"_id": student_data["_id"]},
-                {"$set": {
-                    "prediction": { 
-                        "class": int(prediction_class),
-                        "probability": float(probabilities[1]),
-                        "recommendations": recommendations,
-                        "model_used": model_name,
-                        "timestamp": datetime.now(timezone.utc)
-                    }
-                }}
-            )
-
-        logger.info(f"Predictions updated for all students using {model_name}.")
-
-        return jsonify({"status": "success", "message": f"Predictions updated for all students using {model_name}."}), 200
+        logger.info(f"Queued bulk prediction job {job_id} using {model_name}.")
+
+        return jsonify({"status": "success", "message": f"Prediction job queued using {model_name}.", "job_id": job_id}), 202
 
     except Exception as e:
         logger.error(f"Error during bulk prediction: {e}", exc_info=True)
         return jsonify({"status": "error", "message": "An internal server error occurred."}), 500
 
+@teacher_bp.route("/api/prediction-jobs/<job_id>", methods=["GET"])
+@login_required
+@role_required(["admin", "analyst"])
+def prediction_job_status(job_id):
+    expire_stale_jobs(db)
+    job = get_prediction_job(db, job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+    return jsonify({"status": "success", "job": job_to_dict(job)}), 200
+
+@teacher_bp.route("/api/prediction-jobs/<job_id>/cancel", methods=["POST"])
+@login_required
+@role_required(["admin", "analyst"])
+def cancel_prediction_job(job_id):
+    if get_prediction_job(db, job_id) is None:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+    if not request_cancel(db, job_id):
+        return jsonify({"status": "error", "message": "Job is not running."}), 409
+    return jsonify({"status": "success", "message": "Cancellation requested."}), 200
+
+@teacher_bp.route("/api/prediction-jobs/<job_id>/resume", methods=["POST"])
+@login_required
+@role_required(["admin", "analyst"])
+def resume_prediction_job(job_id):
+    if get_prediction_job(db, job_id) is None:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+    if not requeue_job(db, job_id):
+        return jsonify({"status": "error", "message": "Only failed or cancelled jobs can be resumed."}), 409
+    try:
+        enqueue_prediction_job(db, job_id)
+    except Exception as e:
+        logger.error(f"Failed to enqueue prediction job {job_id}: {e}", exc_info=True)
+        db[JOBS_COLLECTION].update_one({'_id': ObjectId(job_id)}, {'$set': {'status': 'failed', 'error': str(e)}})
+        return jsonify({"status": "error", "message": "Could not queue the prediction job."}), 500
+    return jsonify({"status": "success", "message": "Prediction job resumed.", "job_id": job_id}), 202
+
 @teacher_bp.route("/api/get-all-predictions", methods=["GET"])
 @login_required
 @role_required(["admin", "analyst"])
@@ -164,7 +199,9 @@ def get_all_predictions():
                 "student_id": student.get("studentID", "N/A"),
                 "prediction_class": student["prediction"]["class"],
                 "prediction_probability": student["prediction"]["probability"],
-                "recommendations": student["prediction"]["recommendations"],
+                "recommendations": student["prediction"].get("recommendations"),
+                "explanation": student["prediction"].get("explanation", "exact"),
+                "student_oid": student["_id"],
                 "prediction_timestamp": student["prediction"]["timestamp"].isoformat(), # Convert to string
                 "model_used": student["prediction"]["model_used"]
             })
@@ -173,4 +210,53 @@ def get_all_predictions():
 
     except Exception as e:
         print(f"Error fetching all predictions: {e}")
-        return jsonify({"status": "error", "message": str(e)}), 500
\ No newline at end of file
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+@teacher_bp.route("/api/students/<student_id>/explanation", methods=["GET"])
+@login_required
+@role_required(["admin", "analyst", "teacher"])
+def student_explanation(student_id):
+    """
+    Top feature contributions behind a student's stored prediction. Bulk runs
+    may skip or approximate SHAP, so the exact explanation is computed the first
+    time a student's details are opened and saved on the prediction.
+    """
+    if not ObjectId.is_valid(student_id):
+        return jsonify({"status": "error", "message": "Invalid student id."}), 400
+    student = db.students.find_one(
+        {"_id": ObjectId(student_id)},
+        {"ml_features": 1, "dateOfBirth": 1, "prediction": 1, FEATURE_VERSION_FIELD: 1}
+    )
+    if student is None or not student.get("prediction"):
+        return jsonify({"status": "error", "message": "No prediction stored for this student."}), 404
+
+    prediction = student["prediction"]
+    if prediction.get("top_contributions") is not None:
+        return jsonify({"status": "success", "top_contributions": prediction["top_contributions"],
+                        "recommendations": prediction.get("recommendations")}), 200
+
+    model_path = prediction.get("model_path")
+    if not model_path:
+        return jsonify({"status": "error", "message": "Prediction predates explanation support; re-run predictions."}), 409
+
+    try:
+        df_data = build_feature_frame([student])
+        model_document = db.trained_models.find_one({'details.model_path': model_path}, {'dataset': 1})
+        if model_document and model_document.get('dataset'):
+            df_data = impute_missing_fields(df_data, model_document['dataset'])
+        explanation = explain_batch(df_data, model_path)[0]
+    except Exception as e:
+        logger.error(f"Failed to explain prediction for student {student_id}: {e}", exc_info=True)
+        return jsonify({"status": "error", "message": "Could not compute the explanation."}), 500
+
+    # Only store it if the prediction was computed from the student's current features.
+    db.students.update_one(
+        {"_id": student["_id"], "prediction.feature_version": student.get(FEATURE_VERSION_FIELD, 0)},
+        {"$set": {
+            "prediction.top_contributions": explanation["top_contributions"],
+            "prediction.recommendations": explanation["recommendations"],
+            "prediction.explanation": "exact"
+        }}
+    )
+    return jsonify({"status": "success", **explanation}), 200
\ No newline at end of file
@@ -1,4 +1,3 @@
-from celery import Celery
 from flask import current_app
 import pandas as pd
 import os
@@ -7,12 +6,13 @@ from datetime import datetime, timezone
 from bson.objectid import ObjectId
 import numpy as np
 
+from app import celery_app
 from app.ml.dataset_manager import load_and_prepare_student_data
+from app.ml.feature_versions import stamp_feature_version
 from app.ml.trainer import train_dropout_models
 
 logger = logging.getLogger(__name__)
 
-celery_app = Celery('edflow_tasks')
 
 @celery_app.task(bind=True)
 def process_uploaded_data_and_train_model(self, file_path, model_name, user_id_str, is_paid):
@@ -110,7 +110,7 @@ def process_uploaded_data_and_train_model(self, file_path, model_name, user_id_s
             try:
                 result = students_col.update_one(
                     {'student_id': student_doc['student_id']},
-                    {'$set': student_doc},
+                    stamp_feature_version({'$set': student_doc}),
                     upsert=True
                 )
                 ingested_count += 1
@@ -0,0 +1,41 @@
+import json
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CSV_MIMETYPES = ['text/csv', 'application/csv']
+NDJSON_MIMETYPES = ['application/x-ndjson', 'application/ndjson', 'application/jsonl']
+
+
+def iter_csv_chunks(stream, chunk_size: int):
+    """Reads a CSV body incrementally, yielding DataFrames of at most `chunk_size` rows."""
+    for chunk in pd.read_csv(stream, chunksize=chunk_size):
+        yield chunk.reset_index(drop=True)
+
+
+def iter_ndjson_chunks(stream, chunk_size: int):
+    """Reads a newline-delimited JSON body line by line, yielding DataFrames of at most `chunk_size` rows."""
+    rows = []
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rows.append(json.loads(line))
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON on line {line_number}: {e}") from e
+        if len(rows) >= chunk_size:
+            yield pd.DataFrame.from_records(rows)
+            rows = []
+    if rows:
+        yield pd.DataFrame.from_records(rows)
+
+
+def iter_batch_chunks(stream, mimetype: str, chunk_size: int):
+    """Picks the reader for the request body's content type; returns None for unsupported types."""
+    if mimetype in CSV_MIMETYPES:
+        return iter_csv_chunks(stream, chunk_size)
+    if mimetype in NDJSON_MIMETYPES:
+        return iter_ndjson_chunks(stream, chunk_size)
+    return None
@@ -66,6 +66,7 @@ def save_dataset_to_mongodb(df, dataset_name, user_id, is_paid):
         logger.info(f"Dataset '{dataset_name}' inserted into MongoDB.")
     except Exception as e:
         logger.error(f"Failed to save dataset to MongoDB: {e}")
+        raise
 
 def get_dataset_by_model(model_name, limit=5000):
     return find_many("datasets", {"model_name": model_name}, limit=limit)
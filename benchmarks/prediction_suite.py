@@ -0,0 +1,333 @@
+# benchmarks/prediction_suite.py
+"""
+Offline prediction micro-benchmarks on synthetic data and locally trained models.
+
+    python -m benchmarks.prediction_suite [--sizes 1000 10000 100000] [--output results.json]
+    python -m benchmarks.prediction_suite --baseline old.json --output new.json
+
+Cases:
+  predict_single         predictors.predict latency for one row
+  predict_missing_fields latency of imputing one partially filled row
+  explain                SHAP + recommendation step on precomputed feature matrices
+  bulk_scoring           bulk_scoring throughput at each --sizes value
+
+Every case reports wall time per phase (read, load, transform, predict,
+explain, write). Results are written as JSON so runs on different commits can
+be compared with --baseline.
+
+Models are trained into a temporary working directory, so the repository's
+app/ml/models is never touched. MongoDB is not needed. With --mongo-uri,
+bulk scoring also inserts the synthetic students into that server's
+--mongo-db database and measures the real bulk_write. Without it, the write
+phase is reported as null.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_NAME = 'benchmark'
+MODEL_NAMES = ['random_forest', 'gradient_boosting', 'logistic_regression']
+
+
+def prepare_environment(work_dir: str):
+    """
+    The ML modules resolve app/ml/models relative to the working directory at
+    import time and bind `mongo.db` on import, so both must be in place before
+    anything under `app` is imported.
+    """
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(REPO_ROOT, '.env'))
+    os.environ.setdefault('HDFS_URL', 'http://localhost:50070')
+
+    os.makedirs(os.path.join(work_dir, 'app', 'ml', 'models'), exist_ok=True)
+    os.chdir(work_dir)
+    sys.path.insert(0, REPO_ROOT)
+
+    from pymongo import MongoClient
+    import app
+    # A lazily connecting client: nothing in these benchmarks talks to it.
+    app.mongo.client = MongoClient(os.getenv('MONGO_URI') or 'mongodb://localhost:27017', connect=False)
+    app.mongo.db = app.mongo.client[os.getenv('DB_NAME') or 'edflow']
+
+
+def _latency_summary(seconds: list) -> dict:
+    ms = np.asarray(seconds) * 1000
+    return {
+        'p50': round(float(np.percentile(ms, 50)), 3),
+        'p95': round(float(np.percentile(ms, 95)), 3),
+        'mean': round(float(ms.mean()), 3)
+    }
+
+
+def _per_call(phases: dict, calls: int) -> dict:
+    return {name: round(seconds / calls * 1000, 3) for name, seconds in phases.items()}
+
+
+def train_models(n_rows: int) -> dict:
+    """Trains the dropout classifiers and regression imputers exactly as an upload does; returns model paths."""
+    from app.ml.trainer import train_dropout_models, train_regression_models
+    from benchmarks.synthetic import student_frame
+
+    df = student_frame(n_rows, seed=0)
+    started = time.perf_counter()
+    results = train_dropout_models(df, DATASET_NAME)
+    train_regression_models(df, DATASET_NAME)
+    print(f"Trained models on {n_rows} rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return {detail['model_name']: detail['model_path'] for detail in results}
+
+
+def bench_predict_single(model_paths: dict, repeats: int) -> list:
+    from app.ml.predictors import predict
+    from app.ml.profiling import PhaseTimer
+    from benchmarks.synthetic import student_frame
+
+    rows = student_frame(repeats, seed=1).drop(columns=['student_id', 'dropout'])
+    results = []
+    for name, model_path in model_paths.items():
+        predict(rows.iloc[:1], model_path)  # first call loads artifacts; measured separately by load_cold
+        timer = PhaseTimer()
+        latencies = []
+        for i in range(repeats):
+            started = time.perf_counter()
+            predict(rows.iloc[i:i + 1], model_path, timer=timer)
+            latencies.append(time.perf_counter() - started)
+        results.append({
+            'case': 'predict_single', 'model': name, 'explanation': 'exact', 'calls': repeats,
+            'latency_ms': _latency_summary(latencies),
+            'phase_ms_per_call': _per_call(timer.as_dict(), repeats)
+        })
+    return results
+
+
+def bench_load_cold(model_paths: dict) -> list:
+    """Time to get every artifact of a model from disk into the cache, as the first request after a deploy pays it."""
+    from app.ml.artifact_cache import artifact_cache
+    from app.ml.dataset_manager import PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH, load_preprocessor
+    from app.ml.explainers import load_explainer
+    from app.ml.tree_arrays import load_serving_model
+
+    results = []
+    for name, model_path in model_paths.items():
+        artifact_cache.clear()
+        started = time.perf_counter()
+        load_preprocessor(PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH)
+        load_serving_model(model_path)
+        load_explainer(model_path)
+        results.append({
+            'case': 'load_cold', 'model': name,
+            'phase_ms_per_call': {'load': round((time.perf_counter() - started) * 1000, 3)}
+        })
+    return results
+
+
+def bench_predict_missing_fields(repeats: int) -> list:
+    from app.ml.predictors import predict_missing_fields
+    from app.ml.profiling import PhaseTimer
+    from benchmarks.synthetic import student_frame, with_missing_values
+
+    rows = with_missing_values(student_frame(repeats, seed=2), rate=0.3, seed=2)
+    rows = rows.drop(columns=['student_id', 'dropout']).astype(object).where(rows.notna(), None)
+    records = rows.to_dict(orient='records')
+    predict_missing_fields(records[0], DATASET_NAME)
+
+    timer = PhaseTimer()
+    latencies = []
+    for record in records:
+        started = time.perf_counter()
+        with timer.phase('transform'):
+            predict_missing_fields(record, DATASET_NAME)
+        latencies.append(time.perf_counter() - started)
+    return [{
+        'case': 'predict_missing_fields', 'calls': repeats,
+        'latency_ms': _latency_summary(latencies),
+        'phase_ms_per_call': _per_call(timer.as_dict(), repeats)
+    }]
+
+
+def bench_explain(model_paths: dict, batch_sizes: list) -> list:
+    from app.ml.dataset_manager import (PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH,
+                                        align_to_preprocessor, load_preprocessor)
+    from app.ml.explainers import load_explainer, positive_class_contributions
+    from app.ml.predictors import generate_batch_recommendations
+    from benchmarks.synthetic import student_frame
+
+    preprocessor, feature_names = load_preprocessor(PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH)
+    rows = student_frame(max(batch_sizes), seed=3).drop(columns=['student_id', 'dropout'])
+    X = preprocessor.transform(align_to_preprocessor(rows, preprocessor))
+
+    results = []
+    for name, model_path in model_paths.items():
+        explainer = load_explainer(model_path)
+        for level in ['approximate', 'exact']:
+            for batch_size in batch_sizes:
+                started = time.perf_counter()
+                contributions = positive_class_contributions(explainer, X[:batch_size], approximate=level == 'approximate')
+                shap_seconds = time.perf_counter() - started
+                started = time.perf_counter()
+                generate_batch_recommendations(contributions, feature_names)
+                recommendation_seconds = time.perf_counter() - started
+                results.append({
+                    'case': 'explain', 'model': name, 'explanation': level, 'rows': batch_size,
+                    'rows_per_second': round(batch_size / (shap_seconds + recommendation_seconds), 1),
+                    'phase_ms_per_call': {'explain': round((shap_seconds + recommendation_seconds) * 1000, 3)},
+                    'shap_ms': round(shap_seconds * 1000, 3),
+                    'recommendations_ms': round(recommendation_seconds * 1000, 3)
+                })
+    return results
+
+
+def bench_bulk(model_paths: dict, sizes: list, explanation: str, chunk_size: int, mongo_db=None) -> list:
+    from app.ml.bulk_scoring import build_feature_frame, score_chunk, score_students
+    from app.ml.profiling import PhaseTimer
+    from benchmarks.synthetic import student_documents, student_frame, with_missing_values
+
+    results = []
+    for size in sizes:
+        students = student_documents(with_missing_values(student_frame(size, seed=4), rate=0.1, seed=4))
+        if mongo_db is not None:
+            mongo_db.students.drop()
+            mongo_db.students.insert_many(students)
+
+        for name, model_path in model_paths.items():
+            started = time.perf_counter()
+            if mongo_db is not None:
+                summary = score_students(mongo_db, model_path, name, chunk_size=chunk_size,
+                                         dataset_name=DATASET_NAME, explanation=explanation)
+                phases = summary['phases']
+            else:
+                timer = PhaseTimer()
+                for start in range(0, size, chunk_size):
+                    with timer.phase('transform'):
+                        rows = build_feature_frame(students[start:start + chunk_size])
+                    score_chunk(rows, model_path, name, DATASET_NAME, explanation=explanation, timer=timer)
+                phases = timer.as_dict()
+                phases['write'] = None
+            seconds = time.perf_counter() - started
+            results.append({
+                'case': 'bulk_scoring', 'model': name, 'explanation': explanation, 'rows': size,
+                'chunk_size': chunk_size, 'seconds': round(seconds, 3),
+                'rows_per_second': round(size / seconds, 1),
+                'phase_seconds': phases
+            })
+            print(f"bulk {name} {size} rows: {size / seconds:,.0f} rows/s", file=sys.stderr)
+    return results
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _metadata(args) -> dict:
+    import pandas as pd
+    import shap
+    import sklearn
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'packages': {'numpy': np.__version__, 'pandas': pd.__version__,
+                     'scikit-learn': sklearn.__version__, 'shap': shap.__version__},
+        'args': {key: value for key, value in vars(args).items() if key not in ('baseline', 'output', 'mongo_uri')}
+    }
+
+
+def _result_key(result: dict) -> tuple:
+    return (result['case'], result.get('model'), result.get('explanation'), result.get('rows'))
+
+
+def compare(baseline: dict, current: dict):
+    """Prints the relative change of each case's headline number against a previous run."""
+    previous = {_result_key(result): result for result in baseline['results']}
+    print(f"Compared with {baseline['meta'].get('git_commit')} ({baseline['meta'].get('timestamp')})")
+    for result in current['results']:
+        old = previous.get(_result_key(result))
+        if old is None:
+            continue
+        if 'latency_ms' in result:
+            metric, new_value, old_value, better = 'p50 ms', result['latency_ms']['p50'], old['latency_ms']['p50'], 'lower'
+        elif 'rows_per_second' in result:
+            metric, new_value, old_value, better = 'rows/s', result['rows_per_second'], old['rows_per_second'], 'higher'
+        else:
+            metric = 'load ms'
+            new_value, old_value, better = result['phase_ms_per_call']['load'], old['phase_ms_per_call']['load'], 'lower'
+        change = (new_value - old_value) / old_value * 100 if old_value else float('nan')
+        label = ' '.join(str(part) for part in _result_key(result) if part is not None)
+        print(f"  {label:<55} {metric:<7} {old_value:>12,.3f} -> {new_value:>12,.3f}  ({change:+.1f}%, {better} is better)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--train-rows', type=int, default=5000, help='rows used to train the models')
+    parser.add_argument('--repeats', type=int, default=200, help='calls per single-row case')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='bulk scoring sizes')
+    parser.add_argument('--bulk-explanation', default='approximate', choices=['none', 'approximate', 'exact'])
+    parser.add_argument('--explain-sizes', type=int, nargs='+', default=[1, 100, 1000])
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--models', nargs='+', default=MODEL_NAMES, choices=MODEL_NAMES)
+    parser.add_argument('--with-prediction-cache', action='store_true',
+                        help='keep the prediction result cache on (off by default so every call does the work)')
+    parser.add_argument('--mongo-uri', help='MongoDB to measure bulk writes against')
+    parser.add_argument('--mongo-db', default='edflow_benchmark', help='scratch database used with --mongo-uri')
+    parser.add_argument('--output', default=os.path.join(REPO_ROOT, 'benchmark-results.json'))
+    parser.add_argument('--baseline', help='previous results file to compare with')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    with tempfile.TemporaryDirectory(prefix='edflow-bench-') as work_dir:
+        prepare_environment(work_dir)
+        from flask import Flask
+        from app.ml.prediction_cache import prediction_cache
+
+        if not args.with_prediction_cache:
+            prediction_cache.max_entries = 0
+
+        flask_app = Flask('benchmarks')
+        flask_app.config.from_object('config.Config')
+        flask_app.config['MODEL_DIR'] = os.path.join(work_dir, 'app', 'ml', 'models')
+
+        mongo_db = None
+        if args.mongo_uri:
+            from pymongo import MongoClient
+            mongo_db = MongoClient(args.mongo_uri)[args.mongo_db]
+
+        with flask_app.app_context():
+            model_paths = {name: path for name, path in train_models(args.train_rows).items() if name in args.models}
+            results = []
+            results += bench_load_cold(model_paths)
+            results += bench_predict_single(model_paths, args.repeats)
+            results += bench_predict_missing_fields(args.repeats)
+            results += bench_explain(model_paths, args.explain_sizes)
+            results += bench_bulk(model_paths, args.sizes, args.bulk_explanation, args.chunk_size, mongo_db)
+
+        if mongo_db is not None:
+            mongo_db.students.drop()
+
+    report = {'meta': _metadata(args), 'results': results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {output}", file=sys.stderr)
+
+    if baseline:
+        with open(baseline) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# benchmarks/synthetic.py
+"""Synthetic student data with the columns the upload route and trainer expect."""
+
+import numpy as np
+import pandas as pd
+from bson.objectid import ObjectId
+
+from app.ml.dataset_manager import NUMERICAL_FEATURES, TARGET_FEATURE
+
+
+def student_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """A training-ready frame with every REQUIRED_COLUMNS column and a dropout label loosely tied to the features."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'student_id': [f"S{seed}-{i}" for i in range(n_rows)],
+        'age': rng.integers(17, 30, n_rows).astype(float),
+        'study_hours': rng.uniform(0, 8, n_rows),
+        'social_media_hours': rng.uniform(0, 6, n_rows),
+        'netflix_hours': rng.uniform(0, 5, n_rows),
+        'attendance': rng.uniform(50, 100, n_rows),
+        'sleep_hours': rng.uniform(4, 9, n_rows),
+        'mental_health_score': rng.integers(1, 11, n_rows).astype(float),
+        'exam_score': rng.uniform(30, 100, n_rows),
+        'highSchoolGPA': rng.uniform(1.5, 4, n_rows),
+        'currentGPA': rng.uniform(1, 4, n_rows),
+        'gender': rng.choice(['Male', 'Female', 'Other'], n_rows),
+        'diet_quality': rng.choice(['Poor', 'Fair', 'Good'], n_rows),
+        'exercise_frequency': rng.integers(0, 7, n_rows).astype(str),
+        'parental_education': rng.choice(['High School', 'Bachelor', 'Master', 'None'], n_rows),
+        'internet_quality': rng.choice(['Poor', 'Average', 'Good'], n_rows),
+        'part_time_job': rng.choice(['Yes', 'No'], n_rows),
+        'extracurricular_activities': rng.choice(['Yes', 'No'], n_rows)
+    })
+    logit = (-1.5 * (df['currentGPA'] - 2.5) - 0.05 * (df['attendance'] - 75)
+             + 0.3 * (df['social_media_hours'] - 3) + rng.normal(0, 1, n_rows))
+    df[TARGET_FEATURE] = (logit > 0).astype(int)
+    return df
+
+
+def with_missing_values(df: pd.DataFrame, rate: float, seed: int = 0) -> pd.DataFrame:
+    """Blanks a `rate` fraction of the numeric feature cells, as imputation sees them in practice."""
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    for col in NUMERICAL_FEATURES:
+        df.loc[rng.random(len(df)) < rate, col] = np.nan
+    return df
+
+
+def student_documents(df: pd.DataFrame) -> list:
+    """Student documents shaped like the `students` collection, with features under `ml_features`."""
+    features = df.drop(columns=['student_id', TARGET_FEATURE], errors='ignore')
+    features = features.astype(object).where(features.notna(), None)
+    return [
+        {'_id': ObjectId(), 'student_id': student_id, 'ml_features': row}
+        for student_id, row in zip(df['student_id'], features.to_dict(orient='records'))
+    ]
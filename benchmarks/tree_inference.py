@@ -0,0 +1,105 @@
+# benchmarks/tree_inference.py
+"""
+Compares the compiled tree-array backend with sklearn predict_proba.
+
+    python -m benchmarks.tree_inference [--rows 5000] [--features 34] [--repeats 200] [--json]
+
+Trains the same RandomForest / GradientBoosting configurations as
+trainer.train_dropout_models on synthetic data, exports their tree arrays and
+reports single-row latency, batch throughput and the largest probability
+difference between the two backends.
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+
+from app.ml.tree_arrays import TreeArrayModel, export_tree_arrays
+
+BATCH_SIZES = [1000, 10000]
+
+
+def _synthetic_data(n_rows: int, n_features: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n_rows, n_features))
+    logits = X[:, 0] - 0.5 * X[:, 1] + 0.25 * X[:, 2] * X[:, 3]
+    y = (logits + rng.normal(size=n_rows) > 0).astype(int)
+    return X, y
+
+
+def _median_seconds(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def benchmark_model(name: str, model, X_eval, repeats: int, work_dir: str) -> dict:
+    arrays_dir = export_tree_arrays(model, f"{work_dir}/dropout_{name}.pkl")
+    compiled = TreeArrayModel.load(arrays_dir)
+    single_row = X_eval[:1]
+
+    result = {
+        'model': name,
+        'n_trees': compiled.meta['n_trees'],
+        'max_depth': compiled.meta['max_depth'],
+        'max_abs_diff': float(np.abs(compiled.predict_proba(X_eval) - model.predict_proba(X_eval)).max()),
+        'single_row_ms': {
+            'sklearn': _median_seconds(lambda: model.predict_proba(single_row), repeats) * 1000,
+            'compiled': _median_seconds(lambda: compiled.predict_proba(single_row), repeats) * 1000
+        },
+        'rows_per_second': {}
+    }
+    for batch_size in BATCH_SIZES:
+        batch = np.resize(X_eval, (batch_size, X_eval.shape[1]))
+        result['rows_per_second'][batch_size] = {
+            'sklearn': batch_size / _median_seconds(lambda: model.predict_proba(batch), 3),
+            'compiled': batch_size / _median_seconds(lambda: compiled.predict_proba(batch), 3)
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=5000, help='training rows')
+    parser.add_argument('--features', type=int, default=34, help='features after preprocessing')
+    parser.add_argument('--repeats', type=int, default=200, help='single-row calls per backend')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    X, y = _synthetic_data(args.rows, args.features)
+    X_eval, _ = _synthetic_data(2000, args.features, seed=1)
+    models = {
+        'random_forest': RandomForestClassifier(class_weight='balanced', random_state=42),
+        'gradient_boosting': GradientBoostingClassifier()
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, model in models.items():
+            model.fit(X, y)
+            results.append(benchmark_model(name, model, X_eval, args.repeats, work_dir))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for result in results:
+        single = result['single_row_ms']
+        print(f"{result['model']}: {result['n_trees']} trees, depth {result['max_depth']}, "
+              f"max |diff| {result['max_abs_diff']:.1e}")
+        print(f"  single row   sklearn {single['sklearn']:.3f} ms   compiled {single['compiled']:.3f} ms   "
+              f"({single['sklearn'] / single['compiled']:.1f}x)")
+        for batch_size, rates in result['rows_per_second'].items():
+            print(f"  batch {batch_size:<6} sklearn {rates['sklearn']:,.0f} rows/s   compiled {rates['compiled']:,.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
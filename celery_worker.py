@@ -0,0 +1,15 @@
+# Entry point for Celery workers:
+#   celery -A celery_worker.celery_app worker --loglevel=info
+from celery.signals import worker_process_init
+
+from app import celery_app, create_app
+
+flask_app = create_app(warm_up_models=False)
+
+
+@worker_process_init.connect
+def warm_up_worker_process(**kwargs):
+    # Runs in every pool process after the fork; warm-up continues in a thread
+    # so the process reports itself alive within Celery's startup timeout.
+    from app.ml.warmup import start_warm_up
+    start_warm_up(flask_app)
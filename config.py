@@ -31,8 +31,82 @@ class Config:
     HDFS_USER = os.getenv("HDFS_USER")
 
     MODEL_DIR = os.path.join(os.getcwd(), "app", "ml", "models")
+    MODEL_CACHE_MAX_BYTES = int(os.getenv('MODEL_CACHE_MAX_MB', 512)) * 1024 * 1024
+    # Memory-map served model arrays so gunicorn workers share one copy; set to '' to load private copies
+    MODEL_MMAP_MODE = os.getenv('MODEL_MMAP_MODE', 'r') or None
+    # 'compiled' evaluates exported tree arrays, 'sklearn' the pickled model; trained_models details can override per model
+    DEFAULT_INFERENCE_BACKEND = os.getenv('DEFAULT_INFERENCE_BACKEND', 'compiled')
+    COMPILED_INFERENCE_TOLERANCE = float(os.getenv('COMPILED_INFERENCE_TOLERANCE', 1e-6))
+    # zlib level (0-9) for saved models and preprocessors; memory-mapped artifacts are always written uncompressed
+    ARTIFACT_COMPRESSION = int(os.getenv('ARTIFACT_COMPRESSION', 3))
+    # Store compiled tree node values as float32 when that still reproduces sklearn within COMPILED_INFERENCE_TOLERANCE
+    ARTIFACT_FLOAT32_TREE_VALUES = os.getenv('ARTIFACT_FLOAT32_TREE_VALUES', 'true').lower() == 'true'
+    # Per-worker cache of prediction results; set either value to 0 to disable it
+    PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv('PREDICTION_CACHE_MAX_ENTRIES', 50000))
+    PREDICTION_CACHE_TTL_SECONDS = int(os.getenv('PREDICTION_CACHE_TTL_SECONDS', 3600))
+    # Explanation level ('none', 'approximate' or 'exact') used by bulk jobs and the batch API unless a request asks otherwise
+    BULK_EXPLANATION_LEVEL = os.getenv('BULK_EXPLANATION_LEVEL', 'approximate')
+    # 'background', 'blocking' or 'off': preload active models when a web or Celery worker process starts
+    MODEL_WARMUP = os.getenv('MODEL_WARMUP', 'background')
+    BULK_SCORING_CHUNK_SIZE = int(os.getenv('BULK_SCORING_CHUNK_SIZE', 2000))
+    BATCH_API_CHUNK_SIZE = int(os.getenv('BATCH_API_CHUNK_SIZE', 500))
+    # Background jobs: a worker refreshes its job's updated_at this often, and a queued or running job
+    # left untouched for JOB_STALE_AFTER_SECONDS lost its worker (crash, OOM kill, deploy) and counts as failed
+    JOB_HEARTBEAT_SECONDS = int(os.getenv('JOB_HEARTBEAT_SECONDS', 30))
+    JOB_STALE_AFTER_SECONDS = int(os.getenv('JOB_STALE_AFTER_SECONDS', 600))
+    # Classifiers fitted at the same time during training; 0 uses one per model up to the core count
+    TRAINING_WORKERS = int(os.getenv('TRAINING_WORKERS', 0))
+    # Upload-and-train pipeline: retries of a failed train/persist/notify stage and the wait between them
+    TRAINING_STAGE_MAX_RETRIES = int(os.getenv('TRAINING_STAGE_MAX_RETRIES', 2))
+    TRAINING_STAGE_RETRY_DELAY_SECONDS = int(os.getenv('TRAINING_STAGE_RETRY_DELAY_SECONDS', 30))
+    # Appending rows updates models in place until the rows appended since the last full training exceed this
+    # share of its rows, or the new rows drift: a numeric feature's batch mean moves more than the drift threshold
+    # (in training standard deviations) by more than INCREMENTAL_DRIFT_Z_SCORE standard errors of the batch mean,
+    # or more than INCREMENTAL_UNSEEN_CATEGORY_RATE of them, and at least INCREMENTAL_UNSEEN_CATEGORY_MIN_ROWS,
+    # hold a category unseen in training
+    INCREMENTAL_MAX_CHANGE_RATIO = float(os.getenv('INCREMENTAL_MAX_CHANGE_RATIO', 0.3))
+    INCREMENTAL_DRIFT_THRESHOLD = float(os.getenv('INCREMENTAL_DRIFT_THRESHOLD', 0.25))
+    INCREMENTAL_DRIFT_Z_SCORE = float(os.getenv('INCREMENTAL_DRIFT_Z_SCORE', 4.0))
+    INCREMENTAL_UNSEEN_CATEGORY_RATE = float(os.getenv('INCREMENTAL_UNSEEN_CATEGORY_RATE', 0.25))
+    INCREMENTAL_UNSEEN_CATEGORY_MIN_ROWS = int(os.getenv('INCREMENTAL_UNSEEN_CATEGORY_MIN_ROWS', 10))
+    INCREMENTAL_SGD_LEARNING_RATE = float(os.getenv('INCREMENTAL_SGD_LEARNING_RATE', 0.001))
+    # Optional successive-halving hyperparameter search before the final fit of each classifier.
+    # The budget is shared by all classifiers of a training run; CPU seconds count every search thread.
+    TUNING_ENABLED = os.getenv('TUNING_ENABLED', 'false').lower() == 'true'
+    TUNING_WALL_SECONDS = float(os.getenv('TUNING_WALL_SECONDS', 300))
+    TUNING_CPU_SECONDS = float(os.getenv('TUNING_CPU_SECONDS', 1200))
+    TUNING_CANDIDATES = int(os.getenv('TUNING_CANDIDATES', 27))
+    TUNING_FACTOR = int(os.getenv('TUNING_FACTOR', 3))
+    TUNING_CV_FOLDS = int(os.getenv('TUNING_CV_FOLDS', 3))
+    TUNING_N_JOBS = int(os.getenv('TUNING_N_JOBS', -1))
+    # Cores RandomForest uses to build its trees; -1 uses all of them
+    TRAINING_RF_N_JOBS = int(os.getenv('TRAINING_RF_N_JOBS', -1))
+    # Engine of the dropout gradient-boosting model: 'exact' (GradientBoostingClassifier), 'histogram'
+    # (multithreaded HistGradientBoostingClassifier with early stopping) or 'auto', which picks by training rows
+    BOOSTING_ENGINE = os.getenv('BOOSTING_ENGINE', 'auto')
+    HISTOGRAM_BOOSTING_MIN_ROWS = int(os.getenv('HISTOGRAM_BOOSTING_MIN_ROWS', 50000))
+    HISTOGRAM_BOOSTING_MAX_ITER = int(os.getenv('HISTOGRAM_BOOSTING_MAX_ITER', 500))
+    # Share of the training rows held out to stop boosting once the validation loss stops improving
+    HISTOGRAM_VALIDATION_FRACTION = float(os.getenv('HISTOGRAM_VALIDATION_FRACTION', 0.1))
+    HISTOGRAM_N_ITER_NO_CHANGE = int(os.getenv('HISTOGRAM_N_ITER_NO_CHANGE', 10))
+    # Reuse the preprocessed feature matrix of unchanged training data instead of refitting the preprocessor
+    FEATURE_CACHE_ENABLED = os.getenv('FEATURE_CACHE_ENABLED', 'true').lower() == 'true'
+    # Cached matrices kept per dataset and kind (dropout or regression); older ones are deleted
+    FEATURE_CACHE_KEEP = int(os.getenv('FEATURE_CACHE_KEEP', 2))
+    # Versioned Parquet copy of the students' ML features that training, anomaly detection and bulk scoring read
+    FEATURE_STORE_DIR = os.getenv('FEATURE_STORE_DIR', 'app/ml/feature_store')
+    # Feature store versions kept on disk; a training run can be reproduced from any of them
+    FEATURE_STORE_KEEP = int(os.getenv('FEATURE_STORE_KEEP', 5))
+    # Refreshes re-read students stamped up to this many seconds before the newest stamp already stored, so a write
+    # that commits after a later one, with an earlier $currentDate, is not skipped
+    FEATURE_STORE_WATERMARK_LAG_SECONDS = int(os.getenv('FEATURE_STORE_WATERMARK_LAG_SECONDS', 300))
+    # Student documents fetched per cursor round trip and flattened into columns at a time when loading for ML
+    STUDENT_LOAD_BATCH_SIZE = int(os.getenv('STUDENT_LOAD_BATCH_SIZE', 10000))
 
     CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL') or 'redis://localhost:6379/0'
+    # Celery only reads the old-style setting names next to the CELERY_* keys above
+    BROKER_URL = CELERY_BROKER_URL
+    CELERY_IMPORTS = ('app.ml.prediction_jobs', 'app.ml.training_jobs')
     CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND') or 'mongodb://localhost:27017/celery_results'
     CELERY_ACCEPT_CONTENT = ['json']
     CELERY_TASK_SERIALIZER = 'json'
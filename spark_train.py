@@ -0,0 +1,350 @@
+# spark_train.py
+#
+# Trains the dropout classifiers on the deduplicated student archive with Spark MLlib
+# and exports them as artifacts the prediction engine serves:
+#   spark-submit --master local[*] spark_train.py <data_path> <dataset_name>
+#   spark-submit --master yarn --deploy-mode client spark_train.py /user/hdfs/student_data.csv archive
+# The driver writes the artifacts under app/ml/models, so run it from the project
+# root of the serving host (client deploy mode on a cluster).
+
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+from pyspark.ml import Pipeline
+from pyspark.ml.classification import GBTClassifier, LogisticRegression, RandomForestClassifier
+from pyspark.ml.evaluation import BinaryClassificationEvaluator, MulticlassClassificationEvaluator
+from pyspark.ml.feature import Imputer, OneHotEncoder, StandardScaler, StringIndexer, VectorAssembler
+from pyspark.ml.functions import vector_to_array
+from pyspark.sql import SparkSession, functions as F
+
+from config import Config
+from app import create_app
+
+# The app modules bind the database on import, so the app is created before they are imported.
+flask_app = create_app(warm_up_models=False)
+
+from app.ml.artifact_cache import dump_artifact, manifest_entry  # noqa: E402
+from app.ml.dataset_manager import (BACKGROUND_DATA_PATH, CATEGORICAL_FEATURES, DROPOUT_BACKGROUND_FILE,  # noqa: E402
+                                    DROPOUT_FEATURES_FILE, DROPOUT_PREPROCESSOR_FILE, NUMERICAL_FEATURES,
+                                    PREPROCESSOR_PATH, PROCESSED_FEATURE_NAMES_PATH, TARGET_FEATURE,
+                                    dataset_artifact_path)
+from app.ml.profiling import ResourceMeter  # noqa: E402
+from app.ml.spark_export import (boosting_export, forest_export, linear_model, save_linear_model,  # noqa: E402
+                                 save_tree_model, serving_preprocessor)
+from app.ml.trainer import MODEL_DIR, run_resources, trained_models_collection  # noqa: E402
+from app.ml.tree_arrays import TreeArrayModel  # noqa: E402
+
+logger = logging.getLogger("spark_train")
+
+# Where spark_deduplicate.py keeps the deduplicated archive.
+DEFAULT_DATA_PATH = '/user/hdfs/student_data.csv'
+# Rows of test predictions the exported models are checked against Spark's on.
+CHECK_ROWS = 2000
+BACKGROUND_ROWS = 500
+SEED = 42
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the dropout classifiers with Spark MLlib.")
+    parser.add_argument("data_path", nargs="?", default=DEFAULT_DATA_PATH,
+                        help="Deduplicated student data, a CSV or Parquet file or directory (HDFS or local).")
+    parser.add_argument("dataset_name", nargs="?", default="student_archive",
+                        help="Dataset the models are saved and served under.")
+    parser.add_argument("--format", choices=["csv", "parquet"], default=None,
+                        help="Input format; guessed from the path when omitted.")
+    parser.add_argument("--master", default=None,
+                        help="Spark master; defaults to spark-submit's, or local[*] under plain python.")
+    parser.add_argument("--models", default="random_forest,logistic_regression,gradient_boosting",
+                        help="Comma-separated classifiers to train.")
+    parser.add_argument("--rf-trees", type=int, default=100)
+    parser.add_argument("--rf-max-depth", type=int, default=12)
+    parser.add_argument("--gbt-iterations", type=int, default=100)
+    parser.add_argument("--gbt-max-depth", type=int, default=3)
+    parser.add_argument("--paid", action="store_true", help="Mark the trained models as paid.")
+    parser.add_argument("--username", default="spark", help="Recorded as the run's trainer.")
+    parser.add_argument("--no-record", action="store_true",
+                        help="Export the artifacts without adding a run to trained_models.")
+    return parser.parse_args()
+
+
+def read_students(spark, path: str, data_format: str | None):
+    if data_format is None:
+        data_format = "parquet" if path.rstrip("/").endswith(".parquet") else "csv"
+    if data_format == "parquet":
+        return spark.read.parquet(path)
+    return spark.read.csv(path, header=True, inferSchema=True)
+
+
+def prepare(df, numerical: list, categorical: list, target: str):
+    """
+    The feature columns cast the way the pandas trainer sees them: numerics as
+    doubles, categoricals as strings with missing values as 'missing', and the
+    dropout label as 1.0 / 0.0. Rows without a label are dropped.
+    """
+    missing = [col for col in numerical + categorical + [target] if col not in df.columns]
+    if missing:
+        raise ValueError(f"Dataset is missing required columns: {', '.join(missing)}")
+    label = F.lower(F.trim(F.col(target).cast("string")))
+    return df.where(F.col(target).isNotNull()).select(
+        *[F.col(col).cast("double").alias(col) for col in numerical],
+        *[F.coalesce(F.col(col).cast("string"), F.lit("missing")).alias(col) for col in categorical],
+        F.when(label.isin("yes", "true", "1", "1.0"), 1.0).otherwise(0.0).alias("label")
+    )
+
+
+def preprocessing_pipeline(numerical: list, categorical: list) -> Pipeline:
+    """
+    Mean imputation and standardization of the numeric columns and one-hot
+    encoding of the categorical ones, in the column order of build_preprocessor.
+    Categories are indexed alphabetically, as OneHotEncoder orders them, and
+    unseen ones encode as all zeros.
+    """
+    imputed = [f"{col}__imputed" for col in numerical]
+    indexed = [f"{col}__index" for col in categorical]
+    encoded = [f"{col}__onehot" for col in categorical]
+    return Pipeline(stages=[
+        Imputer(strategy="mean", inputCols=numerical, outputCols=imputed),
+        VectorAssembler(inputCols=imputed, outputCol="numeric"),
+        StandardScaler(inputCol="numeric", outputCol="numeric_scaled", withMean=True, withStd=True),
+        StringIndexer(inputCols=categorical, outputCols=indexed, stringOrderType="alphabetAsc", handleInvalid="keep"),
+        # The extra 'unseen' index is the dropped last column.
+        OneHotEncoder(inputCols=indexed, outputCols=encoded, dropLast=True),
+        VectorAssembler(inputCols=["numeric_scaled"] + encoded, outputCol="features")
+    ])
+
+
+def classifiers(args, train_rows: int) -> dict:
+    """The MLlib counterparts of train_dropout_models' classifiers."""
+    return {
+        # class_weight='balanced' comes from the 'weight' column.
+        "random_forest": RandomForestClassifier(numTrees=args.rf_trees, maxDepth=args.rf_max_depth,
+                                                weightCol="weight", seed=SEED),
+        # sklearn's default C=1 over the training rows.
+        "logistic_regression": LogisticRegression(maxIter=1000, regParam=1.0 / max(train_rows, 1),
+                                                  elasticNetParam=0.0),
+        "gradient_boosting": GBTClassifier(maxIter=args.gbt_iterations, maxDepth=args.gbt_max_depth,
+                                           stepSize=0.1, seed=SEED)
+    }
+
+
+def balanced_weights(df):
+    """Adds the 'weight' column sklearn's class_weight='balanced' would give each row."""
+    counts = {row["label"]: row["count"] for row in df.groupBy("label").count().collect()}
+    total = sum(counts.values())
+    weights = {label: total / (len(counts) * count) for label, count in counts.items()}
+    weight = F.lit(1.0)
+    for label, value in weights.items():
+        weight = F.when(F.col("label") == label, value).otherwise(weight)
+    return df.withColumn("weight", weight)
+
+
+def evaluate(predictions) -> dict:
+    """Test metrics under the names classification_metrics uses."""
+    multiclass = MulticlassClassificationEvaluator(labelCol="label", predictionCol="prediction")
+    by_label = {multiclass.metricLabel: 1.0}
+    return {
+        "accuracy": multiclass.evaluate(predictions, {multiclass.metricName: "accuracy"}),
+        "precision": multiclass.evaluate(predictions, {multiclass.metricName: "precisionByLabel", **by_label}),
+        "recall": multiclass.evaluate(predictions, {multiclass.metricName: "recallByLabel", **by_label}),
+        "f1_score": multiclass.evaluate(predictions, {multiclass.metricName: "fMeasureByLabel", **by_label}),
+        "roc_auc": BinaryClassificationEvaluator(labelCol="label", rawPredictionCol="rawPrediction",
+                                                 metricName="areaUnderROC").evaluate(predictions)
+    }
+
+
+def node_table(spark, mllib_path: str):
+    """The node table of a saved tree ensemble as a pandas frame for spark_export."""
+    return spark.read.parquet(f"{mllib_path}/data").select(
+        "treeID", "nodeData.id", "nodeData.prediction", "nodeData.impurityStats",
+        "nodeData.leftChild", "nodeData.rightChild", "nodeData.split.featureIndex",
+        "nodeData.split.leftCategoriesOrThreshold", "nodeData.split.numCategories"
+    ).toPandas()
+
+
+def collect_features(df, n_rows: int, *columns) -> list:
+    """Up to `n_rows` rows of vector columns as numpy matrices."""
+    rows = df.select(*[vector_to_array(col).alias(col) for col in columns]).limit(n_rows).toPandas()
+    return [np.vstack(rows[col].to_numpy()) if len(rows) else np.empty((0, 0)) for col in columns]
+
+
+def export_preprocessing(prep_model, numerical: list, categorical: list, dataset_name: str):
+    """
+    Saves the fitted Spark preprocessing as the served preprocessor and feature
+    names, globally and for `dataset_name`; returns the names.
+    """
+    imputer, _, scaler, indexer = prep_model.stages[:4]
+    surrogates = imputer.surrogateDF.first()
+    preprocessor, feature_names = serving_preprocessor(
+        numerical, [float(surrogates[col]) for col in numerical],
+        scaler.mean.toArray(), scaler.std.toArray(),
+        categorical, [list(labels) for labels in indexer.labelsArray]
+    )
+    os.makedirs(os.path.join(MODEL_DIR, dataset_name), exist_ok=True)
+    dump_artifact(preprocessor, PREPROCESSOR_PATH)
+    dump_artifact(feature_names, PROCESSED_FEATURE_NAMES_PATH)
+    dump_artifact(preprocessor, dataset_artifact_path(dataset_name, DROPOUT_PREPROCESSOR_FILE))
+    dump_artifact(feature_names, dataset_artifact_path(dataset_name, DROPOUT_FEATURES_FILE))
+    return feature_names
+
+
+def export_classifier(spark, name: str, model, model_path: str, mllib_path: str, n_features: int, background):
+    """
+    Converts a fitted MLlib classifier with spark_export and saves it next to
+    its explainer. Returns (served model, artifact fields for its details).
+    """
+    if name == "logistic_regression":
+        served = linear_model(model.coefficients.toArray(), model.intercept)
+        explainer_path = save_linear_model(served, model_path, background)
+        return served, {"explainer_path": explainer_path, "arrays_path": None, "inference_backend": "sklearn"}
+
+    model.write().overwrite().save(mllib_path)
+    nodes = node_table(spark, mllib_path)
+    if name == "random_forest":
+        arrays, meta, explainer_model = forest_export(nodes, n_features)
+    else:
+        arrays, meta, explainer_model = boosting_export(nodes, list(model.treeWeights), n_features)
+    arrays_dir, explainer_path = save_tree_model(arrays, meta, explainer_model, model_path)
+    served = TreeArrayModel.load(arrays_dir, mmap_mode=None)
+    return served, {"explainer_path": explainer_path, "arrays_path": arrays_dir, "inference_backend": "compiled"}
+
+
+def train(spark, args) -> list:
+    numerical, categorical = list(NUMERICAL_FEATURES), list(CATEGORICAL_FEATURES)
+    df = prepare(read_students(spark, args.data_path, args.format), numerical, categorical, TARGET_FEATURE)
+
+    with ResourceMeter() as run_meter:
+        prep_model = preprocessing_pipeline(numerical, categorical).fit(df)
+        features = prep_model.transform(df).select("features", "label").cache()
+        train_df, test_df = features.randomSplit([0.8, 0.2], seed=SEED)
+        train_df = balanced_weights(train_df).cache()
+        train_rows = train_df.count()
+        rows = features.count()
+        logger.info(f"Training on {train_rows} of {rows} rows from {args.data_path}")
+
+        feature_names = export_preprocessing(prep_model, numerical, categorical, args.dataset_name)
+        background, = collect_features(train_df.orderBy(F.rand(SEED)), BACKGROUND_ROWS, "features")
+        dump_artifact(background, BACKGROUND_DATA_PATH)
+        dump_artifact(background, dataset_artifact_path(args.dataset_name, DROPOUT_BACKGROUND_FILE))
+
+        wanted = [name.strip() for name in args.models.split(",") if name.strip()]
+        estimators = classifiers(args, train_rows)
+        details = []
+        for name in wanted:
+            detail = train_classifier(spark, name, estimators[name], train_df, test_df, args.dataset_name,
+                                      train_rows, len(feature_names), background)
+            if detail is not None:
+                details.append(detail)
+    features.unpersist()
+    train_df.unpersist()
+
+    if details and not args.no_record:
+        trained_models_collection.insert_one({
+            "dataset": args.dataset_name,
+            "trained_by": {"userId": None, "username": args.username},
+            "created_at": datetime.now(timezone.utc),
+            "is_paid": args.paid,
+            "details": details,
+            "training_mode": "full",
+            "retrain_reason": None,
+            "rows_at_full_train": rows,
+            "rows_since_full_train": 0,
+            "tuning": None,
+            "resources": run_resources(run_meter, rows, details),
+            "spark": {
+                "master": spark.sparkContext.master,
+                "application_id": spark.sparkContext.applicationId,
+                "default_parallelism": spark.sparkContext.defaultParallelism,
+                "input": args.data_path
+            }
+        })
+        logger.info(f"Spark training results saved to DB for dataset: {args.dataset_name}")
+    return details
+
+
+def train_classifier(spark, name, estimator, train_df, test_df, dataset_name, train_rows, n_features,
+                     background) -> dict | None:
+    """
+    Fits, evaluates and exports one classifier; returns its details, or None
+    when it failed or its exported model does not reproduce Spark's probabilities.
+    """
+    try:
+        with ResourceMeter() as meter:
+            model = estimator.fit(train_df)
+        fit_seconds = meter.wall_seconds
+        predictions = model.transform(test_df).cache()
+        metrics = evaluate(predictions)
+
+        model_dir = os.path.join(MODEL_DIR, dataset_name, name)
+        os.makedirs(model_dir, exist_ok=True)
+        model_path = os.path.join(model_dir, f"{TARGET_FEATURE}_{name}.pkl").replace("\\", "/")
+        mllib_path = os.path.join(model_dir, "mllib")
+        served, artifacts = export_classifier(spark, name, model, model_path, mllib_path, n_features, background)
+
+        X_check, spark_proba = collect_features(predictions, CHECK_ROWS, "features", "probability")
+        predictions.unpersist()
+        max_abs_diff = float(np.abs(served.predict_proba(X_check)[:, 1] - spark_proba[:, 1]).max()) \
+            if len(X_check) else 0.0
+        if max_abs_diff > Config.COMPILED_INFERENCE_TOLERANCE:
+            logger.error(f"Exported {name} differs from Spark by {max_abs_diff:.2e}; not recording it.")
+            return None
+
+        artifact_paths = [model_path, artifacts["explainer_path"], artifacts["arrays_path"]]
+        entries = [(path, manifest_entry(path)) for path in artifact_paths if path]
+        entries = [(path, entry) for path, entry in entries if entry is not None]
+        logger.info(f"Trained {name} for {dataset_name} with Spark: fit {fit_seconds:.2f}s, "
+                    f"ROC AUC {metrics['roc_auc']:.4f}")
+        return {
+            "type": "classification",
+            "target": TARGET_FEATURE,
+            "model_name": name,
+            "metrics": metrics,
+            "model_path": model_path,
+            **artifacts,
+            "compiled_max_abs_diff": max_abs_diff,
+            "fit_seconds": round(fit_seconds, 3),
+            "estimator": f"pyspark.ml {type(model).__name__}",
+            "n_iter": None,
+            "trainer": "spark-mllib",
+            "mllib_path": None if name == "logistic_regression" else mllib_path,
+            "resources": {
+                # The driver's resources; executors do the fitting on a cluster.
+                **meter.as_dict(),
+                "rows": train_rows,
+                "features": n_features,
+                "artifact_bytes": sum(entry["bytes"] for _, entry in entries),
+                "load_seconds": round(sum(entry["load_seconds"] for _, entry in entries), 4),
+                "artifacts": [{"name": os.path.basename(path), "bytes": entry["bytes"],
+                               "load_seconds": entry["load_seconds"]} for path, entry in entries]
+            },
+            "tuning": None
+        }
+    except Exception as e:
+        logger.error(f"Failed to train {name} with Spark: {e}", exc_info=True)
+        return None
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    args = parse_args()
+    builder = SparkSession.builder.appName("StudentDropoutTraining")
+    if args.master:
+        builder = builder.master(args.master)
+    spark = builder.getOrCreate()
+    try:
+        with flask_app.app_context():
+            details = train(spark, args)
+    finally:
+        spark.stop()
+
+    if not details:
+        logger.error("No classifier could be trained with Spark.")
+        sys.exit(1)
+    logger.info(f"Trained {len(details)} classifiers for {args.dataset_name}.")
+
+
+if __name__ == "__main__":
+    main()